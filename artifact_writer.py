@@ -0,0 +1,239 @@
+"""
+artifact_writer.py
+
+Encodes and writes the per-frame output files of mmdet3d_inference2.py on
+a small thread pool, so the inference loop does not wait for PNG/PLY/JSON
+encoding or for the disk:
+
+  - a job is a path plus an encoder (a function returning the file's bytes)
+    with its arguments; encoding and writing both happen on a worker
+  - the bytes held by queued and running jobs are capped (--write-max-inflight-mb):
+    submit() blocks once the cap is reached, so a slow disk slows the loop
+    down instead of growing memory without bound
+  - files are written to a unique '<path>.<random>.part' next to the target
+    (created with the process umask, like a plain open()) and renamed, so
+    readers never see a half-written artifact, even when two jobs for the
+    same path overlap; --write-fsync also fsyncs each file.
+    remove_stale_parts() deletes the '.part' files a crashed run left for a
+    frame before it is written again
+  - small files (JSON, box / label PLYs) are grouped into one job per batch
+    (flushed at the end of every frame) instead of one pool task each
+  - jobs can carry a tag (the frame basename); done(tag) / wait(tag) tell
+    the caller when a frame is on disk, e.g. before journaling it, and
+    failed(tag) whether any of its files could not be written
+  - with an 'archive' (run_archive.ArchiveWriter, --archive) the files are
+    appended to the run's pack volumes instead of written one by one
+
+With workers=0 every job runs inline in submit(), which is the old
+synchronous behaviour.
+"""
+
+import os
+import glob
+import time
+import uuid
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+SMALL_FILE_BYTES = 64 * 1024
+
+
+def write_file(path, data, fsync=False):
+    """Writes 'data' to 'path' through a uniquely named temporary file and a rename."""
+    path = str(path)
+    part = f"{path}.{uuid.uuid4().hex}.part"
+    try:
+        with open(part, 'xb') as f:
+            f.write(data)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(part, path)
+    except BaseException:
+        if os.path.exists(part):
+            os.remove(part)
+        raise
+
+
+class ArtifactWriter:
+    """
+    Thread pool for encode-and-write jobs with bounded in-flight bytes.
+    Errors are reported as warnings, counted and remembered per tag (failed());
+    they never reach the caller.
+    """
+
+    def __init__(self, workers=2, max_inflight_mb=256, fsync=False, batch_kb=256, archive=None):
+        self.workers = workers
+        self.archive = archive
+        self.max_inflight = int(max_inflight_mb * 2**20)
+        self.fsync = fsync
+        self.batch_bytes = int(batch_kb * 1024)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='artifact-writer') \
+            if workers > 0 else None
+        self._cond = threading.Condition()
+        self._inflight = 0
+        self._batch = []
+        self._batch_size = 0
+        self._batch_done = None  # resolved when the open batch is written
+        self._tag_futures = {}
+        self._failed_tags = set()
+        self._start = time.perf_counter()
+        self.stats = {'files': 0, 'bytes': 0, 'errors': 0, 'jobs': 0, 'batched_files': 0,
+                      'encode_sec': 0.0, 'write_sec': 0.0, 'wait_sec': 0.0, 'peak_inflight_mb': 0.0}
+
+    def submit(self, path, encode, *args, size_hint=None, tag=None):
+        """
+        Queues 'encode(*args)' -> bytes to be written to 'path'. 'size_hint'
+        is the memory the job pins until it is written (its input arrays or
+        the encoded size); by default the size of a bytes-like first argument.
+        """
+        if size_hint is None:
+            size_hint = len(args[0]) if args and isinstance(args[0], (bytes, bytearray)) else SMALL_FILE_BYTES
+        job = (str(path), encode, args, tag)
+        if self._pool is None:
+            self._run([job])
+            return None
+        if size_hint < SMALL_FILE_BYTES and self.batch_bytes > 0:
+            self._batch.append(job)
+            self._batch_size += size_hint
+            future = self._batch_future()
+            if self._batch_size >= self.batch_bytes:
+                self.flush()
+        else:
+            future = self._dispatch([job], size_hint)
+        if tag is not None:
+            self._tag_futures.setdefault(tag, []).append(future)
+        return future
+
+    def write_bytes(self, path, data, tag=None):
+        """Queues already encoded bytes."""
+        return self.submit(path, bytes, data, size_hint=len(data), tag=tag)
+
+    def _batch_future(self):
+        if self._batch_done is None:
+            self._batch_done = Future()
+        return self._batch_done
+
+    def flush(self):
+        """Dispatches the current small-file batch (called at the end of each frame)."""
+        if self._pool is None or not self._batch:
+            return
+        jobs, size, placeholder = self._batch, self._batch_size, self._batch_future()
+        self._batch, self._batch_size, self._batch_done = [], 0, None
+        self.stats['batched_files'] += len(jobs)
+        inner = self._dispatch(jobs, size)
+        inner.add_done_callback(lambda _: placeholder.set_result(None))
+
+    def _dispatch(self, jobs, size):
+        wait_start = time.perf_counter()
+        with self._cond:
+            # Always admit a job when nothing is in flight, even if it alone exceeds the cap
+            while self._inflight > 0 and self._inflight + size > self.max_inflight:
+                self._cond.wait()
+            self._inflight += size
+            self.stats['peak_inflight_mb'] = max(self.stats['peak_inflight_mb'], self._inflight / 2**20)
+            self.stats['jobs'] += 1
+        self.stats['wait_sec'] += time.perf_counter() - wait_start
+        future = self._pool.submit(self._run, jobs)
+        future.add_done_callback(lambda _: self._release(size))
+        return future
+
+    def _release(self, size):
+        with self._cond:
+            self._inflight -= size
+            self._cond.notify_all()
+
+    def _run(self, jobs):
+        for path, encode, args, tag in jobs:
+            try:
+                start = time.perf_counter()
+                data = encode(*args)
+                encoded = time.perf_counter()
+                if self.archive is not None:
+                    self.archive.add(path, data, frame=tag, fsync=self.fsync)
+                else:
+                    write_file(path, data, fsync=self.fsync)
+                written = time.perf_counter()
+            except Exception as e:
+                print(f"  > Warning: Could not write {path}. {e}")
+                with self._cond:
+                    self.stats['errors'] += 1
+                    if tag is not None:
+                        self._failed_tags.add(tag)
+                continue
+            with self._cond:
+                self.stats['files'] += 1
+                self.stats['bytes'] += len(data)
+                self.stats['encode_sec'] += encoded - start
+                self.stats['write_sec'] += written - encoded
+
+    def done(self, tag):
+        """True once every job submitted with 'tag' is written (or failed)."""
+        return all(f is None or f.done() for f in self._tag_futures.get(tag, []))
+
+    def remove_stale_parts(self, directory, basename):
+        """
+        Deletes the '<basename>_*.part' files in 'directory' (left by a crash)
+        unless jobs of that frame are still running. Returns how many.
+        """
+        if not self.done(basename):
+            return 0
+        removed = 0
+        for part in glob.glob(os.path.join(glob.escape(str(directory)), glob.escape(basename) + '_*.part')):
+            try:
+                os.remove(part)
+                removed += 1
+            except OSError:
+                pass
+        return removed
+
+    def failed(self, tag):
+        """True when a job submitted with 'tag' could not be encoded or written."""
+        with self._cond:
+            return tag in self._failed_tags
+
+    def wait(self, tag=None):
+        """Blocks until the jobs of 'tag' (all jobs when None) are written."""
+        self.flush()
+        if tag is None:
+            futures = [f for fs in self._tag_futures.values() for f in fs]
+            with self._cond:
+                while self._inflight > 0:
+                    self._cond.wait()
+        else:
+            futures = self._tag_futures.get(tag, [])
+        for f in futures:
+            if f is not None:
+                f.result()
+
+    def forget(self, tag):
+        """Drops the bookkeeping of a finished tag."""
+        self._tag_futures.pop(tag, None)
+        with self._cond:
+            self._failed_tags.discard(tag)
+
+    def close(self):
+        """Writes everything still queued and stops the pool."""
+        self.wait()
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+
+    def summary(self):
+        """Counters plus write throughput (MB/s of worker time and of wall time)."""
+        stats = dict(self.stats)
+        mb = stats['bytes'] / 2**20
+        busy = stats['encode_sec'] + stats['write_sec']
+        stats.update(workers=self.workers, fsync=self.fsync,
+                     mb=mb,
+                     mb_per_sec_busy=mb / busy if busy > 0 else None,
+                     mb_per_sec_wall=mb / (time.perf_counter() - self._start))
+        return stats
+
+    def report(self):
+        s = self.summary()
+        busy = f"{s['mb_per_sec_busy']:.1f} MB/s per worker" if s['mb_per_sec_busy'] else "n/a"
+        print(f"[INFO] Artifact writer: {s['files']} file(s), {s['mb']:.1f} MB "
+              f"({busy}; encode {s['encode_sec']:.2f} s, write {s['write_sec']:.2f} s; "
+              f"peak in flight {s['peak_inflight_mb']:.1f} MB, backpressure {s['wait_sec']:.2f} s)")
+        if s['errors']:
+            print(f"[WARN] {s['errors']} artifact(s) could not be written.")
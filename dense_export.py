@@ -0,0 +1,359 @@
+"""
+dense_export.py
+
+Exports the dense, post-voxelization part of the KITTI PointPillars and
+SECOND models to TorchScript or ONNX, and runs it back on CPU:
+
+  PointPillars:  pillar features + coors -> PointPillarsScatter -> backbone
+                 -> neck -> head
+  SECOND:        BEV features (SparseEncoder output) -> backbone -> neck
+                 -> head (spconv layers do not export, so the sparse middle
+                 encoder stays in PyTorch)
+
+ExportedInferencer mirrors the inferencer call used by
+mmdet3d_inference2.py: hard voxelization in NumPy (point_ops.hard_voxelize),
+the voxel encoder (and SECOND's sparse encoder) in eager PyTorch, the
+exported graph in ONNX Runtime or TorchScript, then the head's own
+predict_by_feat for box decoding and NMS.
+
+Each export writes a <model>.json sidecar with the architecture, number of
+head levels and config, which ExportedInferencer reads back.
+
+Usage:
+  python dense_export.py --model pointpillars_hv_secfpn_8xb6-160e_kitti-3d-car \
+      --checkpoint checkpoints/kitti_pointpillars/hv_pointpillars_secfpn_6x8_160e_kitti-3d-car_20220331_134606-d42d15ed.pth \
+      --format onnx --out exported/kitti_pointpillars.onnx \
+      --check-parity data/kitti/training/velodyne/000008.bin
+"""
+
+import os
+import json
+import time
+import argparse
+
+import numpy as np
+import torch
+from mmdet3d.apis import LidarDet3DInferencer
+from mmdet3d.structures import LiDARInstance3DBoxes
+
+try:
+    import onnxruntime as ort
+except ImportError:
+    ort = None
+
+from point_ops import get_voxel_layer_cfg, hard_voxelize
+
+SUPPORTED_ARCHS = ('pointpillars', 'second')
+
+
+# --------------------------------------------------------------------
+# Dense wrappers
+# --------------------------------------------------------------------
+
+def _flatten_head_outputs(outputs):
+    """(cls_scores, bbox_preds, dir_cls_preds), each a list per level -> flat tuple."""
+    return tuple(t for per_level in outputs for t in per_level)
+
+
+def _split_head_outputs(flat, num_levels):
+    return [list(flat[i * num_levels:(i + 1) * num_levels]) for i in range(len(flat) // num_levels)]
+
+
+class PillarsDense(torch.nn.Module):
+    """pillar_features (V, C), coors (V, 4) [batch, z, y, x] -> flat head outputs."""
+
+    def __init__(self, model):
+        super().__init__()
+        self.middle_encoder = model.middle_encoder
+        self.backbone = model.backbone
+        self.neck = model.neck
+        self.bbox_head = model.bbox_head
+
+    def forward(self, pillar_features, coors):
+        x = self.middle_encoder(pillar_features, coors, 1)
+        return _flatten_head_outputs(self.bbox_head(self.neck(self.backbone(x))))
+
+
+class BevDense(torch.nn.Module):
+    """bev_features (1, C, H, W) -> flat head outputs."""
+
+    def __init__(self, model):
+        super().__init__()
+        self.backbone = model.backbone
+        self.neck = model.neck
+        self.bbox_head = model.bbox_head
+
+    def forward(self, bev_features):
+        return _flatten_head_outputs(self.bbox_head(self.neck(self.backbone(bev_features))))
+
+
+def detect_arch(model):
+    """'pointpillars' or 'second' from the middle encoder type."""
+    middle = type(getattr(model, 'middle_encoder', None)).__name__
+    if middle == 'PointPillarsScatter':
+        return 'pointpillars'
+    if middle == 'SparseEncoder':
+        return 'second'
+    raise ValueError(f"Unsupported model for dense export (middle encoder: {middle}); "
+                     f"expected one of {SUPPORTED_ARCHS}")
+
+
+# --------------------------------------------------------------------
+# Front end shared by export, runtime and parity check
+# --------------------------------------------------------------------
+
+def get_use_dim(cfg, default=4):
+    """Number of point channels the model consumes (LoadPointsFromFile.use_dim)."""
+    pipeline = cfg.get('test_pipeline', []) or []
+    for transform in pipeline:
+        if transform.get('type') == 'LoadPointsFromFile':
+            use_dim = transform.get('use_dim', default)
+            return len(use_dim) if isinstance(use_dim, (list, tuple)) else int(use_dim)
+    return default
+
+
+def encode_voxels(model, points, voxel_cfg, arch, voxelize=None):
+    """
+    NumPy hard voxelization (or the given 'voxelize' callable, e.g. a
+    voxelizer.Voxelizer) + eager voxel encoder (and sparse encoder for
+    SECOND). Returns the dense graph's input tensors as a tuple.
+    """
+    if voxelize is None:
+        voxels, coors, num_points = hard_voxelize(points, **voxel_cfg)
+    else:
+        voxels, coors, num_points = voxelize(points)
+    coors = np.pad(coors, ((0, 0), (1, 0)))  # batch index 0
+    voxels_t = torch.from_numpy(voxels)
+    coors_t = torch.from_numpy(coors)
+    num_points_t = torch.from_numpy(num_points)
+    with torch.no_grad():
+        features = model.voxel_encoder(voxels_t, num_points_t, coors_t)
+        if arch == 'second':
+            return (model.middle_encoder(features, coors_t, 1),)
+    return features, coors_t
+
+
+def build_dense(model, arch):
+    return PillarsDense(model) if arch == 'pointpillars' else BevDense(model)
+
+
+def input_names(arch):
+    return ['pillar_features', 'coors'] if arch == 'pointpillars' else ['bev_features']
+
+
+# --------------------------------------------------------------------
+# Export
+# --------------------------------------------------------------------
+
+def export_dense(inferencer, points, out_path, fmt='onnx', opset=13):
+    """
+    Traces the dense part of inferencer.model on 'points' and writes it to
+    out_path (.onnx or .pt) plus the <out_path stem>.json sidecar.
+    """
+    model = inferencer.model.eval()
+    arch = detect_arch(model)
+    voxel_cfg = get_voxel_layer_cfg(inferencer.cfg)
+    use_dim = get_use_dim(inferencer.cfg)
+    example = encode_voxels(model, points[:, :use_dim], voxel_cfg, arch)
+    dense = build_dense(model, arch).eval()
+
+    with torch.no_grad():
+        outputs = dense(*example)
+    num_levels = len(outputs) // 3
+    names = input_names(arch)
+    output_names = [f"{kind}_{level}" for kind in ('cls_score', 'bbox_pred', 'dir_cls_pred')
+                    for level in range(num_levels)]
+
+    os.makedirs(os.path.dirname(os.path.abspath(out_path)), exist_ok=True)
+    with torch.no_grad():
+        if fmt == 'torchscript':
+            traced = torch.jit.trace(dense, example, check_trace=False)
+            traced = torch.jit.freeze(traced)
+            traced.save(out_path)
+        else:
+            dynamic_axes = {name: {0: 'num_voxels'} for name in names} if arch == 'pointpillars' else None
+            torch.onnx.export(dense, example, out_path, input_names=names, output_names=output_names,
+                              dynamic_axes=dynamic_axes, opset_version=opset)
+
+    meta = {
+        'format': fmt,
+        'arch': arch,
+        'num_levels': num_levels,
+        'input_names': names,
+        'output_names': output_names,
+        'use_dim': use_dim,
+        'voxel_layer': voxel_cfg,
+        'torch_version': torch.__version__,
+    }
+    with open(sidecar_path(out_path), 'w') as f:
+        json.dump(meta, f, indent=2)
+    print(f"[INFO] Exported {arch} dense graph ({fmt}) to {out_path}")
+    return meta
+
+
+def sidecar_path(model_path):
+    return os.path.splitext(model_path)[0] + '.json'
+
+
+# --------------------------------------------------------------------
+# Runtime
+# --------------------------------------------------------------------
+
+class ExportedInferencer:
+    """
+    Drop-in replacement for the mmdet3d inferencer call in
+    mmdet3d_inference2.py, running the exported dense graph. Attributes not
+    defined here (cfg, model, pipeline, ...) come from the eager inferencer.
+    """
+
+    def __init__(self, inferencer, model_path, intra_threads=None, points_loader=None, voxelize=None):
+        with open(sidecar_path(model_path), 'r') as f:
+            self.meta = json.load(f)
+        self.inferencer = inferencer
+        self.points_loader = points_loader
+        self.voxelize = voxelize
+        self.arch = self.meta['arch']
+        if self.meta['format'] == 'onnx':
+            if ort is None:
+                raise ImportError("The ONNX Runtime backend needs 'pip install onnxruntime'")
+            options = ort.SessionOptions()
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            if intra_threads:
+                options.intra_op_num_threads = intra_threads
+            session = ort.InferenceSession(model_path, options, providers=['CPUExecutionProvider'])
+            self._run = lambda inputs: session.run(
+                None, {name: t.numpy() for name, t in zip(self.meta['input_names'], inputs)})
+        else:
+            module = torch.jit.load(model_path, map_location='cpu').eval()
+
+            def run_torchscript(inputs):
+                with torch.no_grad():
+                    return [t.numpy() for t in module(*inputs)]
+            self._run = run_torchscript
+
+    def __getattr__(self, name):
+        if name == 'inferencer':
+            raise AttributeError(name)
+        return getattr(self.inferencer, name)
+
+    def run_dense(self, points):
+        """Points (N, >=use_dim) -> flat list of head output arrays."""
+        inputs = encode_voxels(self.inferencer.model, points[:, :self.meta['use_dim']],
+                               self.meta['voxel_layer'], self.arch, voxelize=self.voxelize)
+        return self._run(inputs)
+
+    def __call__(self, inputs, show=False, out_dir='', pred_score_thr=0.3, **kwargs):
+        points = inputs['points'] if isinstance(inputs, dict) else inputs
+        if isinstance(points, str):
+            points = self.points_loader(points)
+        points = np.ascontiguousarray(points, dtype=np.float32)
+
+        flat = [torch.from_numpy(np.asarray(o)) for o in self.run_dense(points)]
+        cls_scores, bbox_preds, dir_cls_preds = _split_head_outputs(flat, self.meta['num_levels'])
+        with torch.no_grad():
+            results = self.inferencer.model.bbox_head.predict_by_feat(
+                cls_scores, bbox_preds, dir_cls_preds,
+                batch_input_metas=[{'box_type_3d': LiDARInstance3DBoxes}])
+        res = results[0]
+        pred = {
+            'labels_3d': res.labels_3d.tolist(),
+            'scores_3d': res.scores_3d.tolist(),
+            'bboxes_3d': res.bboxes_3d.tensor.tolist(),
+            'box_type_3d': 'LiDAR',
+        }
+        return {'predictions': [pred], 'visualization': []}
+
+
+# --------------------------------------------------------------------
+# Parity check
+# --------------------------------------------------------------------
+
+def check_parity(inferencer, model_path, points, atol=1e-3):
+    """
+    Compares the exported graph with eager PyTorch on the same voxelized
+    input (max abs difference per head output), then the final boxes of
+    ExportedInferencer with the eager inferencer on the raw points.
+
+    Returns:
+        True when all head outputs agree within 'atol' and both paths return
+        the same boxes and scores (matched in score order) within 'atol'.
+    """
+    exported = ExportedInferencer(inferencer, model_path)
+    use_dim = exported.meta['use_dim']
+    model = inferencer.model.eval()
+    inputs = encode_voxels(model, points[:, :use_dim], exported.meta['voxel_layer'], exported.arch)
+    with torch.no_grad():
+        eager = [t.numpy() for t in build_dense(model, exported.arch).eval()(*inputs)]
+
+    start = time.perf_counter()
+    outputs = exported._run(inputs)
+    exported_ms = (time.perf_counter() - start) * 1000.0
+
+    ok = True
+    print("| Output | Shape | Max abs diff |")
+    print("|--------|-------|-------------:|")
+    for name, a, b in zip(exported.meta['output_names'], eager, outputs):
+        diff = float(np.abs(a - np.asarray(b)).max()) if a.size else 0.0
+        ok &= diff <= atol
+        print(f"| {name} | {tuple(a.shape)} | {diff:.2e} |")
+    print(f"\n[INFO] Exported dense graph: {exported_ms:.1f} ms")
+
+    eager_pred = inferencer({'points': points}, show=False)['predictions'][0]
+    exported_pred = exported({'points': points})['predictions'][0]
+    eager_boxes = np.asarray(eager_pred['bboxes_3d'], dtype=np.float64).reshape(-1, 7)
+    exported_boxes = np.asarray(exported_pred['bboxes_3d'], dtype=np.float64).reshape(-1, 7)
+    print(f"[INFO] Boxes: eager {len(eager_boxes)}, exported {len(exported_boxes)}")
+    ok &= len(eager_boxes) == len(exported_boxes)
+    if len(eager_boxes) and len(eager_boxes) == len(exported_boxes):
+        eager_scores = np.asarray(eager_pred['scores_3d'], dtype=np.float64)
+        exported_scores = np.asarray(exported_pred['scores_3d'], dtype=np.float64)
+        order_a = np.argsort(-eager_scores, kind='stable')
+        order_b = np.argsort(-exported_scores, kind='stable')
+        box_diff = float(np.abs(eager_boxes[order_a] - exported_boxes[order_b]).max())
+        score_diff = float(np.abs(eager_scores[order_a] - exported_scores[order_b]).max())
+        print(f"[INFO] Max box difference (score order): {box_diff:.2e}")
+        print(f"[INFO] Max score difference (score order): {score_diff:.2e}")
+        ok &= box_diff <= atol and score_diff <= atol
+    return bool(ok)
+
+
+# --------------------------------------------------------------------
+# Main
+# --------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the dense part of PointPillars/SECOND to TorchScript/ONNX")
+    parser.add_argument("--model", type=str, required=True, help="Model name or config file")
+    parser.add_argument("--checkpoint", type=str, required=True)
+    parser.add_argument("--format", type=str, default="onnx", choices=["onnx", "torchscript"])
+    parser.add_argument("--out", type=str, required=True, help="Output .onnx / .pt path")
+    parser.add_argument("--sample", type=str, default=None,
+                        help="KITTI .bin used for tracing (random points inside the range by default)")
+    parser.add_argument("--opset", type=int, default=13)
+    parser.add_argument("--check-parity", type=str, default=None, metavar="BIN",
+                        help="After exporting, compare exported vs eager outputs on this .bin file")
+    parser.add_argument("--atol", type=float, default=1e-3)
+    args = parser.parse_args()
+
+    inferencer = LidarDet3DInferencer(args.model, args.checkpoint, device='cpu')
+    use_dim = get_use_dim(inferencer.cfg)
+    if args.sample:
+        points = np.fromfile(args.sample, dtype=np.float32).reshape(-1, 4)
+    else:
+        pcr = np.asarray(get_voxel_layer_cfg(inferencer.cfg)['point_cloud_range'], dtype=np.float32)
+        rng = np.random.default_rng(0)
+        points = np.concatenate([rng.uniform(pcr[:3], pcr[3:], (20000, 3)),
+                                 rng.uniform(0, 1, (20000, max(use_dim - 3, 0)))], axis=1).astype(np.float32)
+
+    export_dense(inferencer, points, args.out, fmt=args.format, opset=args.opset)
+
+    if args.check_parity:
+        parity_points = np.fromfile(args.check_parity, dtype=np.float32).reshape(-1, 4)
+        if not check_parity(inferencer, args.out, parity_points, atol=args.atol):
+            print("[FAIL] Exported model does not match eager PyTorch")
+            raise SystemExit(1)
+        print("[INFO] Parity check passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+ensemble.py
+
+Runs several mmdet3d LiDAR inferencers on the same frame and fuses their
+boxes with 3D weighted box fusion (postprocess.weighted_box_fusion).
+
+The frame is read (memory-mapped) and preprocessed once by
+mmdet3d_inference2.py and the resulting points array is handed to every
+member. Each member runs on its own single-thread executor whose PyTorch
+intra-op pool is sized to its share of the CPUs, so the models run
+concurrently instead of one after the other (PyTorch releases the GIL in its
+kernels).
+
+Members may have different class lists (e.g. a Car-only PointPillars and a
+3-class SECOND); labels are mapped into the union of their classes by name
+before fusion, and the union is returned as the predictions' metainfo
+classes, where resolve_class_names in mmdet3d_inference2.py looks for it.
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+
+from postprocess import weighted_box_fusion
+
+
+def _set_member_threads(num_threads):
+    if num_threads:
+        torch.set_num_threads(num_threads)
+
+
+class EnsembleInferencer:
+    """
+    Drop-in replacement for the mmdet3d inferencer call in
+    mmdet3d_inference2.py. Attributes not defined here (cfg, pipeline, ...)
+    come from the first member.
+    """
+
+    def __init__(self, members, names, weights=None, iou_thr=0.55, skip_box_thr=0.0,
+                 conf_type='avg', intra_threads=None):
+        if weights is not None and len(weights) != len(members):
+            raise ValueError(f"Got {len(weights)} ensemble weight(s) for {len(members)} model(s)")
+        self.members = members
+        self.names = list(names)
+        self.weights = weights
+        self.iou_thr = iou_thr
+        self.skip_box_thr = skip_box_thr
+        self.conf_type = conf_type
+        self.timer = None  # optional StageTimer for per-member timings
+
+        # Union of the members' classes, in order of first appearance
+        self.classes = []
+        member_classes = []
+        for member in members:
+            classes = list((getattr(member.model, 'dataset_meta', None) or {}).get('classes', []))
+            member_classes.append(classes)
+            self.classes.extend(c for c in classes if c not in self.classes)
+        self._label_maps = [np.asarray([self.classes.index(c) for c in classes], dtype=np.int64)
+                            for classes in member_classes]
+
+        threads = max(1, intra_threads // len(members)) if intra_threads else None
+        self.executors = [ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'ensemble-{i}',
+                                             initializer=_set_member_threads, initargs=(threads,))
+                          for i in range(len(members))]
+
+    def __getattr__(self, name):
+        if name == 'members':
+            raise AttributeError(name)
+        return getattr(self.members[0], name)
+
+    def _run_member(self, i, inputs, pred_score_thr):
+        start = time.perf_counter()
+        if isinstance(inputs, dict) and isinstance(inputs.get('points'), np.ndarray):
+            # Test pipelines may transform the points in place; give each member its own copy
+            inputs = dict(inputs, points=inputs['points'].copy())
+        results = self.members[i](inputs, show=False, pred_score_thr=pred_score_thr)
+        if self.timer is not None:
+            self.timer.add(f'inference:{self.names[i]}', time.perf_counter() - start)
+
+        pred = results['predictions'][0]
+        labels = np.asarray(pred.get('labels_3d', []), dtype=np.int64)
+        label_map = self._label_maps[i]
+        return {
+            'bboxes_3d': pred['bboxes_3d'],
+            'scores_3d': pred['scores_3d'],
+            'labels_3d': label_map[labels] if label_map.size else labels,
+        }
+
+    def __call__(self, inputs, show=False, out_dir='', pred_score_thr=0.3, **kwargs):
+        futures = [executor.submit(self._run_member, i, inputs, pred_score_thr)
+                   for i, executor in enumerate(self.executors)]
+        member_preds = [future.result() for future in futures]
+
+        start = time.perf_counter()
+        fused = weighted_box_fusion(member_preds, weights=self.weights, iou_thr=self.iou_thr,
+                                    skip_box_thr=self.skip_box_thr, conf_type=self.conf_type)
+        if self.timer is not None:
+            self.timer.add('ensemble_fusion', time.perf_counter() - start)
+
+        pred = {
+            'labels_3d': fused['labels_3d'].tolist(),
+            'scores_3d': fused['scores_3d'].tolist(),
+            'bboxes_3d': fused['bboxes_3d'].tolist(),
+            'box_type_3d': 'LiDAR',
+            'metainfo': {'classes': self.classes},
+            'num_member_boxes': {name: len(p['scores_3d']) for name, p in zip(self.names, member_preds)},
+        }
+        return {'predictions': [pred], 'visualization': []}
+
+    def close(self):
+        for executor in self.executors:
+            executor.shutdown()
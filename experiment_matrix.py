@@ -0,0 +1,187 @@
+"""
+experiment_matrix.py
+
+Loads the declarative experiment matrix (experiments.yaml, or a .toml file
+with the same layout) shared by run_all_experiments.py and
+compare_results.py.
+
+Layout:
+
+  defaults:  CLI arguments applied to every experiment
+  datasets:  named inputs ('label' for reports, 'tag' for experiment names)
+  models:    named models ('label' for reports); a 'model' that is a key of
+             PRESET_CONFIGS in mmdet3d_inference2.py inherits its checkpoint,
+             score threshold, ... from there, so the preset stays the single
+             source of truth
+  matrix:    blocks crossing lists of models x datasets x score-thr x device
+             x threads x precision
+
+Each block expands to the cartesian product of its lists. Axes with more
+than one value in a block are appended to the experiment name and output
+folder (e.g. kitti_pointpillars_000123_thr0.5_cpu_t4), so single-value
+blocks keep the plain '<model>_<tag>' names.
+
+Keys use the CLI spelling of mmdet3d_inference2.py ('input-path',
+'score-thr', ...). 'threads' is passed as --intra-threads and exported as
+OMP_NUM_THREADS / MKL_NUM_THREADS, which also bounds the OpenMP pools of the
+non-PyTorch libraries in the experiment's process.
+"""
+
+import os
+import ast
+import itertools
+from pathlib import Path
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+try:
+    import tomllib
+except ImportError:
+    try:
+        import tomli as tomllib
+    except ImportError:
+        tomllib = None
+
+DEFAULT_MATRIX = "experiments.yaml"
+INFERENCE_SCRIPT = "mmdet3d_inference2.py"
+
+# Keys of models/datasets entries that describe the experiment, not the CLI
+META_KEYS = ("label", "tag")
+AXES = ("score-thr", "device", "threads", "precision")
+
+
+def load_preset_configs(script_path=INFERENCE_SCRIPT):
+    """
+    Reads PRESET_CONFIGS from mmdet3d_inference2.py without importing it
+    (the script exits when mmdet3d is missing). Keys are converted to the
+    CLI spelling.
+    """
+    if not os.path.isfile(script_path):
+        return {}
+    with open(script_path, "r", encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(getattr(t, "id", None) == "PRESET_CONFIGS" for t in node.targets):
+            presets = ast.literal_eval(node.value)
+            return {name: {key.replace("_", "-"): value for key, value in preset.items()}
+                    for name, preset in presets.items()}
+    return {}
+
+
+def read_matrix_file(path):
+    """Parses a YAML or TOML matrix file into a dict."""
+    suffix = Path(path).suffix.lower()
+    if suffix == ".toml":
+        if tomllib is None:
+            raise ImportError("Reading TOML matrices needs Python 3.11+ or 'pip install tomli'")
+        with open(path, "rb") as f:
+            return tomllib.load(f)
+    if yaml is None:
+        raise ImportError("Reading YAML matrices needs 'pip install pyyaml'")
+    with open(path, "r", encoding="utf-8") as f:
+        return yaml.safe_load(f) or {}
+
+
+def _as_list(value):
+    if value is None:
+        return [None]
+    return list(value) if isinstance(value, (list, tuple)) else [value]
+
+
+def _axis_suffix(axis, value):
+    if axis == "score-thr":
+        return f"thr{value:g}"
+    if axis == "device":
+        return str(value).replace(":", "")
+    if axis == "precision":
+        return str(value)
+    return f"t{value}"
+
+
+def predictions_json_path(args):
+    """
+    The <basename>_predictions.json written for a single-frame experiment,
+    or None when the experiment covers several frames.
+    """
+    out_dir = args.get("out-dir")
+    if not out_dir:
+        return None
+    frame = args.get("frame-number")
+    if args.get("dataset") in ("kitti", "waymokitti") and frame not in (None, "", "-1", -1):
+        return os.path.join(out_dir, f"{frame}_predictions.json")
+    input_path = args.get("input-path")
+    if args.get("dataset") == "any" and input_path and os.path.splitext(input_path)[1]:
+        return os.path.join(out_dir, f"{Path(input_path).stem}_predictions.json")
+    return None
+
+
+def expand_matrix(spec, presets=None):
+    """
+    Expands a parsed matrix into a list of experiments:
+
+      {'name', 'dataset_label', 'model_label', 'args' (CLI arguments),
+       'env' (extra environment variables), 'pred_json'}
+    """
+    presets = load_preset_configs() if presets is None else presets
+    defaults = dict(spec.get("defaults") or {})
+    datasets = spec.get("datasets") or {}
+    models = spec.get("models") or {}
+
+    experiments = []
+    seen = set()
+    for block in spec.get("matrix") or []:
+        axis_values = {axis: _as_list(block.get(axis)) for axis in AXES}
+        varying = [axis for axis in AXES if len(axis_values[axis]) > 1]
+
+        for model_key, dataset_key, *axis_combo in itertools.product(
+                _as_list(block.get("models")), _as_list(block.get("datasets")),
+                *(axis_values[axis] for axis in AXES)):
+            if model_key not in models:
+                raise KeyError(f"Matrix references unknown model '{model_key}'")
+            if dataset_key not in datasets:
+                raise KeyError(f"Matrix references unknown dataset '{dataset_key}'")
+            model, dataset = models[model_key], datasets[dataset_key]
+
+            args = dict(defaults)
+            args.update(presets.get(model.get("model"), {}))
+            args.update({k: v for k, v in dataset.items() if k not in META_KEYS})
+            args.update({k: v for k, v in model.items() if k not in META_KEYS})
+            for axis, value in zip(AXES, axis_combo):
+                if value is not None:
+                    args[axis] = value
+            threads = args.pop("threads", None)
+            # 'modality' is already implied by the model config
+            args.pop("modality", None)
+
+            base_name = block.get("name", "{model}_{tag}").format(
+                model=model_key, dataset=dataset_key, tag=dataset.get("tag", dataset_key))
+            suffix = "".join("_" + _axis_suffix(axis, value)
+                             for axis, value in zip(AXES, axis_combo) if axis in varying)
+            name = base_name + suffix
+            args["out-dir"] = (args.get("out-dir") or os.path.join("outputs", base_name)) + suffix
+            if name in seen:
+                raise ValueError(f"Experiment matrix produces '{name}' twice")
+            seen.add(name)
+
+            env = {}
+            if threads:
+                args["intra-threads"] = threads
+                env = {"OMP_NUM_THREADS": str(threads), "MKL_NUM_THREADS": str(threads)}
+
+            experiments.append({
+                "name": name,
+                "dataset_label": dataset.get("label", dataset_key),
+                "model_label": model.get("label", model_key),
+                "args": args,
+                "env": env,
+                "pred_json": predictions_json_path(args),
+            })
+    return experiments
+
+
+def load_experiments(path=DEFAULT_MATRIX):
+    """Reads and expands the experiment matrix at 'path'."""
+    return expand_matrix(read_matrix_file(path))
@@ -0,0 +1,433 @@
+"""
+kitti_eval.py
+
+KITTI-style 3D and BEV average precision for the predictions saved by
+mmdet3d_inference2.py (<frame>_predictions.json) against label_2/ GT.
+
+Reports, per class and difficulty (easy / moderate / hard), AP with 11
+recall points (R11, the original devkit) and 40 recall points (R40).
+
+Follows the devkit conventions where the saved predictions allow it:
+  - GT outside a difficulty, and GT of the neighbouring class (Van for Car,
+    Person_sitting for Pedestrian), is ignored: detections matched to it
+    count as neither TP nor FP.
+  - IoU thresholds: Car 0.7, Pedestrian 0.5, Cyclist 0.5.
+Predictions are LiDAR-only, so the devkit's DontCare-region and
+2D-height filtering of detections is not applied. Detections are matched
+greedily in descending score order.
+
+GT boxes are converted to LiDAR coordinates with each frame's calibration
+(--calib-dir, by default the calib/ directory next to --label-dir).
+--check-calib <frame> checks that conversion on one frame.
+
+Per-frame matching runs in a process pool.
+
+Usage:
+  python kitti_eval.py --pred-dir outputs/kitti_pointpillars \
+      --label-dir data/kitti/training/label_2 \
+      --config checkpoints/kitti_pointpillars/pointpillars_hv_secfpn_8xb6-160e_kitti-3d-car.py
+  python kitti_eval.py --label-dir data/kitti/training/label_2 --check-calib 000008
+"""
+
+import os
+import ast
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from box_ops import bev_iou, iou_3d
+from kitti_labels import (CLASS_TO_ID, default_calib_dir, load_kitti_label_file, parse_kitti_label_text,
+                          read_rect_to_velo)
+
+DIFFICULTIES = {
+    'easy': dict(min_height=40, max_occlusion=0, max_truncation=0.15),
+    'moderate': dict(min_height=25, max_occlusion=1, max_truncation=0.30),
+    'hard': dict(min_height=25, max_occlusion=2, max_truncation=0.50),
+}
+IOU_THRESHOLDS = {'Car': 0.7, 'Pedestrian': 0.5, 'Cyclist': 0.5}
+NEIGHBOR_CLASSES = {'Car': 'Van', 'Pedestrian': 'Person_sitting'}
+METRICS = {'3d': iou_3d, 'bev': bev_iou}
+
+PREDICTION_SUFFIX = '_predictions.json'
+
+
+# --------------------------------------------------------------------
+# Loading
+# --------------------------------------------------------------------
+
+def read_config_class_names(config_path):
+    """
+    Reads 'class_names' (or metainfo classes) from an mmdet3d config file
+    without importing mmengine.
+    """
+    with open(config_path, 'r') as f:
+        tree = ast.parse(f.read())
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(getattr(t, 'id', None) == 'class_names' for t in node.targets):
+            return list(ast.literal_eval(node.value))
+    for node in tree.body:
+        if (isinstance(node, ast.Assign) and isinstance(node.value, ast.Call)
+                and any(getattr(t, 'id', None) == 'metainfo' for t in node.targets)):
+            for keyword in node.value.keywords:
+                if keyword.arg == 'classes':
+                    return list(ast.literal_eval(keyword.value))
+    raise ValueError(f"No class_names found in {config_path}")
+
+
+def load_prediction_file(pred_path):
+    """Returns {'boxes': (N, 7), 'scores': (N,), 'labels': (N,)} from a predictions JSON."""
+    with open(pred_path, 'r') as f:
+        data = json.load(f)
+    if isinstance(data, list):
+        data = data[0] if data else {}
+    if 'pred_instances_3d' in data:
+        data = data['pred_instances_3d']
+
+    boxes = np.asarray(data.get('bboxes_3d', []), dtype=np.float64)
+    # nuScenes boxes carry two extra velocity values
+    boxes = boxes.reshape(-1, boxes.shape[-1])[:, :7] if boxes.size else np.zeros((0, 7))
+    scores = np.asarray(data.get('scores_3d', np.ones(len(boxes))), dtype=np.float64)
+    labels = np.asarray(data.get('labels_3d', np.zeros(len(boxes))), dtype=np.int64)
+    return {'boxes': boxes, 'scores': scores, 'labels': labels}
+
+
+def load_prediction_dir(pred_dir):
+    """
+    Loads every <frame>_predictions.json of a run's output directory
+    (falling back to the inferencer's preds/<frame>.json dumps).
+
+    Returns:
+        Dict {frame_id: predictions}.
+    """
+    predictions = {}
+    for name in sorted(os.listdir(pred_dir)):
+        if name.endswith(PREDICTION_SUFFIX):
+            predictions[name[:-len(PREDICTION_SUFFIX)]] = load_prediction_file(os.path.join(pred_dir, name))
+
+    preds_subdir = os.path.join(pred_dir, 'preds')
+    if not predictions and os.path.isdir(preds_subdir):
+        for name in sorted(os.listdir(preds_subdir)):
+            if name.endswith('.json'):
+                predictions[os.path.splitext(name)[0]] = load_prediction_file(os.path.join(preds_subdir, name))
+    return predictions
+
+
+# --------------------------------------------------------------------
+# Matching and AP
+# --------------------------------------------------------------------
+
+def match_frame(pred, gt, class_names, score_thr=0.0):
+    """
+    Matches one frame's detections to its GT for every metric, class and
+    difficulty.
+
+    Args:
+        pred: Output of load_prediction_file
+        gt: Output of kitti_labels.load_kitti_label_file
+        class_names: Model class names indexed by the predicted labels
+        score_thr: Detections below this score are dropped first
+
+    Returns:
+        Dict {(metric, class, difficulty): (scores, is_tp, num_gt)} where
+        scores/is_tp cover the non-ignored detections.
+    """
+    keep = pred['scores'] >= score_thr
+    boxes, scores, labels = pred['boxes'][keep], pred['scores'][keep], pred['labels'][keep]
+    gt_height = gt['bbox_2d'][:, 3] - gt['bbox_2d'][:, 1]
+
+    stats = {}
+    for label_id, cls in enumerate(class_names):
+        if cls not in IOU_THRESHOLDS:
+            continue
+        det_mask = labels == label_id
+        det_boxes = boxes[det_mask]
+        det_scores = scores[det_mask]
+        order = np.argsort(-det_scores, kind='stable')
+        det_boxes, det_scores = det_boxes[order], det_scores[order]
+
+        is_cls = gt['class_ids'] == CLASS_TO_ID[cls]
+        is_neighbor = gt['class_ids'] == CLASS_TO_ID.get(NEIGHBOR_CLASSES.get(cls), -2)
+        gt_idx = np.nonzero(is_cls | is_neighbor)[0]
+        gt_boxes = gt['boxes'][gt_idx]
+
+        for metric, iou_fn in METRICS.items():
+            ious = iou_fn(det_boxes, gt_boxes) if det_boxes.size and gt_boxes.size \
+                else np.zeros((det_boxes.shape[0], gt_boxes.shape[0]))
+            for difficulty, limits in DIFFICULTIES.items():
+                valid_gt = (is_cls[gt_idx]
+                            & (gt_height[gt_idx] >= limits['min_height'])
+                            & (gt['occluded'][gt_idx] <= limits['max_occlusion'])
+                            & (gt['truncated'][gt_idx] <= limits['max_truncation']))
+                matched = np.zeros(gt_idx.size, dtype=bool)
+                is_tp = np.zeros(det_scores.size, dtype=bool)
+                ignored = np.zeros(det_scores.size, dtype=bool)
+                for d in range(det_scores.size):
+                    cand = (~matched) & (ious[d] >= IOU_THRESHOLDS[cls])
+                    if not cand.any():
+                        continue
+                    # Prefer a valid GT; matching only ignored GT ignores the detection
+                    pool = cand & valid_gt if (cand & valid_gt).any() else cand
+                    g = int(np.argmax(np.where(pool, ious[d], -1.0)))
+                    matched[g] = True
+                    if valid_gt[g]:
+                        is_tp[d] = True
+                    else:
+                        ignored[d] = True
+                stats[(metric, cls, difficulty)] = (det_scores[~ignored], is_tp[~ignored], int(valid_gt.sum()))
+    return stats
+
+
+def _match_chunk(job):
+    frames, class_names, score_thr = job
+    return [match_frame(pred, gt, class_names, score_thr) for pred, gt in frames]
+
+
+def compute_ap(scores, is_tp, num_gt):
+    """
+    Interpolated average precision at 11 and 40 recall points.
+
+    Returns:
+        (ap_r11, ap_r40) in percent, or (nan, nan) when there is no GT.
+    """
+    if num_gt == 0:
+        return float('nan'), float('nan')
+    order = np.argsort(-scores, kind='stable')
+    tp = np.cumsum(is_tp[order])
+    fp = np.cumsum(~is_tp[order])
+    recall = tp / num_gt
+    precision = tp / np.maximum(tp + fp, 1)
+    # Max precision at recall >= r
+    envelope = np.maximum.accumulate(precision[::-1])[::-1] if precision.size else precision
+
+    def interpolate(points):
+        if envelope.size == 0:
+            return 0.0
+        pos = np.searchsorted(recall, points, side='left')
+        values = np.where(pos < envelope.size, envelope[np.minimum(pos, envelope.size - 1)], 0.0)
+        return float(values.mean() * 100.0)
+
+    return interpolate(np.linspace(0.0, 1.0, 11)), interpolate(np.linspace(1.0 / 40, 1.0, 40))
+
+
+def evaluate_kitti(predictions, label_dir, class_names, score_thr=0.0, workers=None, calib_dir=None):
+    """
+    Evaluates predictions against label_dir.
+
+    Args:
+        predictions: Dict {frame_id: predictions} (see load_prediction_dir)
+        label_dir: KITTI label_2/ directory
+        class_names: Model class names indexed by the predicted labels
+        score_thr: Minimum detection score
+        workers: Process pool size (None = os.cpu_count(), <= 1 = serial)
+        calib_dir: KITTI calib/ directory for the GT conversion (default:
+            next to label_dir)
+
+    Returns:
+        Dict {class: {metric: {difficulty: {'AP_R11', 'AP_R40', 'num_gt'}}}}
+        and the number of evaluated frames.
+    """
+    calib_dir = calib_dir or default_calib_dir(label_dir)
+    if not os.path.isdir(calib_dir):
+        print(f"[WARN] Calibration directory not found: {calib_dir}. GT boxes are converted without "
+              f"calibration, which shifts them by the camera-LiDAR offset; 3D AP at IoU 0.7 is not meaningful.")
+        calib_dir = None
+
+    frames = []
+    for frame_id, pred in sorted(predictions.items()):
+        label_file = os.path.join(label_dir, f"{frame_id}.txt")
+        if not os.path.isfile(label_file):
+            print(f"[WARN] No label for frame {frame_id}, skipping")
+            continue
+        calib_file = os.path.join(calib_dir, f"{frame_id}.txt") if calib_dir else None
+        if calib_file and not os.path.isfile(calib_file):
+            print(f"[WARN] No calibration for frame {frame_id}, skipping")
+            continue
+        frames.append((pred, load_kitti_label_file(label_file, calib_file)))
+
+    workers = os.cpu_count() if workers is None else workers
+    if workers > 1 and len(frames) >= 4 * workers:
+        chunk = -(-len(frames) // (4 * workers))
+        jobs = [(frames[i:i + chunk], class_names, score_thr) for i in range(0, len(frames), chunk)]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            per_frame = [stats for chunk_stats in pool.map(_match_chunk, jobs) for stats in chunk_stats]
+    else:
+        per_frame = _match_chunk((frames, class_names, score_thr))
+
+    results = {}
+    for cls in class_names:
+        if cls not in IOU_THRESHOLDS:
+            continue
+        for metric in METRICS:
+            for difficulty in DIFFICULTIES:
+                key = (metric, cls, difficulty)
+                parts = [stats[key] for stats in per_frame]
+                scores = np.concatenate([p[0] for p in parts]) if parts else np.zeros(0)
+                is_tp = np.concatenate([p[1] for p in parts]) if parts else np.zeros(0, dtype=bool)
+                num_gt = sum(p[2] for p in parts)
+                ap11, ap40 = compute_ap(scores, is_tp, num_gt)
+                results.setdefault(cls, {}).setdefault(metric, {})[difficulty] = {
+                    'AP_R11': ap11, 'AP_R40': ap40, 'num_gt': num_gt,
+                }
+    return results, len(frames)
+
+
+def _label_corners_cam(dims_hwl, loc_cam, rot_y):
+    """(N, 8, 3) corners of KITTI label boxes in rectified camera coordinates (devkit formula)."""
+    h, w, l = dims_hwl[:, 0:1], dims_hwl[:, 1:2], dims_hwl[:, 2:3]
+    x = np.hstack([l, l, -l, -l, l, l, -l, -l]) / 2.0
+    y = np.hstack([np.zeros_like(h)] * 4 + [-h] * 4)
+    z = np.hstack([w, -w, -w, w, w, -w, -w, w]) / 2.0
+    cos, sin = np.cos(rot_y)[:, None], np.sin(rot_y)[:, None]
+    return np.stack([cos * x + sin * z, y, -sin * x + cos * z], axis=-1) + loc_cam[:, None, :]
+
+
+def check_calibration(label_dir, calib_dir, frame_id, min_iou=0.999):
+    """
+    Checks the GT conversion of one frame: each label box is moved to LiDAR
+    coordinates independently (its devkit corners mapped through
+    R0_rect * Tr_velo_to_cam) and must have 3D IoU 1 with the GT that
+    evaluate_kitti matches against. Also prints the IoU the uncalibrated
+    axis swap would give. Returns True when the check passes.
+    """
+    label_file = os.path.join(label_dir, f"{frame_id}.txt")
+    calib_file = os.path.join(calib_dir or default_calib_dir(label_dir), f"{frame_id}.txt")
+    for path in (label_file, calib_file):
+        if not os.path.isfile(path):
+            print(f"[WARN] {path} not found")
+            return False
+    gt = load_kitti_label_file(label_file, calib_file)
+    with open(label_file, 'r') as f:
+        lines = [line.split() for line in f if line.strip()]
+    lines = [line for line in lines if line[0] != 'DontCare']
+    if not lines:
+        print(f"[WARN] Frame {frame_id} has no boxes to check")
+        return True
+    values = np.array([line[8:15] for line in lines], dtype=np.float64)
+    dims_hwl, loc_cam, rot_y = values[:, 0:3], values[:, 3:6], values[:, 6]
+
+    corners = _label_corners_cam(dims_hwl, loc_cam, rot_y).reshape(-1, 3)
+    velo_to_rect = np.linalg.inv(read_rect_to_velo(calib_file))
+    corners_velo = np.linalg.solve(velo_to_rect[:3, :3], (corners - velo_to_rect[:3, 3]).T).T
+    bottom = corners_velo.reshape(-1, 8, 3)[:, :4].mean(axis=1)
+    reference = np.hstack([bottom, dims_hwl[:, [2, 1, 0]], (-rot_y - np.pi / 2.0)[:, None]])
+
+    keep = gt['class_ids'] != CLASS_TO_ID['DontCare']
+    calibrated = np.diag(iou_3d(reference, gt['boxes'][keep]))
+    with open(label_file, 'r') as f:
+        uncalibrated = parse_kitti_label_text(f.read())['boxes'][keep]
+    approx = np.diag(iou_3d(reference, uncalibrated))
+    ok = bool((calibrated >= min_iou).all())
+    print(f"[INFO] {frame_id}: {len(reference)} box(es), 3D IoU with calibration "
+          f"min {calibrated.min():.4f}, without {approx.min():.4f}-{approx.max():.4f} "
+          f"-> {'OK' if ok else 'FAILED'}")
+    return ok
+
+
+def format_delta_markdown(results, reference, ap_key='AP_R40'):
+    """Markdown table of AP differences (results - reference), e.g. bf16 vs fp32."""
+    lines = [f"| Class | Metric | Easy (delta {ap_key}) | Moderate | Hard |",
+             "|-------|--------|-----:|---------:|-----:|"]
+    for cls, per_metric in results.items():
+        for metric, per_diff in per_metric.items():
+            cells = []
+            for difficulty in DIFFICULTIES:
+                delta = per_diff[difficulty][ap_key] - reference[cls][metric][difficulty][ap_key]
+                cells.append("-" if np.isnan(delta) else f"{delta:+.2f}")
+            lines.append(f"| {cls} | {metric.upper()} | {' | '.join(cells)} |")
+    return "\n".join(lines)
+
+
+def format_markdown(results, ap_key='AP_R40'):
+    """Markdown table with one row per class and metric."""
+    lines = [f"| Class | Metric | Easy ({ap_key}) | Moderate | Hard | #GT (mod) |",
+             "|-------|--------|-----:|---------:|-----:|----------:|"]
+    for cls, per_metric in results.items():
+        for metric, per_diff in per_metric.items():
+            cells = []
+            for difficulty in DIFFICULTIES:
+                ap = per_diff[difficulty][ap_key]
+                cells.append("-" if np.isnan(ap) else f"{ap:.2f}")
+            lines.append(f"| {cls} | {metric.upper()} | {' | '.join(cells)} | "
+                         f"{per_diff['moderate']['num_gt']} |")
+    return "\n".join(lines)
+
+
+# --------------------------------------------------------------------
+# Main
+# --------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="KITTI 3D/BEV AP for saved predictions")
+    parser.add_argument("--pred-dir", type=str, default=None,
+                        help="Run output directory containing <frame>_predictions.json files")
+    parser.add_argument("--label-dir", type=str, default=os.path.join("data", "kitti", "training", "label_2"))
+    parser.add_argument("--calib-dir", type=str, default=None,
+                        help="KITTI calib/ directory for the GT conversion (default: calib/ next to --label-dir)")
+    parser.add_argument("--check-calib", type=str, default=None, metavar="FRAME",
+                        help="Check the calibrated GT conversion on one frame and exit")
+    parser.add_argument("--config", type=str, default=None,
+                        help="Model config .py to read class names from")
+    parser.add_argument("--classes", type=str, default=None,
+                        help="Comma-separated model class names (overrides --config), e.g. 'Pedestrian,Cyclist,Car'")
+    parser.add_argument("--score-thr", type=float, default=0.0)
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Processes for per-frame matching (default: all cores, 1 = serial)")
+    parser.add_argument("--reference-dir", type=str, default=None,
+                        help="Second run directory (e.g. the fp32 run) to report AP deltas against")
+    parser.add_argument("--out-json", type=str, default=None)
+    args = parser.parse_args()
+
+    if args.check_calib:
+        ok = check_calibration(args.label_dir, args.calib_dir, args.check_calib)
+        raise SystemExit(0 if ok else 1)
+    if not args.pred_dir:
+        parser.error("--pred-dir is required")
+
+    if args.classes:
+        class_names = [c.strip() for c in args.classes.split(",") if c.strip()]
+    elif args.config:
+        class_names = read_config_class_names(args.config)
+    else:
+        class_names = ['Car']
+
+    predictions = load_prediction_dir(args.pred_dir)
+    if not predictions:
+        print(f"[WARN] No predictions found in {args.pred_dir}")
+        return
+
+    results, num_frames = evaluate_kitti(predictions, args.label_dir, class_names,
+                                         score_thr=args.score_thr, workers=args.workers,
+                                         calib_dir=args.calib_dir)
+    print(f"[INFO] Evaluated {num_frames} frame(s), classes: {', '.join(class_names)}\n")
+    print(format_markdown(results, 'AP_R40'))
+    print()
+    print(format_markdown(results, 'AP_R11'))
+
+    reference = None
+    if args.reference_dir:
+        reference_preds = load_prediction_dir(args.reference_dir)
+        # Only frames present in both runs are compared
+        common = {k: v for k, v in reference_preds.items() if k in predictions}
+        if len(common) != len(predictions):
+            print(f"[WARN] {len(predictions) - len(common)} frame(s) missing from {args.reference_dir}")
+        reference, _ = evaluate_kitti(common, args.label_dir, class_names,
+                                      score_thr=args.score_thr, workers=args.workers, calib_dir=args.calib_dir)
+        if len(common) != len(predictions):
+            results, _ = evaluate_kitti({k: predictions[k] for k in common}, args.label_dir, class_names,
+                                        score_thr=args.score_thr, workers=args.workers, calib_dir=args.calib_dir)
+        print(f"\nAP delta vs {args.reference_dir}:\n")
+        print(format_delta_markdown(results, reference, 'AP_R40'))
+
+    if args.out_json:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out_json)), exist_ok=True)
+        with open(args.out_json, "w") as f:
+            json.dump({'pred_dir': args.pred_dir, 'calib_dir': args.calib_dir, 'score_thr': args.score_thr,
+                       'num_frames': num_frames, 'results': results,
+                       'reference_dir': args.reference_dir, 'reference_results': reference}, f, indent=2)
+        print(f"\n[INFO] Results written to: {args.out_json}")
+
+
+if __name__ == "__main__":
+    main()
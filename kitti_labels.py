@@ -0,0 +1,202 @@
+"""
+kitti_labels.py
+
+Bulk KITTI label parsing for visualization and evaluation.
+
+A label line has 15 whitespace-separated fields (16 for result files, the
+last one being the score):
+
+    type truncated occluded alpha x1 y1 x2 y2 h w l x y z rotation_y [score]
+
+Instead of splitting and converting line by line, every file is tokenized
+in one pass and converted to float32 as a whole array. Parsed files are
+cached in memory keyed by (mtime, size), so repeated loads of an unchanged
+label_2/ directory are dictionary lookups.
+
+Boxes are moved to LiDAR coordinates with the frame's calib/<frame>.txt
+(inv(R0_rect * Tr_velo_to_cam), as mmdet3d's CameraInstance3DBoxes.convert_to
+does) when one is given, and with a fixed axis swap otherwise. The swap is
+only approximate: it is off by the camera-LiDAR offset and rotation.
+"""
+
+import os
+
+import numpy as np
+
+KITTI_CLASSES = ['Car', 'Van', 'Truck', 'Pedestrian', 'Person_sitting',
+                 'Cyclist', 'Tram', 'Misc', 'DontCare']
+CLASS_TO_ID = {name: idx for idx, name in enumerate(KITTI_CLASSES)}
+
+# Classes loaded as GT boxes by mmdet3d_inference2.load_kitti_gt_labels
+DETECTION_CLASSES = ['Car', 'Van', 'Truck', 'Pedestrian', 'Cyclist']
+
+_LABEL_CACHE = {}
+
+
+def _empty_labels(with_score=False):
+    labels = {
+        'boxes': np.zeros((0, 7), dtype=np.float32),
+        'class_ids': np.zeros((0,), dtype=np.int16),
+        'truncated': np.zeros((0,), dtype=np.float32),
+        'occluded': np.zeros((0,), dtype=np.int8),
+        'alpha': np.zeros((0,), dtype=np.float32),
+        'bbox_2d': np.zeros((0, 4), dtype=np.float32),
+    }
+    if with_score:
+        labels['scores'] = np.zeros((0,), dtype=np.float32)
+    return labels
+
+
+def read_rect_to_velo(calib_file):
+    """
+    Reads a KITTI calib file and returns the 4x4 transform from rectified
+    camera to LiDAR coordinates, inv(R0_rect * Tr_velo_to_cam).
+    """
+    calib = {}
+    with open(calib_file, 'r') as f:
+        for line in f:
+            if ':' in line:
+                key, value = line.split(':', 1)
+                calib[key.strip()] = np.array(value.split(), dtype=np.float64)
+    # KITTI tracking calib files name them R_rect / Tr_velo_cam
+    r0_rect = calib.get('R0_rect', calib.get('R_rect'))
+    velo_to_cam = calib.get('Tr_velo_to_cam', calib.get('Tr_velo_cam'))
+    if r0_rect is None or velo_to_cam is None:
+        raise ValueError(f"{calib_file} has no R0_rect / Tr_velo_to_cam")
+
+    rect = np.eye(4)
+    rect[:3, :3] = r0_rect.reshape(3, 3)
+    velo_to_rect = np.eye(4)
+    velo_to_rect[:3, :4] = velo_to_cam.reshape(3, 4)
+    return np.linalg.inv(rect @ velo_to_rect)
+
+
+def camera_to_lidar_boxes(dims_hwl, loc_cam, rot_y, rect_to_velo=None):
+    """
+    Converts KITTI camera-frame boxes to the [x, y, z, l, w, h, yaw] LiDAR
+    layout used throughout the repo, z at the box bottom. Without
+    'rect_to_velo' (see read_rect_to_velo) the axes are only swapped, which
+    ignores the camera-LiDAR offset.
+
+    Args:
+        dims_hwl: (N, 3) h, w, l
+        loc_cam: (N, 3) bottom-center x, y, z in camera coordinates
+        rot_y: (N,) yaw around the camera Y axis
+        rect_to_velo: (Optional) 4x4 rectified camera -> LiDAR transform
+
+    Returns:
+        (N, 7) float32 boxes.
+    """
+    boxes = np.empty((dims_hwl.shape[0], 7), dtype=np.float32)
+    if rect_to_velo is not None:
+        boxes[:, :3] = loc_cam.astype(np.float64) @ rect_to_velo[:3, :3].T + rect_to_velo[:3, 3]
+    else:
+        boxes[:, 0] = loc_cam[:, 2]
+        boxes[:, 1] = -loc_cam[:, 0]
+        boxes[:, 2] = -loc_cam[:, 1]
+    boxes[:, 3] = dims_hwl[:, 2]
+    boxes[:, 4] = dims_hwl[:, 1]
+    boxes[:, 5] = dims_hwl[:, 0]
+    boxes[:, 6] = -rot_y - np.float32(np.pi / 2.0)
+    return boxes
+
+
+def parse_kitti_label_text(text, rect_to_velo=None):
+    """
+    Parses the content of one KITTI label (or result) file; 'rect_to_velo'
+    is the frame's calibration (see camera_to_lidar_boxes).
+
+    Returns:
+        Dict of arrays: 'boxes' (N, 7) LiDAR boxes, 'class_ids' (N,) indices
+        into KITTI_CLASSES (-1 for unknown types), 'truncated', 'occluded',
+        'alpha', 'bbox_2d' (N, 4) and, for result files, 'scores'.
+    """
+    lines = [line for line in text.splitlines() if line.strip()]
+    if not lines:
+        return _empty_labels()
+
+    # Every line must have the same count, or the reshape below misaligns rows
+    field_counts = {len(line.split()) for line in lines}
+    if len(field_counts) != 1 or not field_counts <= {15, 16}:
+        raise ValueError("Malformed KITTI label file: expected 15 or 16 fields on every line, "
+                         f"got {sorted(field_counts)}")
+    num_fields = field_counts.pop()
+    table = np.array(text.split()).reshape(len(lines), num_fields)
+
+    values = table[:, 1:].astype(np.float32)
+    labels = {
+        'boxes': camera_to_lidar_boxes(values[:, 7:10], values[:, 10:13], values[:, 13], rect_to_velo),
+        'class_ids': np.array([CLASS_TO_ID.get(name, -1) for name in table[:, 0]], dtype=np.int16),
+        'truncated': values[:, 0],
+        'occluded': values[:, 1].astype(np.int8),
+        'alpha': values[:, 2],
+        'bbox_2d': values[:, 3:7],
+    }
+    if num_fields == 16:
+        labels['scores'] = values[:, 14]
+    return labels
+
+
+def load_kitti_label_file(label_file, calib_file=None):
+    """
+    Parses one label file, with boxes converted through 'calib_file' when
+    given, reusing the cached result while the mtime and size of both files
+    are unchanged.
+    """
+    paths = [label_file] + ([calib_file] if calib_file else [])
+    key = tuple(os.path.abspath(p) for p in paths)
+    stamp = tuple((st.st_mtime_ns, st.st_size) for st in map(os.stat, paths))
+    cached = _LABEL_CACHE.get(key)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+
+    rect_to_velo = read_rect_to_velo(calib_file) if calib_file else None
+    with open(label_file, 'r') as f:
+        labels = parse_kitti_label_text(f.read(), rect_to_velo)
+    _LABEL_CACHE[key] = (stamp, labels)
+    return labels
+
+
+def default_calib_dir(label_dir):
+    """The calib/ directory next to a label_2/ directory."""
+    return os.path.join(os.path.dirname(os.path.normpath(label_dir)), 'calib')
+
+
+def load_kitti_label_dir(label_dir, frame_ids=None, calib_dir=None):
+    """
+    Loads a whole label_2/ directory into flat arrays.
+
+    Args:
+        label_dir: Directory of <frame_id>.txt label files
+        frame_ids: (Optional) frames to load; defaults to every .txt file
+        calib_dir: (Optional) directory of <frame_id>.txt calib files used
+            to convert the boxes to LiDAR coordinates
+
+    Returns:
+        Dict with the same arrays as parse_kitti_label_text, concatenated over
+        all frames, plus 'frame_ids' (list of str) and 'frame_index' (N,)
+        giving each object's position in 'frame_ids'.
+    """
+    if frame_ids is None:
+        frame_ids = sorted(os.path.splitext(name)[0] for name in os.listdir(label_dir)
+                           if name.endswith('.txt'))
+
+    per_frame = [load_kitti_label_file(os.path.join(label_dir, f"{frame_id}.txt"),
+                                       os.path.join(calib_dir, f"{frame_id}.txt") if calib_dir else None)
+                 for frame_id in frame_ids]
+    counts = np.array([labels['boxes'].shape[0] for labels in per_frame], dtype=np.int64)
+
+    with_score = bool(per_frame) and all('scores' in labels for labels in per_frame)
+    merged = {}
+    for key, empty in _empty_labels(with_score).items():
+        parts = [labels[key] for labels in per_frame]
+        merged[key] = np.concatenate(parts, axis=0) if parts else empty
+    merged['frame_ids'] = list(frame_ids)
+    merged['frame_index'] = np.repeat(np.arange(len(frame_ids), dtype=np.int32), counts)
+    return merged
+
+
+def class_mask(labels, class_names):
+    """Boolean mask selecting the objects whose class is in class_names."""
+    wanted = [CLASS_TO_ID[name] for name in class_names]
+    return np.isin(labels['class_ids'], wanted)
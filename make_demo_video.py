@@ -1,6 +1,3 @@
-import cv2
-import os
-
 """
 make_demo_video.py
 
@@ -13,8 +10,34 @@ Creates a single demo video that shows all HW2 experiments:
 5. nuScenes - CenterPoint (Open3D screenshot)
 
 Output: results/demo_all_experiments.mp4
+
+Sequence mode (--sequence <out-dir>) turns a whole run into a video instead:
+every frame (of the directory, or of --manifest, e.g. its run_journal.jsonl)
+becomes one video frame with the 2D projection (<frame>_2d_vis.png) and the
+BEV raster (<frame>_bev.png, or rendered from the saved points and
+predictions when the run had no --bev) side by side. Frames are decoded and
+composed by a thread pool at most --read-ahead frames ahead of the writer, so
+memory stays flat for drives of any length. Runs written with --archive are
+read from their pack volumes:
+
+  python make_demo_video.py --sequence outputs/kitti_pointpillars --fps 10
 """
 
+import cv2
+import os
+import json
+import time
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from bev_render import DEFAULT_RANGE, render_bev
+from ply_io import read_points_artifact
+from run_archive import read_artifact
+from run_frames import list_frames
+
 frames = [
     "outputs/kitti_pointpillars/000123_2d_vis.png",
     "outputs/kitti_3dssd/000123_2d_vis.png",
@@ -23,42 +46,184 @@ frames = [
     "results/screenshots/nuscenes_centerpoint_open3d.png",
 ]
 
-# Keep only existing files
-frames = [f for f in frames if os.path.exists(f)]
-if not frames:
-    raise RuntimeError("No valid frames found. Check paths and generate images first.")
+PANELS = ("2d", "bev")
+
+
+def make_stills_video():
+    # Keep only existing files
+    still_frames = [f for f in frames if os.path.exists(f)]
+    if not still_frames:
+        raise RuntimeError("No valid frames found. Check paths and generate images first.")
+
+    print("Using frames:")
+    for f in still_frames:
+        print("  ✓", f)
+
+    first_img = cv2.imread(still_frames[0])
+    if first_img is None:
+        raise RuntimeError(f"Failed to load first frame: {still_frames[0]}")
+
+    height, width = first_img.shape[:2]
+    fps = 4
+    seconds_per_image = 2.5
+    repeat_frames = int(fps * seconds_per_image)
+
+    os.makedirs("results", exist_ok=True)
+    out_path = "results/demo_all_experiments.mp4"
+
+    fourcc = cv2.VideoWriter_fourcc(*"mp4v")
+    video = cv2.VideoWriter(out_path, fourcc, fps, (width, height))
+
+    for img_path in still_frames:
+        img = cv2.imread(img_path)
+        if img is None:
+            print("Warning: skipping unreadable frame:", img_path)
+            continue
 
-print("Using frames:")
-for f in frames:
-    print("  ✓", f)
+        if img.shape[:2] != (height, width):
+            img = cv2.resize(img, (width, height))
 
-first_img = cv2.imread(frames[0])
-if first_img is None:
-    raise RuntimeError(f"Failed to load first frame: {frames[0]}")
+        for _ in range(repeat_frames):
+            video.write(img)
 
-height, width = first_img.shape[:2]
-fps = 4
-seconds_per_image = 2.5
-repeat_frames = int(fps * seconds_per_image)
+    video.release()
+    print("\nDemo video created successfully:")
+    print(os.path.abspath(out_path))
 
-os.makedirs("results", exist_ok=True)
-out_path = "results/demo_all_experiments.mp4"
 
-fourcc = cv2.VideoWriter_fourcc(*"mp4v")
-video = cv2.VideoWriter(out_path, fourcc, fps, (width, height))
+# --------------------------------------------------------------------
+# Sequence mode
+# --------------------------------------------------------------------
 
-for img_path in frames:
-    img = cv2.imread(img_path)
+def read_image(path):
+    """Decodes an image file or archive member as BGR; None when it is missing."""
+    data = read_artifact(path)
+    if data is None:
+        return None
+    return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+
+def load_panel(out_dir, basename, panel, bev_range, bev_resolution):
+    """One panel of a frame as a BGR image, or None when its outputs are missing."""
+    if panel == "2d":
+        return read_image(os.path.join(out_dir, f"{basename}_2d_vis.png"))
+
+    img = read_image(os.path.join(out_dir, f"{basename}_bev.png"))
+    if img is not None:
+        return img
+    loaded = read_points_artifact(out_dir, basename)
+    if loaded is None:
+        return None
+    boxes = []
+    pred_data = read_artifact(os.path.join(out_dir, f"{basename}_predictions.json"))
+    if pred_data is not None:
+        boxes = json.loads(pred_data).get("bboxes_3d", [])
+    rgb = render_bev(loaded[0], boxes, bev_range=bev_range, resolution=bev_resolution)
+    return np.ascontiguousarray(rgb[:, :, ::-1])
+
+
+def fit_into(img, width, height):
+    """Letterboxes 'img' into a black width x height slot."""
+    slot = np.zeros((height, width, 3), dtype=np.uint8)
     if img is None:
-        print("Warning: skipping unreadable frame:", img_path)
-        continue
+        cv2.putText(slot, "missing", (10, height // 2), cv2.FONT_HERSHEY_SIMPLEX, 1.0, (128, 128, 128), 2)
+        return slot
+    scale = min(width / img.shape[1], height / img.shape[0])
+    w, h = max(1, int(img.shape[1] * scale)), max(1, int(img.shape[0] * scale))
+    resized = cv2.resize(img, (w, h), interpolation=cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR)
+    y, x = (height - h) // 2, (width - w) // 2
+    slot[y:y + h, x:x + w] = resized
+    return slot
+
+
+def compose_frame(out_dir, basename, index, panels, slot_widths, panel_height, bev_range, bev_resolution):
+    """Loads and places the panels of one frame side by side with a caption."""
+    row = [fit_into(load_panel(out_dir, basename, panel, bev_range, bev_resolution), width, panel_height)
+           for panel, width in zip(panels, slot_widths)]
+    frame = np.hstack(row)
+    cv2.putText(frame, f"{index:05d}  {basename}", (10, 28), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 255), 2)
+    return frame
+
+
+def make_sequence_video(out_dir, out_path, manifest=None, panels=PANELS, fps=10.0, panel_height=480,
+                        workers=4, read_ahead=16, bev_range=DEFAULT_RANGE, bev_resolution=0.1):
+    names = list_frames(out_dir, manifest)
+    if not names:
+        raise RuntimeError(f"No frames found in {manifest or out_dir}")
+
+    # Slot sizes come from the first frame that has each panel (video frames must all be the same size)
+    slot_widths = []
+    for panel in panels:
+        sample = next((img for img in (load_panel(out_dir, name, panel, bev_range, bev_resolution)
+                                       for name in names[:10]) if img is not None), None)
+        aspect = sample.shape[1] / sample.shape[0] if sample is not None else 4 / 3
+        slot_widths.append(int(round(panel_height * aspect / 2)) * 2)
+    size = (sum(slot_widths), panel_height)
+
+    os.makedirs(os.path.dirname(os.path.abspath(out_path)), exist_ok=True)
+    video = cv2.VideoWriter(out_path, cv2.VideoWriter_fourcc(*"mp4v"), fps, size)
+    print(f"[INFO] {len(names)} frame(s) from {manifest or out_dir} -> {out_path} "
+          f"({size[0]}x{size[1]} @ {fps:g} fps, panels: {', '.join(panels)})")
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        def submit(i):
+            return pool.submit(compose_frame, out_dir, names[i], i, panels, slot_widths, panel_height,
+                               bev_range, bev_resolution)
+
+        # Bounded read-ahead: at most 'read_ahead' composed frames wait for the writer
+        pending = deque(submit(i) for i in range(min(read_ahead, len(names))))
+        next_index = len(pending)
+        written = 0
+        while pending:
+            frame = pending.popleft().result()
+            if next_index < len(names):
+                pending.append(submit(next_index))
+                next_index += 1
+            video.write(frame)
+            written += 1
+            if written % 100 == 0:
+                print(f"[INFO] {written}/{len(names)} frames "
+                      f"({written / (time.perf_counter() - start):.1f} frames/s)")
+    video.release()
+
+    elapsed = time.perf_counter() - start
+    print(f"[INFO] Wrote {written} frames in {elapsed:.1f} s ({written / elapsed:.1f} frames/s, "
+          f"{written / fps:.1f} s of video): {os.path.abspath(out_path)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the HW2 demo video, or a video of a whole run")
+    parser.add_argument("--sequence", type=str, default=None,
+                        help="Output directory of one mmdet3d_inference2.py run (sequence mode)")
+    parser.add_argument("--manifest", type=str, default=None,
+                        help="Frames of the sequence: run_journal.jsonl, a JSON list or a text list of basenames")
+    parser.add_argument("--out", type=str, default=None,
+                        help="Video path (default: results/<run folder>_sequence.mp4)")
+    parser.add_argument("--panels", type=str, default="2d,bev", help="Comma-separated panels: 2d, bev")
+    parser.add_argument("--fps", type=float, default=10.0, help="Video rate; 10 = KITTI / nuScenes LiDAR rate")
+    parser.add_argument("--panel-height", type=int, default=480)
+    parser.add_argument("--workers", type=int, default=4, help="Decode / compose threads")
+    parser.add_argument("--read-ahead", type=int, default=16, help="Maximum frames decoded ahead of the writer")
+    parser.add_argument("--bev-range", type=float, nargs=4, default=list(DEFAULT_RANGE),
+                        metavar=("X_MIN", "Y_MIN", "X_MAX", "Y_MAX"),
+                        help="Area of BEV panels rendered here (runs without --bev)")
+    parser.add_argument("--bev-resolution", type=float, default=0.1)
+    args = parser.parse_args()
+
+    if not args.sequence:
+        make_stills_video()
+        return
 
-    if img.shape[:2] != (height, width):
-        img = cv2.resize(img, (width, height))
+    panels = [p.strip() for p in args.panels.split(",") if p.strip()]
+    unknown = [p for p in panels if p not in PANELS]
+    if unknown or not panels:
+        parser.error(f"--panels takes {', '.join(PANELS)}")
+    out_path = args.out or os.path.join("results", f"{os.path.basename(os.path.normpath(args.sequence))}_sequence.mp4")
+    make_sequence_video(args.sequence, out_path, manifest=args.manifest, panels=panels, fps=args.fps,
+                        panel_height=args.panel_height, workers=args.workers, read_ahead=args.read_ahead,
+                        bev_range=args.bev_range, bev_resolution=args.bev_resolution)
 
-    for _ in range(repeat_frames):
-        video.write(img)
 
-video.release()
-print("\nDemo video created successfully:")
-print(os.path.abspath(out_path))
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,14 @@
 import os
+import re
+import sys
+import json
+import time
+import hashlib
+import bisect
 import argparse
+import functools
+import contextlib
+from collections import deque
 from pathlib import Path
 import numpy as np
 
@@ -31,6 +40,26 @@ except ImportError:
     print("Please install it: pip install opencv-python-headless")
     exit()
 
+from kitti_labels import DETECTION_CLASSES, class_mask, load_kitti_label_file
+from point_ops import (get_point_cloud_range, preprocess_points, height_range, points_in_boxes,
+                       decimate_indices, lod_indices)
+from ply_io import (PLY_FORMATS, POINTS_GZ_SUFFIX, POINTS_REF_SUFFIX, POINTS_LOD_SUFFIX, MAX_LOD_LEVELS,
+                    point_ply_path, point_ply_bytes, points_ref_bytes, encode_line_set_ply, encode_mesh_ply)
+import cpu_tuning
+from dense_export import ExportedInferencer
+from voxelizer import Voxelizer, install_voxelizer
+from ensemble import EnsembleInferencer
+from artifact_writer import ArtifactWriter
+from run_archive import ArchiveWriter
+from bev_render import DEFAULT_RANGE as DEFAULT_BEV_RANGE, render_bev, encode_png
+from stroke_font import layout_text
+
+try:
+    # Optional: kernel file events for --watch; falls back to polling when missing
+    from inotify_simple import INotify, flags as inotify_flags
+except ImportError:
+    INotify = None
+
 try:
     import matplotlib.pyplot as plt
 except ImportError:
@@ -39,16 +68,20 @@ except ImportError:
     exit()
 
 
-def load_lidar_file(file_path):
+def load_lidar_file(file_path, load_dim=4, mmap=False):
     """
     Loads a LiDAR file (.bin, .ply, .pcd) and returns (N, C) points.
-    For .bin, assumes (x, y, z, intensity).
+    For .bin, assumes (x, y, z, intensity) unless 'load_dim' says otherwise
+    (nuScenes .pcd.bin files store 5 values per point). With mmap=True a
+    .bin is memory-mapped read-only instead of read into memory.
     """
     ext = os.path.splitext(file_path)[-1]
     
     if ext == '.bin':
         # Assuming KITTI-style .bin (x, y, z, intensity)
-        points = np.fromfile(file_path, dtype=np.float32).reshape(-1, 4)
+        if mmap:
+            return np.memmap(file_path, dtype=np.float32, mode='r').reshape(-1, load_dim)
+        points = np.fromfile(file_path, dtype=np.float32).reshape(-1, load_dim)
         return points
     elif ext in ['.ply', '.pcd']:
         pcd = o3d.io.read_point_cloud(file_path)
@@ -243,6 +276,30 @@ def combine_line_sets(line_sets, color=None):
         combined.paint_uniform_color(color)
     return combined
 
+def save_line_set(writer, path, line_set, tag=None):
+    """Queues a LineSet as a PLY on the artifact writer (a copy of its arrays is encoded off-thread)."""
+    points = np.asarray(line_set.points).copy()
+    lines = np.asarray(line_set.lines).copy()
+    colors = np.asarray(line_set.colors).copy() if line_set.has_colors() else None
+    writer.submit(path, encode_line_set_ply, points, lines, colors,
+                  size_hint=points.nbytes + lines.nbytes, tag=tag)
+
+def save_triangle_mesh(writer, path, mesh, tag=None):
+    """Queues a TriangleMesh as a PLY on the artifact writer."""
+    vertices = np.asarray(mesh.vertices).copy()
+    triangles = np.asarray(mesh.triangles).copy()
+    colors = np.asarray(mesh.vertex_colors).copy() if mesh.has_vertex_colors() else None
+    normals = np.asarray(mesh.vertex_normals).copy() if mesh.has_vertex_normals() else None
+    writer.submit(path, encode_mesh_ply, vertices, triangles, colors, normals,
+                  size_hint=vertices.nbytes * 3 + triangles.nbytes, tag=tag)
+
+def encode_image(img, ext='.png'):
+    """Encodes a BGR image with OpenCV; returns bytes."""
+    ok, buf = cv2.imencode(ext, img)
+    if not ok:
+        raise RuntimeError(f"Could not encode {ext} image")
+    return buf.tobytes()
+
 def create_text_label_3d(text, position, color=[1, 1, 1], size=0.5):
     """
     Creates a compact 3D marker (sphere). Intended for center markers.
@@ -267,8 +324,8 @@ def create_text_stroke_label(text, position, color=[1, 1, 1], scale=0.4):
     Creates a lightweight stroke-based text label as an Open3D LineSet.
     This avoids textures and works in both interactive and headless modes.
 
-    Supported characters: A–Z (uppercase), 0–9, dash and space.
-    For unknown characters, they are skipped. Text is rendered on the XY plane.
+    Supported characters: A–Z (uppercase), 0–9, '-', '_', '.', ':', '%' and space
+    (see stroke_font.GLYPHS). Unknown characters are skipped. Text is rendered on the XY plane.
 
     Args:
         text: String to render (will be uppercased)
@@ -279,81 +336,34 @@ def create_text_stroke_label(text, position, color=[1, 1, 1], scale=0.4):
     Returns:
         Open3D LineSet geometry positioned at 'position'.
     """
-    import numpy as np
-
-    # Basic vector font (normalized to 1x1 box per glyph)
-    # Each glyph is a list of line segments ((x1, y1), (x2, y2))
-    glyphs = {
-        'A': [((0,0), (0.5,1)), ((1,0), (0.5,1)), ((0.25,0.5), (0.75,0.5))],
-        'B': [((0,0), (0,1)), ((0,1), (0.6,1)), ((0.6,1),(0.6,0.5)), ((0.6,0.5),(0,0.5)),
-              ((0,0.5),(0.6,0)), ((0.6,0),(0,0))],
-        'C': [((1,0),(0,0)), ((0,0),(0,1)), ((0,1),(1,1))],
-        'D': [((0,0),(0,1)), ((0,1),(0.7,0.85)), ((0.7,0.85),(0.7,0.15)), ((0.7,0.15),(0,0))],
-        'E': [((1,1),(0,1)), ((0,1),(0,0)), ((0,0),(1,0)), ((0,0.5),(0.6,0.5))],
-        'I': [((0.5,0),(0.5,1))],
-        'L': [((0,1),(0,0)), ((0,0),(1,0))],
-        'N': [((0,0),(0,1)), ((0,1),(1,0)), ((1,0),(1,1))],
-        'O': [((0,0),(1,0)), ((1,0),(1,1)), ((1,1),(0,1)), ((0,1),(0,0))],
-        'P': [((0,0),(0,1)), ((0,1),(0.7,1)), ((0.7,1),(0.7,0.6)), ((0.7,0.6),(0,0.6))],
-        'R': [((0,0),(0,1)), ((0,1),(0.7,1)), ((0.7,1),(0.7,0.6)), ((0.7,0.6),(0,0.6)),
-              ((0,0.6),(0.9,0)),],
-        'S': [((1,1),(0.2,1)), ((0.2,1),(0,0.8)), ((0,0.8),(0.8,0.6)), ((0.8,0.6),(1,0.4)),
-              ((1,0.4),(0.2,0.2)), ((0.2,0.2),(0,0))],
-        'T': [((0,1),(1,1)), ((0.5,1),(0.5,0))],
-        'U': [((0,1),(0,0.2)), ((0,0.2),(1,0.2)), ((1,0.2),(1,1))],
-        'V': [((0,1),(0.5,0)), ((0.5,0),(1,1))],
-        'W': [((0,1),(0.25,0)), ((0.25,0),(0.5,0.5)), ((0.5,0.5),(0.75,0)), ((0.75,0),(1,1))],
-        'X': [((0,0),(1,1)), ((1,0),(0,1))],
-        'Y': [((0,1),(0.5,0.5)), ((1,1),(0.5,0.5)), ((0.5,0.5),(0.5,0))],
-        'Z': [((0,1),(1,1)), ((1,1),(0,0)), ((0,0),(1,0))],
-        '0': [((0,0),(1,0)), ((1,0),(1,1)), ((1,1),(0,1)), ((0,1),(0,0)), ((0,0),(1,1))],
-        '1': [((0.5,0),(0.5,1)), ((0.3,0.2),(0.5,0))],
-        '2': [((0,1),(1,1)), ((1,1),(0,0.5)), ((0,0.5),(1,0)), ((1,0),(0,0))],
-        '3': [((0,1),(1,1)), ((1,1),(0.2,0.6)), ((0.2,0.6),(1,0.3)), ((1,0.3),(0,0))],
-        '4': [((0,1),(0,0.4)), ((1,1),(0,0.4)), ((1,1),(1,0))],
-        '5': [((1,1),(0,1)), ((0,1),(0,0.6)), ((0,0.6),(1,0.6)), ((1,0.6),(1,0)), ((1,0),(0,0))],
-        '6': [((1,1),(0,1)), ((0,1),(0,0)), ((0,0),(1,0)), ((1,0),(1,0.6)), ((1,0.6),(0,0.6))],
-        '7': [((0,1),(1,1)), ((1,1),(0,0))],
-        '8': [((0,0),(1,0)), ((1,0),(1,1)), ((1,1),(0,1)), ((0,1),(0,0)), ((0,0.5),(1,0.5))],
-        '9': [((1,0),(1,1)), ((1,1),(0,1)), ((0,1),(0,0.5)), ((0,0.5),(1,0.5))],
-        '-': [((0,0.5),(1,0.5))],
-        ' ': [],
-    }
-
-    text = (text or '').upper()
-    points = []
-    lines = []
-    cursor_x = 0.0
-    spacing = 0.25  # glyph spacing
-    glyph_w = 1.0
-
-    for ch in text:
-        segments = glyphs.get(ch, [])
-        start_idx = len(points)
-        # Add points for this glyph
-        for (x1, y1), (x2, y2) in segments:
-            # Scale to glyph width and height
-            p1 = [ (cursor_x + x1 * glyph_w) * scale, y1 * scale, 0 ]
-            p2 = [ (cursor_x + x2 * glyph_w) * scale, y2 * scale, 0 ]
-            points.append(p1)
-            points.append(p2)
-            # Each pair contributes one line between consecutive points
-            lines.append([len(points)-2, len(points)-1])
-        cursor_x += glyph_w + spacing
-
-    # Convert to numpy arrays and translate to position
-    if len(points) == 0:
+    ls = create_text_stroke_labels([text], [position], color=color, scale=scale)
+    if ls.is_empty():
         # Fallback: simple small sphere if text empty/unsupported
         return create_text_label_3d('', position, color=color, size=scale)
+    return ls
 
-    pts = np.array(points)
-    pts[:, 0] += position[0]
-    pts[:, 1] += position[1]
-    pts[:, 2] += position[2]
+def create_text_stroke_labels(texts, positions, color=[1, 1, 1], scale=0.4):
+    """
+    Lays out the labels of a whole frame in one vectorized pass (glyph
+    tables are built once in stroke_font) and returns them as a single LineSet.
 
+    Args:
+        texts: Label strings, e.g. 'Car 0.87'
+        positions: One 3D baseline position per label
+        color: RGB color for the strokes
+        scale: Overall scale of the rendered text
+
+    Returns:
+        Open3D LineSet with the strokes of all labels (empty when there are none).
+    """
     ls = o3d.geometry.LineSet()
-    ls.points = o3d.utility.Vector3dVector(pts)
-    ls.lines = o3d.utility.Vector2iVector(np.array(lines, dtype=np.int32))
+    if len(texts) == 0:
+        return ls
+    points, lines, _ = layout_text(texts, positions, scale=scale)
+    if len(lines) == 0:
+        return ls
+    ls.points = o3d.utility.Vector3dVector(points)
+    ls.lines = o3d.utility.Vector2iVector(lines)
     ls.paint_uniform_color(color)
     return ls
 
@@ -380,56 +390,29 @@ def get_bbox_center(bbox_tensor):
     # Convert bottom-center z -> geometric center for marker placement
     return [x, y, z + dz/2.0]
 
-def load_kitti_gt_labels(label_file):
+def load_kitti_gt_labels(label_file, calib_file=None):
     """
     Loads KITTI-style ground truth labels from a .txt file.
-    Only loads 'Car', 'Van', 'Truck' and converts to 7D bbox format.
+    Only loads 'Car', 'Van', 'Truck', 'Pedestrian', 'Cyclist' and converts to 7D bbox format.
     (h, w, l, x, y, z, yaw) -> (x_cam, y_cam, z_cam, l, w, h, yaw_lidar)
+
+    Parsing is vectorized and cached per file in kitti_labels.py.
+    With the frame's calib file the location is mapped by
+    inv(R0_rect @ Tr_velo_to_cam); without it the axes are only swapped:
+      - x_lidar = z_cam
+      - y_lidar = -x_cam
+      - z_lidar = -y_cam (KITTI 'y_cam' is the bottom-center, so no h/2 offset)
+    In both cases yaw_lidar = -yaw_cam - pi/2 (as in mmdet3d).
     
-    Returns: List of 7D bbox tensors [x, y, z, l, w, h, yaw] in LiDAR coords.
+    Returns: (N, 7) float32 array of bboxes [x, y, z, l, w, h, yaw] in LiDAR coords.
     """
-    gt_bboxes = []
-    with open(label_file, 'r') as f:
-        for line in f:
-            parts = line.strip().split(' ')
-            obj_type = parts[0]
-            
-            # We only care about objects for detection
-            if obj_type not in ['Car', 'Van', 'Truck', 'Pedestrian', 'Cyclist']:
-                continue
-                
-            # h, w, l (dimensions in camera_coords)
-            h, w, l = map(float, parts[8:11])
-            
-            # x, y, z (center in camera_coords)
-            x_cam, y_cam, z_cam = map(float, parts[11:14])
-            
-            # yaw (in camera_coords)
-            yaw_cam = float(parts[14])
-            
-            # Convert camera-coord box to LiDAR-coord box
-            # 1. (x, y, z, l, w, h, yaw)_cam
-            # 2. (x, y, z, l, w, h, yaw)_lidar
-            # In mmdet3d (for KITTI):
-            #   - x_lidar = z_cam
-            #   - y_lidar = -x_cam
-            #   - z_lidar = -y_cam + h/2 (to get center)
-            #   - l_lidar = l
-            #   - w_lidar = w
-            #   - h_lidar = h
-            #   - yaw_lidar = -yaw_cam - pi/2
-            
-            x_lidar = z_cam
-            y_lidar = -x_cam
-            # KITTI 'y_cam' is the bottom-center in camera coords; using -y_cam aligns
-            # GT centers with LiDAR z without adding h/2 offset, which can bias height.
-            z_lidar = -y_cam
-            yaw_lidar = -yaw_cam - (np.pi / 2.0)
-            
-            # We use [x, y, z, l, w, h, yaw]
-            gt_bboxes.append(np.array([x_lidar, y_lidar, z_lidar, l, w, h, yaw_lidar]))
-            
-    return gt_bboxes
+    try:
+        labels = load_kitti_label_file(label_file, calib_file)
+    except ValueError as e:
+        # Not a KITTI calib file (no R0_rect / Tr_velo_to_cam)
+        print(f"  > Warning: {e}; GT boxes are placed without calibration.")
+        labels = load_kitti_label_file(label_file)
+    return labels['boxes'][class_mask(labels, DETECTION_CLASSES)]
 
 def read_kitti_calib(calib_file):
     """
@@ -486,10 +469,11 @@ def project_lidar_to_image(points_lidar, P2, Tr_velo_to_rect):
     return points_img, in_front
 
 def draw_projected_boxes_on_image(image_path, calib_path, pred_bboxes_3d, gt_bboxes_3d, out_path,
-                                  pred_labels=None, class_names=None):
+                                  pred_labels=None, class_names=None, writer=None, tag=None):
     """
     Loads an image, reads calibration, projects 3D boxes (pred and gt),
-    overlays predicted class labels, and saves the visualized image.
+    overlays predicted class labels, and saves the visualized image
+    (encoded and written by 'writer', an ArtifactWriter, when given).
     """
     try:
         img = cv2.imread(image_path)
@@ -561,11 +545,23 @@ def draw_projected_boxes_on_image(image_path, calib_path, pred_bboxes_3d, gt_bbo
     # Draw Predicted boxes (Red) with labels
     _draw_boxes(pred_bboxes_3d, (0, 0, 255), labels=pred_labels, cls_names=class_names)
 
-    cv2.imwrite(out_path, img)
+    if writer is None:
+        writer = ArtifactWriter(workers=0)
+    writer.submit(out_path, encode_image, img, Path(out_path).suffix or '.png', size_hint=img.nbytes, tag=tag)
     print(f"  > Saved 2D visualization: {out_path}")
 
+def resolve_class_names(predictions_dict):
+    """Class names from the prediction metainfo; falls back to the KITTI classes."""
+    metainfo = predictions_dict.get('metainfo', {}) if isinstance(predictions_dict, dict) else {}
+    class_names = metainfo.get('classes', None)
+    if class_names is None:
+        class_names = ['Car', 'Pedestrian', 'Cyclist']
+    return class_names
+
 def visualize_with_open3d(lidar_file, predictions_dict, gt_bboxes, out_dir, basename, 
-                          headless=False, img_file=None, calib_file=None):
+                          headless=False, ply_format='float32', load_dim=4,
+                          vis_max_points=None, vis_voxel=None, vis_lod_levels=0, writer=None,
+                          outputs=('3d', 'labels')):
     """
     Visualizes the point cloud and predicted/gt boxes using Open3D with enhanced features.
     Saves to .ply in headless mode, otherwise shows an interactive window.
@@ -577,114 +573,151 @@ def visualize_with_open3d(lidar_file, predictions_dict, gt_bboxes, out_dir, base
         out_dir: Output directory for saving files
         basename: Base name for output files
         headless: Whether to run in headless mode
-        img_file: Optional path to corresponding image file
-        calib_file: Optional path to calibration file
+        ply_format: Headless point artifact format (see ply_io.PLY_FORMATS)
+        load_dim: Values per point in a .bin file
+        vis_max_points, vis_voxel: Decimate the displayed / saved points to this
+            budget or one point per voxel of this edge (points inside the
+            predicted and GT boxes are always kept)
+        vis_lod_levels: In headless mode, also write this many disjoint
+            coarse-to-fine '_points_lod<i>.ply' files for progressive loading
+        writer: ArtifactWriter that encodes and writes the output files
+            (synchronous when None); jobs are tagged with 'basename'
+        outputs: Parts to build: '3d' (points and boxes) and/or 'labels'
+            (top text labels); nothing else is loaded or constructed. The
+            coordinate axes are written once per run by main()
     """
-    # Load the point cloud (N, 4)
-    points = load_lidar_file(lidar_file)
-    pcd = o3d.geometry.PointCloud()
-    pcd.points = o3d.utility.Vector3dVector(points[:, :3])
-    
-    # Color points by height with high contrast colors (blue to red)
-    pcd_colors = color_points_by_height(points)
-    pcd.colors = o3d.utility.Vector3dVector(pcd_colors)
-    
+    if writer is None:
+        writer = ArtifactWriter(workers=0)
+    with_3d = '3d' in outputs
+    with_labels = 'labels' in outputs
+
     # Get predicted boxes and labels
     pred_bboxes_list = predictions_dict['bboxes_3d']
     pred_bboxes_tensor = np.array(pred_bboxes_list)
-    
-    # Get predicted labels if available
     pred_labels = predictions_dict.get('labels_3d', [])
     pred_scores = predictions_dict.get('scores_3d', [])
-    
-    # Create geometries list starting with point cloud
-    geometries = [pcd]
-    
-    # Add compact coordinate frame at origin (smaller to avoid overflow)
-    coordinate_frame = o3d.geometry.TriangleMesh.create_coordinate_frame(size=1.0)
-    geometries.append(coordinate_frame)
-    
+    class_names = resolve_class_names(predictions_dict)
+
+    # Create geometries list (window only) starting with point cloud
+    geometries = []
+    if with_3d:
+        # Load the point cloud (N, load_dim)
+        points = load_lidar_file(lidar_file, load_dim=load_dim, mmap=True)
+        if ply_format == 'ref' and Path(lidar_file).suffix != '.bin':
+            print("  > Warning: --ply-format ref needs a .bin source; writing float32 points instead.")
+            ply_format = 'float32'
+
+        # Color points by height with high contrast colors (blue to red)
+        write_lods = headless and vis_lod_levels > 1
+        needs_colors = not headless or ply_format != 'ref' or write_lods
+        pcd_colors = color_points_by_height(points) if needs_colors else None
+
+        # Level of detail: full resolution inside the predicted / GT boxes, uniform decimation elsewhere
+        vis_points, vis_colors = points, pcd_colors
+        in_boxes = None
+        if vis_max_points or vis_voxel or write_lods:
+            box_list = [np.asarray(b, dtype=float).reshape(-1)[:7]
+                        for b in list(pred_bboxes_list) + list(gt_bboxes)]
+            in_boxes = points_in_boxes(points, np.asarray(box_list).reshape(-1, 7), margin=0.2)
+        if vis_max_points or vis_voxel:
+            keep_idx = decimate_indices(points, max_points=vis_max_points, voxel_size=vis_voxel, keep_mask=in_boxes)
+            vis_points = points[keep_idx]
+            vis_colors = pcd_colors[keep_idx] if pcd_colors is not None else None
+            print(f"  > Preview keeps {keep_idx.size}/{points.shape[0]} points ({int(in_boxes.sum())} inside boxes)")
+
+        if not headless:
+            # Headless runs write the points with ply_io; Open3D only needs them for the window
+            pcd = o3d.geometry.PointCloud()
+            pcd.points = o3d.utility.Vector3dVector(vis_points[:, :3])
+            pcd.colors = o3d.utility.Vector3dVector(vis_colors)
+            geometries.append(pcd)
+            # Add compact coordinate frame at origin (smaller to avoid overflow)
+            geometries.append(o3d.geometry.TriangleMesh.create_coordinate_frame(size=1.0))
+
     # Create geometries for predicted boxes (Green)
     pred_line_sets = []
-    pred_text_line_sets = []
-    # Resolve class names if provided in metainfo; fallback to KITTI classes
-    metainfo = predictions_dict.get('metainfo', {}) if isinstance(predictions_dict, dict) else {}
-    class_names = metainfo.get('classes', None)
-    if class_names is None:
-        class_names = ['Car', 'Pedestrian', 'Cyclist']
-
+    pred_label_texts = []
+    pred_label_positions = []
     for i, bbox in enumerate(pred_bboxes_tensor):
-        bbox_lines = create_open3d_bbox(bbox, color=[0.0, 1.0, 0.0])  # Green
-        pred_line_sets.append(bbox_lines)
-        geometries.append(bbox_lines)
-        # Center marker: single green dot for predictions
-        center_pos = get_bbox_center(bbox)
-        pred_center = create_text_label_3d('', center_pos, color=[0.0, 1.0, 0.0], size=0.14)
-        geometries.append(pred_center)
-
-        # Add class label text at top center of box
-        cls_id = None
-        if isinstance(pred_labels, (list, np.ndarray)) and i < len(pred_labels):
-            try:
-                cls_id = int(pred_labels[i])
-            except Exception:
-                cls_id = None
-        cls_name = class_names[cls_id] if (cls_id is not None and 0 <= cls_id < len(class_names)) else 'OBJ'
-        top_pos = get_bbox_top_center(bbox)
-        text_ls = create_text_stroke_label(cls_name, top_pos, color=[1.0, 1.0, 1.0], scale=0.6)
-        geometries.append(text_ls)
-        pred_text_line_sets.append(text_ls)
+        if with_3d:
+            bbox_lines = create_open3d_bbox(bbox, color=[0.0, 1.0, 0.0])  # Green
+            pred_line_sets.append(bbox_lines)
+            if not headless:
+                geometries.append(bbox_lines)
+                # Center marker: single green dot for predictions
+                center_pos = get_bbox_center(bbox)
+                geometries.append(create_text_label_3d('', center_pos, color=[0.0, 1.0, 0.0], size=0.14))
+
+        if with_labels:
+            # Add class label text at top center of box
+            cls_id = None
+            if isinstance(pred_labels, (list, np.ndarray)) and i < len(pred_labels):
+                try:
+                    cls_id = int(pred_labels[i])
+                except Exception:
+                    cls_id = None
+            cls_name = class_names[cls_id] if (cls_id is not None and 0 <= cls_id < len(class_names)) else 'OBJ'
+            label_text = f"{cls_name} {float(pred_scores[i]):.2f}" if i < len(pred_scores) else cls_name
+            pred_label_texts.append(label_text)
+            pred_label_positions.append(get_bbox_top_center(bbox))
+
+    # All top text labels of the frame as one LineSet
+    pred_text = create_text_stroke_labels(pred_label_texts, pred_label_positions, color=[1.0, 1.0, 1.0], scale=0.6)
+    if not pred_text.is_empty() and not headless:
+        geometries.append(pred_text)
     
     # Create geometries for ground truth boxes (Red)
     gt_line_sets = []
-    for i, bbox in enumerate(gt_bboxes):
+    for bbox in gt_bboxes if with_3d else []:
         bbox_lines = create_open3d_bbox(bbox, color=[1.0, 0.0, 0.0])  # Red
         gt_line_sets.append(bbox_lines)
-        geometries.append(bbox_lines)
-        # Center marker: single red dot for GT
-        gt_center = get_bbox_center(bbox)
-        gt_center_marker = create_text_label_3d('', gt_center, color=[1.0, 0.0, 0.0], size=0.12)
-        geometries.append(gt_center_marker)
-
-# Generate 2D visualization if image and calibration data are provided
-    if img_file and calib_file:
-        try:
-            img_2d_vis_path = Path(out_dir) / f"{basename}_2d_vis.png"
-            draw_projected_boxes_on_image(img_file, calib_file, pred_bboxes_tensor, gt_bboxes, str(img_2d_vis_path), pred_labels=pred_labels, class_names=class_names)
-        except Exception as e:
-            print(f"  > Warning: Could not generate 2D visualization. {e}")
-    
+        if not headless:
+            geometries.append(bbox_lines)
+            # Center marker: single red dot for GT
+            gt_center = get_bbox_center(bbox)
+            geometries.append(create_text_label_3d('', gt_center, color=[1.0, 0.0, 0.0], size=0.12))
+
     if headless:
         print(f"  > Headless mode. Saving to .ply files in {out_dir}")
         pcd_file = Path(out_dir) / f"{basename}_points.ply"
-        axes_file = Path(out_dir) / f"{basename}_axes.ply"
         pred_bbox_file = Path(out_dir) / f"{basename}_pred_bboxes.ply"
         pred_label_file = Path(out_dir) / f"{basename}_pred_labels.ply"
         gt_bbox_file = Path(out_dir) / f"{basename}_gt_bboxes.ply"
         
-        o3d.io.write_point_cloud(str(pcd_file), pcd)
-        
-        # Save coordinate frame mesh
-        o3d.io.write_triangle_mesh(str(axes_file.with_suffix('.ply')), coordinate_frame)
+        if with_3d:
+            if ply_format == 'ref':
+                # A reference always stands for the full sweep
+                pcd_file = Path(out_dir) / f"{basename}{POINTS_REF_SUFFIX}"
+                writer.write_bytes(pcd_file, points_ref_bytes(lidar_file, load_dim=points.shape[1],
+                                                              z_range=height_range(points)), tag=basename)
+            else:
+                pcd_file = point_ply_path(pcd_file, ply_format)
+                writer.submit(pcd_file, point_ply_bytes, vis_points[:, :3], vis_colors, ply_format,
+                              size_hint=vis_points.shape[0] * 12 + vis_colors.nbytes, tag=basename)
+            if write_lods:
+                levels = lod_indices(points, vis_lod_levels, base_voxel=vis_voxel or 0.1, keep_mask=in_boxes)
+                lod_format = 'float32' if ply_format == 'ref' else ply_format
+                for level, idx in enumerate(levels):
+                    lod_file = point_ply_path(Path(out_dir) / f"{basename}{POINTS_LOD_SUFFIX.format(level)}",
+                                              lod_format)
+                    lod_xyz, lod_colors = points[idx, :3], pcd_colors[idx]
+                    writer.submit(lod_file, point_ply_bytes, lod_xyz, lod_colors, lod_format,
+                                  size_hint=lod_xyz.nbytes + lod_colors.nbytes, tag=basename)
+                print(f"  > Saved {len(levels)} LOD levels: {', '.join(str(idx.size) for idx in levels)} points")
+            print(f"  > Saved points: {pcd_file}")
         
         # Save bounding boxes (combine into single LineSet for each group)
         if len(pred_line_sets) > 0:
             combined_pred = combine_line_sets(pred_line_sets, color=[0.0, 1.0, 0.0])
-            o3d.io.write_line_set(str(pred_bbox_file), combined_pred)
+            save_line_set(writer, pred_bbox_file, combined_pred, tag=basename)
+            print(f"  > Saved pred bboxes: {pred_bbox_file}")
         if len(gt_line_sets) > 0:
             combined_gt = combine_line_sets(gt_line_sets, color=[1.0, 0.0, 0.0])
-            o3d.io.write_line_set(str(gt_bbox_file), combined_gt)
-            
-        print(f"  > Saved points: {pcd_file}")
-        print(f"  > Saved coordinate axes: {axes_file}")
-        if len(pred_bboxes_tensor) > 0:
-            print(f"  > Saved pred bboxes: {pred_bbox_file}")
-        if len(gt_bboxes) > 0:
+            save_line_set(writer, gt_bbox_file, combined_gt, tag=basename)
             print(f"  > Saved gt bboxes: {gt_bbox_file}")
         # Save predicted top text labels in headless mode
-        if len(pred_text_line_sets) > 0:
-            combined_text = combine_line_sets(pred_text_line_sets, color=[1.0, 1.0, 1.0])
-            o3d.io.write_line_set(str(pred_label_file), combined_text)
+        if not pred_text.is_empty():
+            save_line_set(writer, pred_label_file, pred_text, tag=basename)
     else:
         print(f"  > Displaying Open3D visualization for {basename}...")
         print(f"  > Point cloud colored with turbo colormap (rainbow-like, high contrast)")
@@ -699,26 +732,13 @@ def visualize_with_open3d(lidar_file, predictions_dict, gt_bboxes, out_dir, base
             height=900
         )
 
-def find_matching_file(basename, directory, extensions):
-    """
-    Find a file with the given basename and one of the given extensions in the directory.
-    
-    Args:
-        basename: Base filename without extension
-        directory: Directory to search in (can be None)
-        extensions: List of extensions to try (e.g., ['.png', '.jpg'])
-    
-    Returns:
-        Full path to matching file, or None if not found
-    """
-    if not directory or not os.path.isdir(directory):
-        return None
-        
-    for ext in extensions:
-        candidate = os.path.join(directory, basename + ext)
-        if os.path.isfile(candidate):
-            return candidate
-    return None
+RUN_AXES_NAME = 'axes.ply'
+
+def write_run_axes(writer, out_dir):
+    """Writes the coordinate axes mesh, identical for every frame, once per run as <out_dir>/axes.ply."""
+    axes_file = Path(out_dir) / RUN_AXES_NAME
+    save_triangle_mesh(writer, axes_file, o3d.geometry.TriangleMesh.create_coordinate_frame(size=1.0))
+    print(f"Saved coordinate axes: {axes_file}")
 
 def build_kitti_input_list(base_folder, frame_number=None):
     """
@@ -844,7 +864,147 @@ def build_waymokitti_input_list(base_folder, frame_number=None):
     return inputs_list
 
 
-def build_input_dict(primary_file, modality, img_dir, calib_dir, gt_label_dir):
+IMG_EXTS = ['.png', '.jpg', '.jpeg']
+CALIB_EXTS = ['.txt']
+GT_LABEL_EXTS = ['.txt']
+
+# nuScenes-style sample names: <log>__<CHANNEL>__<timestamp_us>[.pcd]
+NUSCENES_NAME_RE = re.compile(r'__(?P<channel>[A-Z0-9_]+?)__(?P<timestamp>\d{10,})')
+
+
+def index_directory(directory, extensions):
+    """
+    List a directory once and map each file stem to its path.
+
+    When several files share a stem, the extension that comes first in
+    'extensions' wins (e.g. '.png' over '.jpg').
+
+    Args:
+        directory: Directory to index (can be None)
+        extensions: List of accepted extensions (e.g., ['.png', '.jpg'])
+
+    Returns:
+        Dict {stem: full_path}; empty if the directory is missing.
+    """
+    if not directory or not os.path.isdir(directory):
+        return {}
+
+    priority = {ext: rank for rank, ext in enumerate(extensions)}
+    index = {}
+    ranks = {}
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            stem, ext = os.path.splitext(entry.name)
+            rank = priority.get(ext)
+            if rank is None or not entry.is_file():
+                continue
+            if stem not in index or rank < ranks[stem]:
+                index[stem] = entry.path
+                ranks[stem] = rank
+    return index
+
+
+def parse_nuscenes_name(name):
+    """
+    Extract (channel, timestamp_us) from a nuScenes-style file name such as
+    'n015-...__CAM_FRONT__1532402927612460'. Returns (None, None) otherwise.
+    """
+    match = NUSCENES_NAME_RE.search(name)
+    if not match:
+        return None, None
+    return match.group('channel'), int(match.group('timestamp'))
+
+
+def build_timestamp_index(index):
+    """
+    Group an index from index_directory by sensor channel for timestamp lookups.
+
+    Returns:
+        Dict {channel: (sorted_timestamps, paths)} with paths aligned to timestamps.
+    """
+    per_channel = {}
+    for stem, path in index.items():
+        channel, timestamp = parse_nuscenes_name(stem)
+        if channel is None:
+            continue
+        per_channel.setdefault(channel, []).append((timestamp, path))
+
+    ts_index = {}
+    for channel, items in per_channel.items():
+        items.sort()
+        ts_index[channel] = ([t for t, _ in items], [p for _, p in items])
+    return ts_index
+
+
+def match_by_timestamp(name, ts_index, tolerance_ms):
+    """
+    Find, for every channel in ts_index, the file closest in time to 'name'.
+
+    Args:
+        name: Primary file stem carrying a nuScenes-style timestamp
+        ts_index: Output of build_timestamp_index
+        tolerance_ms: Maximum accepted time difference in milliseconds
+
+    Returns:
+        Dict {channel: path}; channels without a match in tolerance are omitted.
+    """
+    _, timestamp = parse_nuscenes_name(name)
+    if timestamp is None:
+        return {}
+
+    tolerance_us = tolerance_ms * 1000.0
+    matches = {}
+    for channel, (timestamps, paths) in ts_index.items():
+        pos = bisect.bisect_left(timestamps, timestamp)
+        best = None
+        for cand in (pos - 1, pos):
+            if 0 <= cand < len(timestamps):
+                delta = abs(timestamps[cand] - timestamp)
+                if delta <= tolerance_us and (best is None or delta < best[0]):
+                    best = (delta, paths[cand])
+        if best is not None:
+            matches[channel] = best[1]
+    return matches
+
+
+def build_directory_indexes(img_dir, calib_dir, gt_label_dir, timestamp_tolerance_ms=None):
+    """
+    Index the optional image/calib/label directories once for a whole run,
+    so that pairing each primary file is a dict lookup instead of stat calls.
+
+    Returns:
+        Dict with 'img', 'calib', 'gt_label' stem indexes and, when
+        timestamp matching is enabled, an 'img_ts' per-channel index.
+    """
+    for flag, directory in (('--img-dir', img_dir), ('--calib-dir', calib_dir),
+                            ('--gt-label-dir', gt_label_dir)):
+        if directory and not os.path.isdir(directory):
+            print(f"Warning: {flag} '{directory}' is not a valid directory.")
+
+    indexes = {
+        'img': index_directory(img_dir, IMG_EXTS),
+        'calib': index_directory(calib_dir, CALIB_EXTS),
+        'gt_label': index_directory(gt_label_dir, GT_LABEL_EXTS),
+        'img_dir': img_dir if img_dir and os.path.isdir(img_dir) else None,
+        'calib_dir': calib_dir if calib_dir and os.path.isdir(calib_dir) else None,
+        'gt_label_dir': gt_label_dir if gt_label_dir and os.path.isdir(gt_label_dir) else None,
+        'timestamp_tolerance_ms': timestamp_tolerance_ms,
+    }
+    if timestamp_tolerance_ms is not None:
+        indexes['img_ts'] = build_timestamp_index(indexes['img'])
+    return indexes
+
+
+def indexes_cover(indexes, basename):
+    """True when every indexed companion directory has a match for 'basename'."""
+    if indexes['img_dir'] and basename not in indexes['img']:
+        if 'img_ts' not in indexes or not match_by_timestamp(basename, indexes['img_ts'],
+                                                             indexes['timestamp_tolerance_ms']):
+            return False
+    return all(basename in indexes[kind] for kind in ('calib', 'gt_label') if indexes[f'{kind}_dir'])
+
+
+def build_input_dict(primary_file, modality, img_dir, calib_dir, gt_label_dir, indexes=None):
     """
     Build input dictionary for a single sample, finding matching files in provided directories.
     
@@ -854,10 +1014,15 @@ def build_input_dict(primary_file, modality, img_dir, calib_dir, gt_label_dir):
         img_dir: Directory containing image files (can be None)
         calib_dir: Directory containing calibration files (can be None)
         gt_label_dir: Directory containing ground truth label files (can be None)
+        indexes: (Optional) Output of build_directory_indexes, shared across a
+            folder run. Built on the fly for single-file runs.
     
     Returns:
         Dictionary with input file paths
     """
+    if indexes is None:
+        indexes = build_directory_indexes(img_dir, calib_dir, gt_label_dir)
+
     basename = Path(primary_file).stem
     input_dict = {}
 
@@ -868,37 +1033,35 @@ def build_input_dict(primary_file, modality, img_dir, calib_dir, gt_label_dir):
         input_dict['points'] = str(primary_file)
         
     # --- 1. Find matching image file ---
-    img_exts = ['.png', '.jpg', '.jpeg']
-    if img_dir and os.path.isdir(img_dir):
-        img_file = find_matching_file(basename, img_dir, img_exts)
+    if indexes['img_dir']:
+        img_file = indexes['img'].get(basename)
+        if img_file is None and 'img_ts' in indexes:
+            # nuScenes-style names: cameras and LiDAR share no stem, pair by timestamp
+            cam_imgs = match_by_timestamp(basename, indexes['img_ts'],
+                                          indexes['timestamp_tolerance_ms'])
+            if cam_imgs:
+                input_dict['cam_imgs'] = cam_imgs
+                img_file = cam_imgs.get('CAM_FRONT', cam_imgs[sorted(cam_imgs)[0]])
         if img_file:
             input_dict['img'] = img_file
         elif modality == 'multi-modal':
             print(f"Warning: --img-dir provided, but no matching image for {basename} found.")
-    elif img_dir and not os.path.isdir(img_dir):
-        print(f"Warning: --img-dir '{img_dir}' is not a valid directory.")
 
     # --- 2. Find matching calibration file ---
-    calib_exts = ['.txt']
-    if calib_dir and os.path.isdir(calib_dir):
-        calib_file = find_matching_file(basename, calib_dir, calib_exts)
+    if indexes['calib_dir']:
+        calib_file = indexes['calib'].get(basename)
         if calib_file:
             input_dict['calib'] = calib_file
         else:
             print(f"Warning: --calib-dir provided, but no matching calib file for {basename} found.")
-    elif calib_dir and not os.path.isdir(calib_dir):
-        print(f"Warning: --calib-dir '{calib_dir}' is not a valid directory.")
 
     # --- 3. Find matching ground truth label file ---
-    gt_exts = ['.txt']
-    if gt_label_dir and os.path.isdir(gt_label_dir):
-        gt_file = find_matching_file(basename, gt_label_dir, gt_exts)
+    if indexes['gt_label_dir']:
+        gt_file = indexes['gt_label'].get(basename)
         if gt_file:
             input_dict['gt_label'] = gt_file
         else:
             print(f"Warning: --gt-label-dir provided, but no matching label for {basename} found.")
-    elif gt_label_dir and not os.path.isdir(gt_label_dir):
-        print(f"Warning: --gt-label-dir '{gt_label_dir}' is not a valid directory.")
 
     return input_dict
 
@@ -971,10 +1134,14 @@ PRESET_CONFIGS = {
         "headless": True,
     },
 }
-def apply_preset_from_model(args):
+def apply_preset_from_model(args, explicit_args=()):
     """
     If args.model matches one of our PRESET_CONFIGS keys, override
     the other arguments so you only need to type --dataset and --model.
+
+    Arguments named in 'explicit_args' (given on the command line) keep
+    their value, so experiment sweeps can vary e.g. --score-thr or --device
+    of a preset model.
     """
     preset = PRESET_CONFIGS.get(args.model)
     if not preset:
@@ -986,6 +1153,8 @@ def apply_preset_from_model(args):
     for key, value in preset.items():
         if value is None:
             continue  # skip None fields like frame_number for nuscenes
+        if key in explicit_args:
+            continue  # command line wins over the preset
 
         if key == "headless":
             if value:
@@ -997,6 +1166,710 @@ def apply_preset_from_model(args):
     return args
 
 
+def get_pipeline_transform_cfg(cfg, transform_type):
+    """
+    Returns the first transform of type 'transform_type' in the test pipeline
+    of an mmengine config, or None.
+    """
+    try:
+        pipeline = cfg.test_dataloader.dataset.pipeline
+    except AttributeError:
+        pipeline = cfg.get('test_pipeline', [])
+    for transform in pipeline:
+        if transform.get('type') == transform_type:
+            return transform
+    return None
+
+
+def strip_pipeline_transform(inferencer, transform_type):
+    """
+    Removes every transform of class 'transform_type' from an inferencer's
+    built pipeline. Returns the number of transforms removed.
+    """
+    transforms = inferencer.pipeline.transforms
+    kept = [t for t in transforms if type(t).__name__ != transform_type]
+    inferencer.pipeline.transforms = kept
+    return len(transforms) - len(kept)
+
+
+def load_sweep_poses(pose_file):
+    """
+    Loads per-sweep poses for multi-sweep aggregation from a JSON file:
+
+        {"<lidar file name or stem>": {"timestamp": <us>,
+                                       "lidar2global": 4x4}, ...}
+
+    Instead of 'lidar2global', 'lidar2ego' and 'ego2global' (as stored in the
+    nuScenes calibrated_sensor / ego_pose tables) may be given.
+
+    Returns:
+        Dict {key: (timestamp_us or None, 4x4 float64 lidar-to-global)}.
+    """
+    with open(pose_file, 'r') as f:
+        raw = json.load(f)
+
+    poses = {}
+    for key, item in raw.items():
+        if 'lidar2global' in item:
+            pose = np.asarray(item['lidar2global'], dtype=np.float64)
+        else:
+            pose = (np.asarray(item['ego2global'], dtype=np.float64)
+                    @ np.asarray(item['lidar2ego'], dtype=np.float64))
+        poses[key] = (item.get('timestamp'), pose)
+    return poses
+
+
+class SweepAggregator:
+    """
+    Rolling ring buffer of the last K LiDAR sweeps and their poses, mirroring
+    mmdet3d's LoadPointsFromMultiSweeps for sequential (streamed or sorted)
+    inputs.
+
+    Every sweep is read from disk once. When a new sweep is pushed, all
+    buffered sweeps are moved into its frame with one batched matmul and
+    returned together with it as (M, 5) [x, y, z, intensity, time_lag]
+    points, time_lag being seconds relative to the newest sweep.
+    """
+
+    def __init__(self, num_sweeps, remove_close=1.0, max_time_gap=1.0):
+        """
+        Args:
+            num_sweeps: Number of previous sweeps to keep (config 'sweeps_num')
+            remove_close: Drop points of previous sweeps with both |x| and |y|
+                below this (meters) in their sensor frame, as
+                LoadPointsFromMultiSweeps does
+            max_time_gap: Clear the buffer when consecutive sweeps are further
+                apart than this (seconds), e.g. at a scene boundary
+        """
+        self.sweeps = deque(maxlen=num_sweeps)
+        self.remove_close = remove_close
+        self.max_time_gap = max_time_gap
+        self.last_num_previous = 0
+
+    def push(self, points, pose, timestamp):
+        """
+        Adds the current sweep and returns it aggregated with the buffer.
+
+        Args:
+            points: (N, >=4) sweep points in its own sensor frame
+            pose: 4x4 sensor-to-global transform of the sweep
+            timestamp: Sweep time in seconds
+
+        Returns:
+            (M, 5) float32 aggregated points in the current sensor frame.
+        """
+        points = np.asarray(points, dtype=np.float32)
+        pose = np.asarray(pose, dtype=np.float64)
+
+        if self.sweeps and not (0.0 <= timestamp - self.sweeps[-1][2] <= self.max_time_gap):
+            self.sweeps.clear()
+
+        current = np.zeros((points.shape[0], 5), dtype=np.float32)
+        current[:, :4] = points[:, :4]
+        chunks = [current]
+
+        # Newest previous sweep first, as in LoadPointsFromMultiSweeps
+        sweeps = list(reversed(self.sweeps))
+        self.last_num_previous = len(sweeps)
+        if sweeps:
+            counts = np.array([s[0].shape[0] for s in sweeps])
+            padded = np.zeros((len(sweeps), counts.max(), 3), dtype=np.float32)
+            for k, (sweep_points, _, _) in enumerate(sweeps):
+                padded[k, :counts[k]] = sweep_points[:, :3]
+
+            # sweep -> global -> current, for all buffered sweeps at once
+            poses = np.stack([s[1] for s in sweeps])
+            rel = (np.linalg.inv(pose) @ poses).astype(np.float32)
+            moved = padded @ rel[:, :3, :3].transpose(0, 2, 1) + rel[:, None, :3, 3]
+
+            valid = np.arange(padded.shape[1])[None, :] < counts[:, None]
+            previous = np.empty((int(counts.sum()), 5), dtype=np.float32)
+            previous[:, :3] = moved[valid]
+            previous[:, 3] = np.concatenate([s[0][:, 3] for s in sweeps])
+            lags = np.array([timestamp - s[2] for s in sweeps], dtype=np.float32)
+            previous[:, 4] = np.repeat(lags, counts)
+            chunks.append(previous)
+
+        aggregated = np.concatenate(chunks, axis=0)
+
+        # Buffer this sweep for the following frames (close points removed once)
+        keep = points
+        if self.remove_close:
+            close = ((np.abs(points[:, 0]) < self.remove_close)
+                     & (np.abs(points[:, 1]) < self.remove_close))
+            keep = points[~close]
+        self.sweeps.append((np.array(keep[:, :4], dtype=np.float32), pose, timestamp))
+        return aggregated
+
+
+def prepare_inferencer_input(single_input, sweep_aggregator=None, sweep_poses=None, load_dim=4,
+                             point_cloud_range=None, ground_threshold=None, voxel_size=None,
+                             mmap_points=False):
+    """
+    Builds what is handed to the inferencer for one input dict.
+
+    Without sweep aggregation, preprocessing or 'mmap_points' this is the
+    input dict itself (the inferencer reads the file). Otherwise the sweep is
+    memory-mapped once, optionally aggregated with the buffered previous
+    sweeps, cropped to point_cloud_range, stripped of ground points and
+    voxel-downsampled, and passed to the inferencer as a 'points' array.
+    """
+    preprocess = point_cloud_range is not None or ground_threshold or voxel_size
+    if 'points' not in single_input or (sweep_aggregator is None and not preprocess and not mmap_points):
+        return single_input
+
+    lidar_file = single_input['points']
+    points = load_lidar_file(lidar_file, load_dim=load_dim, mmap=True)
+
+    if sweep_aggregator is not None:
+        name = Path(lidar_file).name
+        timestamp_us, pose = None, None
+        if sweep_poses:
+            timestamp_us, pose = sweep_poses.get(name, sweep_poses.get(Path(lidar_file).stem, (None, None)))
+        if timestamp_us is None:
+            _, timestamp_us = parse_nuscenes_name(name)
+        if pose is None:
+            print(f"  > Warning: No pose for {name}; assuming a static sensor for sweep aggregation.")
+            pose = np.eye(4)
+        if timestamp_us is None:
+            raise ValueError(f"No timestamp for {name}; add it to --sweep-poses for multi-sweep input.")
+
+        points = sweep_aggregator.push(points, pose, timestamp_us / 1e6)
+        print(f"  > Aggregated {sweep_aggregator.last_num_previous} previous sweep(s): "
+              f"{points.shape[0]} points")
+
+    if preprocess:
+        points, report = preprocess_points(points, point_cloud_range=point_cloud_range,
+                                           ground_threshold=ground_threshold, voxel_size=voxel_size)
+        stages = ", ".join(f"{stage}: {count}" for stage, count in report[1:])
+        print(f"  > Preprocessing kept {report[-1][1]}/{report[0][1]} points ({stages})")
+
+    inferencer_input = dict(single_input)
+    inferencer_input['points'] = np.ascontiguousarray(points, dtype=np.float32)
+    return inferencer_input
+
+
+def current_rss_mb():
+    """Resident set size of this process in MB (peak RSS where /proc is unavailable)."""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError, IndexError):
+        return peak_memory_mb()['peak_rss_mb']
+
+
+def peak_memory_mb():
+    """Peak host RSS and, when CUDA is in use, peak allocated GPU memory in MB."""
+    memory = {'peak_rss_mb': None, 'cuda_peak_mb': None}
+    try:
+        import resource
+        # ru_maxrss is in KB on Linux and bytes on macOS
+        scale = 2**20 if sys.platform == 'darwin' else 2**10
+        memory['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+    except ImportError:
+        pass
+    torch = sys.modules.get('torch')
+    if torch is not None and torch.cuda.is_available() and torch.cuda.is_initialized():
+        memory['cuda_peak_mb'] = torch.cuda.max_memory_allocated() / 2**20
+    return memory
+
+
+class StageTimer:
+    """
+    Collects wall-clock durations per named stage (one sample per frame and
+    repeat) together with the process RSS after each stage, and summarizes
+    them for the run statistics file.
+    """
+
+    def __init__(self):
+        self.samples = {}
+        self.rss_samples = {}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        self.samples.setdefault(name, []).append(seconds)
+        self.rss_samples.setdefault(name, []).append(current_rss_mb())
+
+    def summary(self):
+        """
+        Returns {stage: {'count', 'mean', 'p50', 'p90', 'max', 'total',
+        'rss_mb_p50', 'rss_mb_max'}}; times in seconds.
+        """
+        stats = {}
+        for name, values in self.samples.items():
+            arr = np.asarray(values, dtype=np.float64)
+            rss = np.asarray(self.rss_samples.get(name, [np.nan]), dtype=np.float64)
+            stats[name] = {
+                'count': int(arr.size),
+                'mean': float(arr.mean()),
+                'p50': float(np.percentile(arr, 50)),
+                'p90': float(np.percentile(arr, 90)),
+                'max': float(arr.max()),
+                'total': float(arr.sum()),
+                'rss_mb_p50': float(np.percentile(rss, 50)),
+                'rss_mb_max': float(rss.max()),
+            }
+        return stats
+
+
+RUN_STATS_NAME = 'run_stats.json'
+
+
+def write_run_stats(args, inferencer, timer, num_frames, wall_time, writer=None):
+    """
+    Writes <out_dir>/run_stats.json describing this run (model, thresholds,
+    classes) with its per-stage timing summary, raw per-frame samples and
+    the artifact writer's throughput.
+    """
+    dataset_meta = getattr(getattr(inferencer, 'model', None), 'dataset_meta', None) or {}
+    if isinstance(inferencer, EnsembleInferencer):
+        dataset_meta = {'classes': inferencer.classes}
+    stats = {
+        'model': '+'.join(args.ensemble) if args.ensemble else args.model,
+        'preset': args.model if args.model in PRESET_CONFIGS else None,
+        'ensemble': args.ensemble,
+        'checkpoint': args.checkpoint,
+        'dataset': args.dataset,
+        'input_path': args.input_path,
+        'out_dir': args.out_dir,
+        'device': args.device,
+        'score_thr': args.score_thr,
+        'intra_threads': args.intra_threads,
+        'inter_threads': args.inter_threads,
+        'cpu_backend': args.cpu_backend,
+        'precision': args.precision,
+        'backend': args.backend,
+        'voxelizer': args.voxelizer,
+        'outputs': args.outputs,
+        'archive': args.archive,
+        'classes': list(dataset_meta.get('classes', [])),
+        'num_frames': num_frames,
+        'repeat': args.repeat,
+        'wall_time_sec': wall_time,
+        'memory': peak_memory_mb(),
+        'stages': timer.summary(),
+        'samples': timer.samples,
+        'rss_samples': timer.rss_samples,
+        'artifact_writer': writer.summary() if writer is not None else None,
+    }
+    stats_path = Path(args.out_dir) / RUN_STATS_NAME
+    with open(stats_path, 'w') as f:
+        json.dump(stats, f, indent=2)
+    print(f"Run statistics saved to {stats_path}")
+
+
+def get_input_basename(single_input, modality):
+    """
+    Returns the output basename for one input dict: the KITTI/WaymoKITTI
+    frame id when present, otherwise the stem of the primary file.
+    """
+    if 'frame_id' in single_input:
+        return single_input['frame_id']
+    primary_input_key = 'img' if modality == 'mono' else 'points'
+    return Path(single_input[primary_input_key]).stem
+
+
+def encode_predictions_json(pred_dict):
+    """The _predictions.json content of one prediction dict (arrays as lists)."""
+    serializable_pred_data = {}
+    for k, v in pred_dict.items():
+        if isinstance(v, np.ndarray):
+            serializable_pred_data[k] = v.tolist()
+        else:
+            serializable_pred_data[k] = v
+    return json.dumps(serializable_pred_data, indent=2).encode('utf-8')
+
+
+def process_single_input(inferencer, single_input, args, is_headless, prepare_input=None, timer=None,
+                         writer=None):
+    """
+    Runs inference on one input dict and writes its predictions and
+    visualizations to args.out_dir.
+
+    'prepare_input' optionally maps the input dict to what is passed to the
+    inferencer (see prepare_inferencer_input). Stage durations are recorded
+    in 'timer' (a StageTimer) when given. Output files are encoded and
+    written by 'writer' (an ArtifactWriter, tagged with the basename) and may
+    still be in flight when this returns; without one they are written inline.
+
+    Returns:
+        The basename used for this frame's output files.
+    """
+    if timer is None:
+        timer = StageTimer()
+    if writer is None:
+        writer = ArtifactWriter(workers=0)
+    frame_start = time.perf_counter()
+
+    basename = get_input_basename(single_input, args.modality)
+    print(f"\nRunning inference on input: {basename}")
+    if writer.remove_stale_parts(args.out_dir, basename):
+        print(f"  > Removed unfinished files of {basename} left by an earlier run.")
+
+    # Load GT labels if available
+    gt_bboxes_3d = []
+    if 'gt_label' in single_input:
+        try:
+            with timer.stage('gt_labels'):
+                gt_bboxes_3d = load_kitti_gt_labels(single_input['gt_label'], single_input.get('calib'))
+        except Exception as e:
+            print(f"  > Warning: Could not load GT labels. {e}")
+    
+    # Prepare input for inferencer based on dataset mode
+    # Pass the full dict so inferencer can use all available info
+    inferencer_input = single_input
+    if prepare_input is not None:
+        with timer.stage('prepare'):
+            inferencer_input = prepare_input(single_input)
+    
+    # Run inference
+    with timer.stage('inference'):
+        results_dict = inferencer(
+            inferencer_input,
+            show=False,
+            out_dir=args.out_dir,
+            pred_score_thr=args.score_thr
+        )
+    
+    pred_dict = results_dict['predictions'][0]
+    pred_bboxes_3d = np.array(pred_dict['bboxes_3d'])
+
+    # Save the raw predictions (JSON)
+    if 'predictions' in args.outputs:
+        pred_path = Path(args.out_dir) / f"{basename}_predictions.json"
+        print(f"  > Saving raw predictions to {pred_path}")
+        with timer.stage('save_predictions'):
+            writer.submit(pred_path, encode_predictions_json, dict(pred_dict),
+                          size_hint=1024 + 256 * len(pred_bboxes_3d), tag=basename)
+
+    # --- Generate 2D Visualization (if img and calib are available) ---
+    if '2d' in args.outputs and 'img' in single_input and 'calib' in single_input:
+        img_2d_vis_path = Path(args.out_dir) / f"{basename}_2d_vis.png"
+        with timer.stage('vis_2d'):
+            try:
+                draw_projected_boxes_on_image(
+                    single_input['img'],
+                    single_input['calib'],
+                    pred_bboxes_3d,
+                    gt_bboxes_3d,
+                    str(img_2d_vis_path),
+                    pred_labels=pred_dict.get('labels_3d', []),
+                    class_names=resolve_class_names(pred_dict),
+                    writer=writer,
+                    tag=basename
+                )
+            except Exception as e:
+                print(f"  > Warning: Could not generate 2D visualization. {e}")
+
+    # --- Generate 3D Visualization ---
+    vis_outputs = [o for o in ('3d', 'labels') if o in args.outputs]
+    if args.modality == 'mono':
+        print("  > Monocular model. Skipping Open3D visualization.")
+    elif vis_outputs:
+        # Determine lidar file path based on dataset mode
+        # Use the 'points' key across all modes
+        lidar_file = single_input['points']
+        
+        with timer.stage('vis_3d'):
+            visualize_with_open3d(
+                lidar_file,
+                pred_dict,
+                gt_bboxes_3d,
+                args.out_dir,
+                basename,
+                headless=is_headless,
+                ply_format=args.ply_format,
+                load_dim=getattr(inferencer, 'load_dim', 4),
+                vis_max_points=args.vis_max_points,
+                vis_voxel=args.vis_voxel,
+                vis_lod_levels=args.vis_lod_levels,
+                writer=writer,
+                outputs=vis_outputs
+            )
+
+    # --- BEV raster overview (NumPy, no OpenGL) ---
+    if 'bev' in args.outputs and args.modality != 'mono':
+        bev_path = Path(args.out_dir) / f"{basename}_bev.png"
+        with timer.stage('vis_bev'):
+            bev_points = load_lidar_file(single_input['points'], load_dim=getattr(inferencer, 'load_dim', 4),
+                                         mmap=True)
+            bev_image = render_bev(bev_points, pred_bboxes_3d, gt_bboxes_3d, bev_range=args.bev_range,
+                                   resolution=args.bev_resolution, color_by=args.bev_color)
+            writer.submit(bev_path, encode_png, bev_image, size_hint=bev_image.nbytes, tag=basename)
+        print(f"  > Saved BEV image: {bev_path}")
+
+    # Small files of this frame go out as one batch
+    writer.flush()
+    timer.add('frame_total', time.perf_counter() - frame_start)
+    return basename
+
+
+# Artifact kinds of --outputs; 'bev' is opt-in (--bev)
+OUTPUT_KINDS = ('predictions', '2d', '3d', 'bev', 'labels')
+DEFAULT_OUTPUTS = ('predictions', '2d', '3d', 'labels')
+
+# Per-frame files written next to each other in out_dir ('<basename><suffix>')
+FRAME_ARTIFACT_SUFFIXES = [
+    '_predictions.json',
+    '_2d_vis.png',
+    '_bev.png',
+    '_points.ply',
+    POINTS_GZ_SUFFIX,
+    POINTS_REF_SUFFIX,
+    '_axes.ply',
+    '_pred_bboxes.ply',
+    '_pred_labels.ply',
+    '_gt_bboxes.ply',
+] + [suffix.format(level) for level in range(MAX_LOD_LEVELS)
+     for suffix in (POINTS_LOD_SUFFIX, POINTS_LOD_SUFFIX + '.gz')]
+
+
+def list_frame_artifacts(out_dir, basename):
+    """
+    Returns the existing output files of one frame, including the inferencer's
+    own 'preds/<basename>.json' dump.
+    """
+    candidates = [Path(out_dir) / f"{basename}{suffix}" for suffix in FRAME_ARTIFACT_SUFFIXES]
+    candidates.append(Path(out_dir) / 'preds' / f"{basename}.json")
+    return [p for p in candidates if p.is_file()]
+
+
+RUN_JOURNAL_NAME = 'run_journal.jsonl'
+
+
+def hash_file(path, chunk_size=1 << 20):
+    """Returns the SHA-256 hex digest of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_run_journal(out_dir):
+    """
+    Reads the append-only completion journal of out_dir.
+
+    Returns:
+        Dict {basename: entry} where the last entry for a frame wins. A
+        truncated final line (process killed mid-write) is ignored.
+    """
+    journal_path = Path(out_dir) / RUN_JOURNAL_NAME
+    entries = {}
+    if not journal_path.is_file():
+        return entries
+    with open(journal_path, 'r') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            entries[entry['frame']] = entry
+    return entries
+
+
+def record_completed_frame(out_dir, basename, archive=None):
+    """
+    Appends one frame with the SHA-256 of each of its artifacts to the
+    journal and flushes it to disk, so the entry survives a crash right after.
+    With an 'archive' (ArchiveWriter) the frame's archive members are recorded
+    (as 'archive:<name>') with the digests computed while they were written.
+    """
+    artifacts = {str(p.relative_to(out_dir)): hash_file(p)
+                 for p in list_frame_artifacts(out_dir, basename)}
+    if archive is not None:
+        artifacts.update({f"archive:{name}": digest for name, digest in archive.members(basename).items()})
+    entry = {'frame': basename, 'finished_at': time.time(), 'artifacts': artifacts}
+    journal_path = Path(out_dir) / RUN_JOURNAL_NAME
+    line = json.dumps(entry) + '\n'
+    # Start on a fresh line if a previous run died mid-write
+    if journal_path.is_file() and journal_path.stat().st_size > 0:
+        with open(journal_path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b'\n':
+                line = '\n' + line
+    with open(journal_path, 'a') as f:
+        f.write(line)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def frame_outputs_valid(out_dir, entry, archive=None):
+    """
+    Checks that every artifact recorded for a journal entry still exists with
+    the recorded hash (archive members against the digests in 'archive').
+    Returns (ok, reason).
+    """
+    for rel_path, digest in entry.get('artifacts', {}).items():
+        if rel_path.startswith('archive:'):
+            recorded = archive.digest(rel_path[len('archive:'):]) if archive is not None else None
+            if recorded is None:
+                return False, f"missing {rel_path}"
+            if recorded != digest:
+                return False, f"modified {rel_path}"
+            continue
+        path = Path(out_dir) / rel_path
+        if not path.is_file():
+            return False, f"missing {rel_path}"
+        if hash_file(path) != digest:
+            return False, f"modified {rel_path}"
+    return True, ''
+
+
+class FolderWatcher:
+    """
+    Reports LiDAR files that appear in a directory once they are completely
+    written. Uses inotify close-write/moved-to events when 'inotify_simple'
+    is installed; otherwise polls and treats a file as complete when its size
+    and mtime are unchanged between two polls.
+
+    Files already present when the watcher starts are not reported.
+    """
+
+    def __init__(self, watch_dir, extensions=('.bin', '.pcd'), poll_interval=1.0):
+        self.watch_dir = watch_dir
+        self.extensions = tuple(extensions)
+        self.poll_interval = poll_interval
+        self._seen = set(self._scan())
+        self._pending_sizes = {}
+        self._inotify = None
+        if INotify is not None:
+            self._inotify = INotify()
+            self._inotify.add_watch(watch_dir, inotify_flags.CLOSE_WRITE | inotify_flags.MOVED_TO)
+
+    @property
+    def backend(self):
+        return 'inotify' if self._inotify is not None else 'polling'
+
+    def _scan(self):
+        stats = {}
+        with os.scandir(self.watch_dir) as entries:
+            for entry in entries:
+                if entry.name.lower().endswith(self.extensions) and entry.is_file():
+                    st = entry.stat()
+                    stats[entry.path] = (st.st_size, st.st_mtime_ns)
+        return stats
+
+    def poll(self, timeout):
+        """
+        Waits up to 'timeout' seconds and returns a sorted list of newly
+        completed file paths (possibly empty).
+        """
+        if self._inotify is not None:
+            ready = []
+            for event in self._inotify.read(timeout=int(timeout * 1000)):
+                path = os.path.join(self.watch_dir, event.name)
+                if path.lower().endswith(self.extensions) and path not in self._seen:
+                    self._seen.add(path)
+                    ready.append(path)
+            return sorted(ready)
+
+        if timeout > 0:
+            time.sleep(min(timeout, self.poll_interval))
+        ready = []
+        stats = self._scan()
+        for path, size_mtime in stats.items():
+            if path in self._seen:
+                continue
+            if size_mtime[0] > 0 and self._pending_sizes.get(path) == size_mtime:
+                self._seen.add(path)
+                self._pending_sizes.pop(path, None)
+                ready.append(path)
+            else:
+                self._pending_sizes[path] = size_mtime
+        return sorted(ready)
+
+
+def watch_folder(inferencer, args, is_headless, prepare_input=None, writer=None):
+    """
+    Streaming mode: runs every new LiDAR file written into args.watch through
+    process_single_input as soon as it is complete.
+
+    Throughput is bounded by --watch-max-pending (oldest unprocessed frames are
+    dropped when the logger outpaces inference) and --watch-max-fps. Only the
+    artifacts of the newest --watch-keep frames are kept in out_dir.
+
+    The companion directories are indexed once and re-listed (at most once
+    per poll interval) only when a new frame has no match in the index yet.
+    """
+    if not os.path.isdir(args.watch):
+        print(f"Error: Watch directory does not exist: {args.watch}")
+        return
+
+    watcher = FolderWatcher(args.watch, poll_interval=args.watch_poll_interval)
+    print(f"Watching {args.watch} for new LiDAR files ({watcher.backend}). Press Ctrl+C to stop.")
+
+    indexes = build_directory_indexes(args.img_dir, args.calib_dir, args.gt_label_dir,
+                                      args.match_tolerance_ms)
+    last_index_time = time.perf_counter()
+    pending = deque()
+    kept_basenames = deque()
+    unforgotten = deque()  # frames whose writer bookkeeping is still held
+    min_interval = 1.0 / args.watch_max_fps if args.watch_max_fps else 0.0
+    last_start = 0.0
+    num_done = 0
+    try:
+        while True:
+            timeout = 0.0 if pending else args.watch_poll_interval
+            pending.extend(watcher.poll(timeout))
+
+            dropped = len(pending) - max(args.watch_max_pending, 1)
+            if dropped > 0:
+                print(f"Warning: Inference is falling behind; dropping {dropped} oldest pending frame(s).")
+                for _ in range(dropped):
+                    pending.popleft()
+            if not pending:
+                continue
+
+            wait = min_interval - (time.perf_counter() - last_start)
+            if wait > 0:
+                time.sleep(wait)
+            last_start = time.perf_counter()
+
+            lidar_file = pending.popleft()
+            if (not indexes_cover(indexes, Path(lidar_file).stem)
+                    and time.perf_counter() - last_index_time >= args.watch_poll_interval):
+                # Companion files written after the last listing
+                indexes = build_directory_indexes(args.img_dir, args.calib_dir, args.gt_label_dir,
+                                                  args.match_tolerance_ms)
+                last_index_time = time.perf_counter()
+            single_input = build_input_dict(lidar_file, args.modality, args.img_dir,
+                                            args.calib_dir, args.gt_label_dir, indexes=indexes)
+            try:
+                basename = process_single_input(inferencer, single_input, args, is_headless,
+                                                prepare_input=prepare_input, writer=writer)
+            except Exception as e:
+                print(f"  > Warning: Failed to process {lidar_file}. {e}")
+                continue
+            num_done += 1
+
+            # Drop the writer's per-frame bookkeeping once a frame is on disk
+            if writer is not None:
+                unforgotten.append(basename)
+                while unforgotten and writer.done(unforgotten[0]):
+                    writer.forget(unforgotten.popleft())
+
+            # Rotate out the artifacts of the oldest frames
+            if args.watch_keep > 0:
+                kept_basenames.append(basename)
+            while len(kept_basenames) > args.watch_keep:
+                old_basename = kept_basenames.popleft()
+                if writer is not None:
+                    writer.wait(old_basename)
+                    writer.forget(old_basename)
+                for old_file in list_frame_artifacts(args.out_dir, old_basename):
+                    old_file.unlink()
+    except KeyboardInterrupt:
+        print(f"\nStopped watching {args.watch} after {num_done} frame(s).")
+
+
 def main(args):
     # --- 1. Initialize Model ---
     print(f"Initializing {args.modality} inferencer...")
@@ -1011,7 +1884,13 @@ def main(args):
     # --- End New Logic ---
     
     # Handle auto-download for model names
-    if not os.path.isfile(args.model):
+    if args.ensemble:
+        unknown = [name for name in args.ensemble if name not in PRESET_CONFIGS]
+        if unknown:
+            print(f"Error: --ensemble takes preset model names; unknown: {', '.join(unknown)}")
+            exit()
+        print(f"Loading an ensemble of {len(args.ensemble)} models: {', '.join(args.ensemble)}")
+    elif not os.path.isfile(args.model):
         if not checkpoint_path:
             checkpoint_path = None
         print(f"Loading model '{args.model}' with checkpoint: {checkpoint_path or 'auto-download'}")
@@ -1032,16 +1911,158 @@ def main(args):
         print(f"Error: Unknown modality '{args.modality}'")
         exit()
         
-    inferencer = InferencerClass(
-        model_path,
-        checkpoint_path,
-        device=args.device
-    )
+    use_cpu = args.device == 'cpu'
+    if use_cpu and (args.intra_threads or args.inter_threads):
+        cpu_tuning.configure_threads(args.intra_threads, args.inter_threads)
+
+    if args.ensemble:
+        if args.modality != 'lidar' or args.backend != 'pytorch':
+            print("Error: --ensemble supports --modality lidar with --backend pytorch only.")
+            exit()
+        members = []
+        for name in args.ensemble:
+            print(f"  > {name}: {PRESET_CONFIGS[name]['checkpoint']}")
+            members.append(InferencerClass(name, PRESET_CONFIGS[name]['checkpoint'], device=args.device))
+        inferencer = EnsembleInferencer(
+            members, args.ensemble, weights=args.ensemble_weights, iou_thr=args.wbf_iou_thr,
+            skip_box_thr=args.wbf_skip_thr, conf_type=args.wbf_conf_type,
+            intra_threads=(args.intra_threads or cpu_tuning.available_cpus()) if use_cpu else None)
+        if len(set(getattr(m, 'load_dim', 4) for m in members)) > 1:
+            print("Error: --ensemble members must read the same point format (load_dim).")
+            exit()
+        print(f"Fusing into classes: {', '.join(inferencer.classes)}")
+    else:
+        members = None
+        inferencer = InferencerClass(
+            model_path,
+            checkpoint_path,
+            device=args.device
+        )
+    # The inferencers whose models the CPU options below apply to
+    model_inferencers = members or [inferencer]
+
+    # Reduced precision of the dense modules (the voxel encoder stays fp32)
+    if args.precision != 'fp32':
+        if use_cpu:
+            try:
+                for member in model_inferencers:
+                    cpu_tuning.apply_precision(member.model, args.precision)
+            except ValueError as e:
+                print(f"Error: --precision {args.precision}: {e}.")
+                exit()
+        else:
+            print("  > Warning: --precision only applies to --device cpu; running fp32.")
+            args.precision = 'fp32'
+
+    # CPU execution settings: a cached auto-tune result wins over --cpu-backend
+    autotune_pending = False
+    tuning_key = args.model if args.precision == 'fp32' else f"{args.model}|{args.precision}"
+    if use_cpu:
+        cached = cpu_tuning.load_cached_tuning(tuning_key, args.autotune_cache) if args.cpu_autotune else None
+        if cached:
+            print(f"Using cached CPU tuning for this host: {cached}")
+            args.intra_threads, args.cpu_backend = cached['intra_threads'], cached['cpu_backend']
+            cpu_tuning.configure_threads(args.intra_threads)
+        else:
+            autotune_pending = args.cpu_autotune
+        if autotune_pending and members:
+            print("  > Warning: --cpu-autotune tunes a single model; skipped for --ensemble.")
+            autotune_pending = False
+        if not autotune_pending:
+            for member in model_inferencers:
+                cpu_tuning.apply_cpu_backend(member.model, args.cpu_backend)
+    elif args.cpu_backend != 'default' or args.cpu_autotune:
+        print("  > Warning: --cpu-backend/--cpu-autotune only apply to --device cpu; ignored.")
+
+    # Exported dense graph: NumPy voxelization + ONNX Runtime / TorchScript
+    if args.backend != 'pytorch':
+        if not args.exported_model:
+            print(f"Error: --backend {args.backend} requires --exported-model (see dense_export.py).")
+            exit()
+        if not use_cpu:
+            print(f"  > Warning: --backend {args.backend} runs on CPU regardless of --device {args.device}.")
+        if autotune_pending:
+            print("  > Warning: --cpu-autotune tunes the PyTorch model only; skipped.")
+            autotune_pending = False
+        inferencer = ExportedInferencer(
+            inferencer, args.exported_model, intra_threads=args.intra_threads,
+            points_loader=functools.partial(load_lidar_file, load_dim=getattr(inferencer, 'load_dim', 4),
+                                            mmap=True))
+        if args.voxelizer == 'numba':
+            inferencer.voxelize = Voxelizer(inferencer.meta['voxel_layer'], 'numba')
+        expected = 'onnx' if args.backend == 'onnxruntime' else 'torchscript'
+        if inferencer.meta['format'] != expected:
+            print(f"  > Warning: {args.exported_model} is a {inferencer.meta['format']} export; running it as such.")
+        print(f"Running the exported {inferencer.meta['arch']} dense graph ({inferencer.meta['format']}).")
 
     Path(args.out_dir).mkdir(parents=True, exist_ok=True)
+    archive = None
+    if args.archive:
+        if args.watch:
+            print("Error: --archive cannot be combined with --watch (archives are append-only).")
+            exit()
+        archive = ArchiveWriter(args.out_dir, volume_mb=args.archive_volume_mb)
+    writer = ArtifactWriter(workers=args.write_workers, max_inflight_mb=args.write_max_inflight_mb,
+                            fsync=args.write_fsync, batch_kb=args.write_batch_kb, archive=archive)
     is_headless = args.headless or not os.environ.get('DISPLAY')
     if is_headless:
         print("Running in headless mode. Visualizations will be saved to files.")
+    if is_headless and '3d' in args.outputs and args.modality != 'mono':
+        write_run_axes(writer, args.out_dir)
+    if 'bev' in args.outputs and args.bev_range is None:
+        # The model's BEV extent; for an ensemble, the first member's
+        pcr = get_point_cloud_range(inferencer.cfg)
+        args.bev_range = [pcr[0], pcr[1], pcr[3], pcr[4]] if pcr is not None else list(DEFAULT_BEV_RANGE)
+
+    # Optional multi-sweep aggregation (nuScenes-style configs) and point preprocessing
+    prep_kwargs = {}
+    if args.crop_to_range:
+        # For an ensemble, the union of the members' ranges
+        ranges = [get_point_cloud_range(member.cfg) for member in model_inferencers]
+        if any(r is None for r in ranges):
+            print("  > Warning: Config defines no point_cloud_range; --crop-to-range ignored.")
+        else:
+            ranges = np.asarray(ranges, dtype=np.float64)
+            prep_kwargs['point_cloud_range'] = np.concatenate([ranges[:, :3].min(axis=0),
+                                                               ranges[:, 3:].max(axis=0)]).tolist()
+    if args.remove_ground:
+        prep_kwargs['ground_threshold'] = args.ground_threshold
+    if args.voxel_downsample:
+        prep_kwargs['voxel_size'] = args.voxel_downsample
+    if args.sweeps:
+        sweep_cfg = get_pipeline_transform_cfg(inferencer.cfg, 'LoadPointsFromMultiSweeps') or {}
+        num_sweeps = args.sweeps if args.sweeps > 0 else sweep_cfg.get('sweeps_num', 9)
+        sweep_aggregator = SweepAggregator(num_sweeps,
+                                           remove_close=1.0 if sweep_cfg.get('remove_close') else 0.0)
+        # The aggregator replaces the config's own sweep loader
+        for member in model_inferencers:
+            strip_pipeline_transform(member, 'LoadPointsFromMultiSweeps')
+        sweep_poses = load_sweep_poses(args.sweep_poses) if args.sweep_poses else None
+        prep_kwargs.update(sweep_aggregator=sweep_aggregator, sweep_poses=sweep_poses)
+        print(f"Aggregating up to {num_sweeps} previous sweep(s) per frame.")
+    if args.voxelizer != 'mmcv' and args.backend == 'pytorch':
+        # Feed the NumPy/Numba voxelizer memory-mapped points instead of a file path
+        for member in model_inferencers:
+            if install_voxelizer(member, args.voxelizer) is not None:
+                prep_kwargs['mmap_points'] = True
+    if members:
+        # Read and preprocess each frame once; every member gets the same points array
+        prep_kwargs['mmap_points'] = True
+    prepare_input = None
+    if any(v is not None and v is not False for v in prep_kwargs.values()):
+        prepare_input = functools.partial(prepare_inferencer_input,
+                                          load_dim=getattr(inferencer, 'load_dim', 4),
+                                          **prep_kwargs)
+
+    if args.watch:
+        if autotune_pending:
+            print("  > Warning: --cpu-autotune needs a sample frame; not run in watch mode.")
+        try:
+            watch_folder(inferencer, args, is_headless, prepare_input=prepare_input, writer=writer)
+        finally:
+            writer.close()
+            writer.report()
+        return
     
     # --- 2. Gather all inputs based on dataset mode ---
     inputs_list = []
@@ -1062,9 +2083,12 @@ def main(args):
         
     else:  # args.dataset == 'any'
         print("Using manual path mode (any dataset)")
+        indexes = build_directory_indexes(args.img_dir, args.calib_dir, args.gt_label_dir,
+                                          args.match_tolerance_ms)
         if os.path.isfile(args.input_path):
             inputs_list.append(
-                build_input_dict(args.input_path, args.modality, args.img_dir, args.calib_dir, args.gt_label_dir)
+                build_input_dict(args.input_path, args.modality, args.img_dir, args.calib_dir,
+                                 args.gt_label_dir, indexes=indexes)
             )
         elif os.path.isdir(args.input_path):
             if args.modality == 'mono':
@@ -1077,7 +2101,8 @@ def main(args):
                 if fname.lower().endswith(file_exts):
                     primary_file = os.path.join(args.input_path, fname)
                     inputs_list.append(
-                        build_input_dict(primary_file, args.modality, args.img_dir, args.calib_dir, args.gt_label_dir)
+                        build_input_dict(primary_file, args.modality, args.img_dir, args.calib_dir,
+                                         args.gt_label_dir, indexes=indexes)
                     )
         else:
             print(f"Error: Input path does not exist: {args.input_path}")
@@ -1089,93 +2114,76 @@ def main(args):
         
     print(f"Found {len(inputs_list)} samples to infer.")
 
+    journal = {}
+    if args.resume:
+        journal = load_run_journal(args.out_dir)
+        print(f"Resuming: {len(journal)} frame(s) recorded in {Path(args.out_dir) / RUN_JOURNAL_NAME}")
+
     # --- 3. Run Inference & Visualize ---
+    pending_inputs = []
     for single_input in inputs_list:
-        
-        # Determine the basename and primary file based on dataset mode
-        if args.dataset in ['kitti', 'waymokitti']:
-            basename = single_input.get('frame_id', 'unknown_frame')
-            primary_file = single_input['points']
-        else:
-            primary_input_key = 'img' if args.modality == 'mono' else 'points'
-            primary_file = single_input[primary_input_key]
-            basename = Path(primary_file).stem
-            
-        print(f"\nRunning inference on input: {basename}")
-
-        # Load GT labels if available
-        gt_bboxes_3d = []
-        if 'gt_label' in single_input:
-            try:
-                gt_bboxes_3d = load_kitti_gt_labels(single_input['gt_label'])
-            except Exception as e:
-                print(f"  > Warning: Could not load GT labels. {e}")
-        
-        # Prepare input for inferencer based on dataset mode
-        # Pass the full dict so inferencer can use all available info
-        inferencer_input = single_input
-        
-        # Run inference
-        results_dict = inferencer(
-            inferencer_input,
-            show=False,
-            out_dir=args.out_dir,
-            pred_score_thr=args.score_thr
-        )
-        
-        pred_dict = results_dict['predictions'][0]
-        pred_bboxes_3d = np.array(pred_dict['bboxes_3d'])
-
-        # Save the raw predictions (JSON)
-        pred_path = Path(args.out_dir) / f"{basename}_predictions.json"
-        print(f"  > Saving raw predictions to {pred_path}")
-        try:
-            import json
-            serializable_pred_data = {}
-            for k, v in pred_dict.items():
-                if isinstance(v, np.ndarray):
-                    serializable_pred_data[k] = v.tolist()
-                else:
-                    serializable_pred_data[k] = v
-            with open(pred_path, 'w') as f:
-                json.dump(serializable_pred_data, f, indent=2)
-        except Exception as e:
-            print(f"  > Warning: Could not save prediction JSON. {e}")
-
-        # --- Generate 2D Visualization (if img and calib are available) ---
-        if 'img' in single_input and 'calib' in single_input:
-            img_2d_vis_path = Path(args.out_dir) / f"{basename}_2d_vis.png"
-            draw_projected_boxes_on_image(
-                single_input['img'],
-                single_input['calib'],
-                pred_bboxes_3d,
-                gt_bboxes_3d,
-                str(img_2d_vis_path)
-            )
+        basename = get_input_basename(single_input, args.modality)
+        entry = journal.get(basename)
+        if entry is not None:
+            ok, reason = frame_outputs_valid(args.out_dir, entry, archive)
+            if ok:
+                continue
+            print(f"\nRe-running {basename}: journal entry is stale ({reason}).")
+        pending_inputs.append(single_input)
+
+    if autotune_pending and pending_inputs:
+        print("Auto-tuning CPU threads and backend on the first frame...")
+        sample = pending_inputs[0]
+        # The sweep aggregator is stateful, so its frames are not pushed twice
+        if prepare_input is not None and not args.sweeps:
+            sample = prepare_input(sample)
+        choice = cpu_tuning.autotune(inferencer, sample)
+        args.intra_threads, args.cpu_backend = choice['intra_threads'], choice['cpu_backend']
+        cpu_tuning.save_cached_tuning(tuning_key, choice, args.autotune_cache)
+        print(f"Selected {choice} (cached in {args.autotune_cache})")
+
+    timer = StageTimer()
+    if members:
+        inferencer.timer = timer
+    run_start = time.perf_counter()
+    # Frames are journaled once the writer has put all of their files on disk
+    unjournaled = deque()
+
+    def journal_written_frames():
+        while unjournaled and writer.done(unjournaled[0]):
+            basename = unjournaled.popleft()
+            if writer.failed(basename):
+                # Left out of the journal so that --resume runs the frame again
+                print(f"  > Warning: Not journaling {basename}: some of its artifacts could not be written.")
+            else:
+                record_completed_frame(args.out_dir, basename, archive)
+            writer.forget(basename)
+
+    # Repeats give the timing statistics more samples; outputs are simply rewritten
+    for iteration in range(args.repeat):
+        if args.repeat > 1:
+            print(f"\n=== Iteration {iteration + 1}/{args.repeat} ===")
+        for single_input in pending_inputs:
+            basename = process_single_input(inferencer, single_input, args, is_headless,
+                                            prepare_input=prepare_input, timer=timer, writer=writer)
+            unjournaled.append(basename)
+            journal_written_frames()
+    with timer.stage('artifact_drain'):
+        writer.close()
+    journal_written_frames()
+    writer.report()
+    if archive is not None:
+        archive.close()
+        print(f"[INFO] Archived artifacts in {', '.join(archive.volumes_written) or 'no new volume'}")
+
+    num_skipped = len(inputs_list) - len(pending_inputs)
+    if num_skipped:
+        print(f"\nSkipped {num_skipped} frame(s) already completed in a previous run.")
+    write_run_stats(args, inferencer, timer, len(pending_inputs),
+                    time.perf_counter() - run_start, writer=writer)
+    if members:
+        inferencer.close()
 
-        # --- Generate 3D Visualization ---
-        if args.modality != 'mono':
-            # Determine lidar file path based on dataset mode
-            # Use the 'points' key across all modes
-            lidar_file = single_input['points']
-            
-            # Pass image and calibration files if available for enhanced visualization
-            img_file = single_input.get('img', None)
-            calib_file = single_input.get('calib', None)
-            
-            visualize_with_open3d(
-                lidar_file,
-                pred_dict,
-                gt_bboxes_3d,
-                args.out_dir,
-                basename,
-                headless=is_headless,
-                img_file=img_file,
-                calib_file=calib_file
-            )
-        else:
-            print("  > Monocular model. Skipping Open3D visualization.")
-            
     print(f"\nInference complete. Results saved in {args.out_dir}")
 
 if __name__ == "__main__":
@@ -1216,6 +2224,10 @@ if __name__ == "__main__":
                         help="(Optional) Directory of calibration files (e.g., KITTI-style .txt). Only used with --dataset=any.")
     parser.add_argument('--gt-label-dir', type=str, default=None,
                         help="(Optional) Directory of ground truth label files (e.g., KITTI-style .txt). Only used with --dataset=any.")
+    parser.add_argument('--match-tolerance-ms', type=float, default=None,
+                        help="(Optional) Pair camera images with LiDAR files by the timestamp in nuScenes-style "
+                             "names (e.g., '__CAM_FRONT__<ts>') when no image shares the LiDAR stem. Accepts the "
+                             "nearest image per camera within this many milliseconds. Only used with --dataset=any.")
     
     parser.add_argument('--score-thr', type=float, default=0.3,
                         help="Score threshold for filtering predictions.")
@@ -1224,9 +2236,136 @@ if __name__ == "__main__":
     parser.add_argument('--headless', action='store_true',
                         help="Run in headless mode. Will save visualizations to .ply files "
                              "instead of opening an interactive window.")
+
+    parser.add_argument('--sweeps', type=int, default=0,
+                        help="Aggregate this many previous sweeps into each LiDAR frame (time-lag channel "
+                             "appended), for configs trained with LoadPointsFromMultiSweeps. Inputs are processed in "
+                             "name order, so point --input-path at consecutive sweeps. -1 uses the config's "
+                             "sweeps_num; 0 disables.")
+    parser.add_argument('--sweep-poses', type=str, default=None,
+                        help="(Optional) JSON of per-sweep timestamps and lidar2global (or lidar2ego + ego2global) "
+                             "poses, keyed by LiDAR file name, used by --sweeps.")
+    parser.add_argument('--crop-to-range', action='store_true',
+                        help="Drop points outside the config's point_cloud_range before handing them to the model.")
+    parser.add_argument('--remove-ground', action='store_true',
+                        help="Remove the RANSAC-fitted ground plane before inference.")
+    parser.add_argument('--ground-threshold', type=float, default=0.2,
+                        help="Distance (m) to the ground plane below which points are removed by --remove-ground.")
+    parser.add_argument('--voxel-downsample', type=float, default=None,
+                        help="(Optional) Keep one point per voxel of this edge length (m) before inference.")
+    parser.add_argument('--resume', action='store_true',
+                        help="Skip frames recorded as complete in <out-dir>/run_journal.jsonl whose artifacts are "
+                             "still present and unmodified. Every run appends finished frames to that journal.")
+    # PyTorch CPU execution (--device cpu)
+    parser.add_argument('--intra-threads', type=int, default=None,
+                        help="PyTorch intra-op threads (torch.set_num_threads). Default: PyTorch's choice (all cores).")
+    parser.add_argument('--inter-threads', type=int, default=None,
+                        help="PyTorch inter-op threads (torch.set_num_interop_threads).")
+    parser.add_argument('--cpu-backend', type=str, default='default', choices=['default', 'onednn', 'channels_last'],
+                        help="CPU execution of the 2D backbone/neck/head: 'onednn' folds BatchNorm into the "
+                             "convolutions, 'channels_last' runs them in NHWC layout.")
+    parser.add_argument('--cpu-autotune', action='store_true',
+                        help="Time thread counts x CPU backends on the first frame and keep the fastest; the "
+                             "choice is cached per host and model and reused by later runs.")
+    parser.add_argument('--backend', type=str, default='pytorch', choices=['pytorch', 'onnxruntime', 'torchscript'],
+                        help="Execution backend. 'onnxruntime'/'torchscript' voxelize in NumPy and run the dense "
+                             "graph exported by dense_export.py (KITTI PointPillars/SECOND) on CPU.")
+    parser.add_argument('--voxelizer', type=str, default='mmcv', choices=['mmcv', 'numpy', 'numba'],
+                        help="Hard voxelization for voxel-based models: mmcv's op, or the vectorized NumPy / "
+                             "Numba voxelizer in voxelizer.py fed with memory-mapped points. The exported "
+                             "backends always voxelize in NumPy (or Numba).")
+    parser.add_argument('--exported-model', type=str, default=None,
+                        help="Exported .onnx/.pt file for --backend onnxruntime/torchscript.")
+    parser.add_argument('--precision', type=str, default='fp32', choices=['fp32', 'bf16', 'int8-dynamic'],
+                        help="CPU precision of the backbone/neck/head: bf16 autocast or dynamic int8 quantization "
+                             "of their Linear layers (an error when there are none). "
+                             "Compare AP with kitti_eval.py --reference-dir.")
+    parser.add_argument('--autotune-cache', type=str, default=str(cpu_tuning.DEFAULT_CACHE),
+                        help="Cache file for --cpu-autotune results.")
+    parser.add_argument('--ply-format', type=str, default='float32', choices=PLY_FORMATS,
+                        help="Headless point artifact: float32 PLY, int16 (1 cm quantized) PLY, gzipped int16 "
+                             "PLY, or 'ref' (a JSON reference to the source .bin instead of a copy of its points).")
+    parser.add_argument('--vis-max-points', type=int, default=None,
+                        help="(Optional) Decimate the displayed / saved point cloud to about this many points "
+                             "(spatially uniform; points inside predicted and GT boxes keep full resolution).")
+    parser.add_argument('--vis-voxel', type=float, default=None,
+                        help="(Optional) Keep one random point per voxel of this edge (m) outside the boxes "
+                             "in the displayed / saved point cloud.")
+    parser.add_argument('--vis-lod-levels', type=int, default=0,
+                        help=f"In headless mode, also write N (2-{MAX_LOD_LEVELS}) disjoint coarse-to-fine "
+                             "<frame>_points_lod<i>.ply files; loading levels 0..k gives a progressively "
+                             "finer cloud and all levels the full sweep.")
+    parser.add_argument('--outputs', type=str, default=','.join(DEFAULT_OUTPUTS),
+                        help=f"Comma-separated artifacts to produce per frame, from {', '.join(OUTPUT_KINDS)}: "
+                             "predictions = <frame>_predictions.json, 2d = <frame>_2d_vis.png, 3d = points and "
+                             "box PLYs (or the Open3D window), bev = <frame>_bev.png, labels = text label PLY. "
+                             "Stages not listed are skipped entirely, e.g. '--outputs predictions' for scoring jobs.")
+    parser.add_argument('--bev', action='store_true',
+                        help="Also write <frame>_bev.png, a bird's-eye-view raster of the points and boxes "
+                             "rendered in NumPy (works without a display or OpenGL); same as adding 'bev' to --outputs.")
+    parser.add_argument('--bev-resolution', type=float, default=0.1,
+                        help="Metres per pixel of the --bev image.")
+    parser.add_argument('--bev-range', type=float, nargs=4, default=None,
+                        metavar=('X_MIN', 'Y_MIN', 'X_MAX', 'Y_MAX'),
+                        help="Area shown by --bev (default: the model's point_cloud_range).")
+    parser.add_argument('--bev-color', type=str, default='height', choices=['height', 'intensity'],
+                        help="Point coloring of the --bev image.")
+    parser.add_argument('--ensemble', type=str, nargs='+', default=None,
+                        help="(Optional) Run these preset models together on every frame (points are read and "
+                             "preprocessed once) and fuse their boxes with 3D weighted box fusion. "
+                             "--model/--checkpoint are ignored.")
+    parser.add_argument('--ensemble-weights', type=float, nargs='+', default=None,
+                        help="Per-model weights for --ensemble (default 1 each).")
+    parser.add_argument('--wbf-iou-thr', type=float, default=0.55,
+                        help="Rotated BEV IoU above which --ensemble boxes of one class are fused.")
+    parser.add_argument('--wbf-skip-thr', type=float, default=0.05,
+                        help="Member boxes scoring below this are ignored by the --ensemble fusion.")
+    parser.add_argument('--wbf-conf-type', type=str, default='avg', choices=['avg', 'max'],
+                        help="Fused score: 'avg' (down-weights boxes few models agree on) or 'max'.")
+    parser.add_argument('--repeat', type=int, default=1,
+                        help="Process the inputs this many times, e.g. to collect timing samples for "
+                             "compare_results.py --baseline (stage timings go to <out-dir>/run_stats.json).")
+    parser.add_argument('--write-workers', type=int, default=2,
+                        help="Threads that encode and write the output files while inference continues "
+                             "(0 writes them inline on the main thread).")
+    parser.add_argument('--write-max-inflight-mb', type=float, default=256,
+                        help="Memory cap of queued / running write jobs; inference waits when it is reached.")
+    parser.add_argument('--write-fsync', action='store_true',
+                        help="fsync every output file before it is renamed into place.")
+    parser.add_argument('--write-batch-kb', type=float, default=256,
+                        help="Files under 64 KB (JSON, box / label PLYs) are written in batches of up to this "
+                             "size, one batch per frame at least (0 disables batching).")
+    parser.add_argument('--archive', action='store_true',
+                        help="Append the per-frame artifacts to <out-dir>/run_archive.<n>.pack volumes (with a "
+                             "trailing offset index) instead of writing 5-8 files per frame; run_archive.py reads them.")
+    parser.add_argument('--archive-volume-mb', type=float, default=2048,
+                        help="Start a new --archive volume once the current one reaches this size.")
+
+    # Streaming mode
+    parser.add_argument('--watch', type=str, default=None,
+                        help="(Optional) Watch this directory and run every new .bin/.pcd file through inference "
+                             "as soon as it is completely written. --img-dir/--calib-dir/--gt-label-dir still apply.")
+    parser.add_argument('--watch-poll-interval', type=float, default=1.0,
+                        help="Seconds between directory checks in --watch mode (polling fallback and idle wait).")
+    parser.add_argument('--watch-max-pending', type=int, default=8,
+                        help="Maximum number of queued frames in --watch mode; the oldest are dropped beyond this.")
+    parser.add_argument('--watch-max-fps', type=float, default=None,
+                        help="(Optional) Upper bound on frames processed per second in --watch mode.")
+    parser.add_argument('--watch-keep', type=int, default=100,
+                        help="Keep the artifacts of only the newest N frames in --out-dir in --watch mode "
+                             "(0 keeps everything).")
     
     args = parser.parse_args()
-    args = apply_preset_from_model(args)
+    args.outputs = [o.strip() for o in args.outputs.split(',') if o.strip()]
+    unknown_outputs = [o for o in args.outputs if o not in OUTPUT_KINDS]
+    if unknown_outputs:
+        parser.error(f"Unknown --outputs {', '.join(unknown_outputs)}; choose from {', '.join(OUTPUT_KINDS)}")
+    if args.bev and 'bev' not in args.outputs:
+        args.outputs.append('bev')
+    if args.vis_lod_levels and not 2 <= args.vis_lod_levels <= MAX_LOD_LEVELS:
+        parser.error(f"--vis-lod-levels must be between 2 and {MAX_LOD_LEVELS}")
+    explicit_args = {arg[2:].split('=')[0].replace('-', '_') for arg in sys.argv[1:] if arg.startswith('--')}
+    args = apply_preset_from_model(args, explicit_args)
     # Update default paths from relative to absolute
     # (Assuming your defaults are relative to a project root)
     # If your paths are already absolute, you can remove this block.
@@ -0,0 +1,314 @@
+"""
+pareto_report.py
+
+Accuracy-vs-latency report across every run recorded under results/runs/
+(the run_stats.json files collected by run_all_experiments.py, or copied
+there from any mmdet3d_inference2.py output directory).
+
+For each run, at every requested score threshold and at the run's own
+--score-thr, the saved predictions are re-filtered and evaluated with
+kitti_eval against label_2/. Each (run, threshold) point is joined with the
+run's per-stage latency, and the points that no other point beats on both
+latency and AP form the Pareto frontier.
+
+Writes:
+  - results/pareto_report.csv   (one row per run and threshold)
+  - results/pareto_report.html  (static table + inline SVG scatter plot)
+  - results/pareto_report.png   (if matplotlib is available)
+
+Runs without KITTI labels (e.g. the nuScenes demos) are listed with an
+empty AP and left out of the frontier.
+
+Usage:
+  python pareto_report.py --thresholds 0.1,0.3,0.5,0.7 --class-name Car
+"""
+
+import os
+import csv
+import glob
+import json
+import argparse
+
+import numpy as np
+
+from kitti_eval import evaluate_kitti, load_prediction_dir
+
+try:
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+except ImportError:
+    plt = None
+
+DEFAULT_THRESHOLDS = [0.05, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7]
+
+CSV_FIELDS = ['run', 'model', 'dataset', 'device', 'precision', 'score_thr', 'num_frames',
+              'latency_ms', 'fps', 'stage_breakdown', 'ap', 'num_gt', 'pareto']
+
+
+# --------------------------------------------------------------------
+# Loading
+# --------------------------------------------------------------------
+
+def load_runs(runs_dir):
+    """Returns [(run_name, run_stats)] for every results/runs/*.json file."""
+    runs = []
+    for path in sorted(glob.glob(os.path.join(runs_dir, '*.json'))):
+        with open(path, 'r') as f:
+            runs.append((os.path.splitext(os.path.basename(path))[0], json.load(f)))
+    return runs
+
+
+def run_latency(stats, stage, statistic):
+    """Seconds per frame for one stage of a run, or nan if it was not recorded."""
+    summary = stats.get('stages', {}).get(stage)
+    if not summary:
+        return float('nan')
+    return float(summary[statistic])
+
+
+# --------------------------------------------------------------------
+# Report
+# --------------------------------------------------------------------
+
+def collect_points(runs, label_dir, thresholds, class_name, metric, difficulty,
+                   ap_key, stage, statistic, workers=None, calib_dir=None):
+    """
+    Evaluates every run at every requested threshold and at its own score threshold.
+
+    Returns:
+        List of row dicts (see CSV_FIELDS); 'ap' is nan when not evaluable.
+    """
+    rows = []
+    for name, stats in runs:
+        latency = run_latency(stats, stage, statistic)
+        breakdown = ' '.join(f"{s}={v[statistic] * 1000.0:.1f}"
+                             for s, v in stats.get('stages', {}).items() if s != 'frame_total')
+        base = {
+            'run': name,
+            'model': stats.get('model', ''),
+            'dataset': stats.get('dataset', ''),
+            'device': stats.get('device', ''),
+            'precision': stats.get('precision', 'fp32'),
+            'num_frames': stats.get('num_frames', 0),
+            'latency_ms': latency * 1000.0,
+            'fps': 1.0 / latency if latency > 0 else float('nan'),
+            'stage_breakdown': breakdown,
+        }
+
+        classes = stats.get('classes') or []
+        out_dir = stats.get('out_dir', '')
+        evaluable = (stats.get('dataset') == 'kitti' and class_name in classes
+                     and os.path.isdir(out_dir) and os.path.isdir(label_dir))
+        predictions = load_prediction_dir(out_dir) if evaluable else {}
+        if evaluable and not predictions:
+            print(f"[WARN] {name}: no predictions found in {out_dir}")
+
+        run_thr = float(stats.get('score_thr', 0.0))
+        # The saved predictions keep low-score boxes too (the inferencer's
+        # pred_score_thr only filters the visualization), so any threshold works
+        run_thresholds = sorted({run_thr} | set(thresholds))
+        for thr in run_thresholds:
+            ap, num_gt = float('nan'), 0
+            if predictions:
+                results, _ = evaluate_kitti(predictions, label_dir, classes,
+                                            score_thr=thr, workers=workers, calib_dir=calib_dir)
+                cell = results[class_name][metric][difficulty]
+                ap, num_gt = cell[ap_key], cell['num_gt']
+            rows.append(dict(base, score_thr=thr, ap=ap, num_gt=num_gt, pareto=False))
+    return rows
+
+
+def mark_pareto(rows):
+    """
+    Flags the rows not dominated by any other row (lower or equal latency
+    and higher or equal AP, strictly better in one). Rows without AP or
+    latency are never on the frontier.
+    """
+    valid = [r for r in rows if not (np.isnan(r['ap']) or np.isnan(r['latency_ms']))]
+    if not valid:
+        return rows
+    latency = np.array([r['latency_ms'] for r in valid])
+    ap = np.array([r['ap'] for r in valid])
+    no_worse = (latency[:, None] <= latency[None, :]) & (ap[:, None] >= ap[None, :])
+    better = (latency[:, None] < latency[None, :]) | (ap[:, None] > ap[None, :])
+    dominated = (no_worse & better).any(axis=0)
+    for row, is_dominated in zip(valid, dominated):
+        row['pareto'] = not bool(is_dominated)
+    return rows
+
+
+def write_csv(rows, csv_path):
+    with open(csv_path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+        writer.writeheader()
+        for r in rows:
+            out = dict(r)
+            for key in ('latency_ms', 'fps', 'ap'):
+                out[key] = '' if np.isnan(r[key]) else f"{r[key]:.3f}"
+            writer.writerow(out)
+
+
+def _svg_scatter(rows, width=720, height=420, margin=56):
+    """Inline SVG scatter of AP vs latency with the frontier drawn as a step line."""
+    points = [r for r in rows if not (np.isnan(r['ap']) or np.isnan(r['latency_ms']))]
+    if not points:
+        return "<p>No evaluable runs (KITTI predictions with labels) found.</p>"
+
+    lat = np.array([r['latency_ms'] for r in points])
+    ap = np.array([r['ap'] for r in points])
+    x_lo, x_hi = 0.0, max(lat.max() * 1.1, 1e-3)
+    y_lo, y_hi = 0.0, max(100.0, ap.max())
+
+    def sx(v):
+        return margin + (v - x_lo) / (x_hi - x_lo) * (width - 2 * margin)
+
+    def sy(v):
+        return height - margin - (v - y_lo) / (y_hi - y_lo) * (height - 2 * margin)
+
+    runs = sorted({r['run'] for r in points})
+    palette = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd', '#8c564b', '#e377c2', '#7f7f7f']
+    color = {run: palette[i % len(palette)] for i, run in enumerate(runs)}
+
+    parts = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+             f'font-family="sans-serif" font-size="11">',
+             f'<line x1="{margin}" y1="{height - margin}" x2="{width - margin}" y2="{height - margin}" stroke="black"/>',
+             f'<line x1="{margin}" y1="{margin}" x2="{margin}" y2="{height - margin}" stroke="black"/>',
+             f'<text x="{width / 2}" y="{height - 16}" text-anchor="middle">latency (ms / frame)</text>',
+             f'<text x="16" y="{height / 2}" text-anchor="middle" transform="rotate(-90 16 {height / 2})">AP (%)</text>']
+    for tick in np.linspace(x_lo, x_hi, 5):
+        parts.append(f'<text x="{sx(tick):.1f}" y="{height - margin + 14}" text-anchor="middle">{tick:.0f}</text>')
+    for tick in np.linspace(y_lo, y_hi, 5):
+        parts.append(f'<text x="{margin - 6}" y="{sy(tick) + 4:.1f}" text-anchor="end">{tick:.0f}</text>')
+
+    frontier = sorted((r for r in points if r['pareto']), key=lambda r: r['latency_ms'])
+    if len(frontier) > 1:
+        steps = []
+        for prev, cur in zip(frontier[:-1], frontier[1:]):
+            steps.append(f"{sx(prev['latency_ms']):.1f},{sy(prev['ap']):.1f}")
+            steps.append(f"{sx(cur['latency_ms']):.1f},{sy(prev['ap']):.1f}")
+        steps.append(f"{sx(frontier[-1]['latency_ms']):.1f},{sy(frontier[-1]['ap']):.1f}")
+        parts.append(f'<polyline points="{" ".join(steps)}" fill="none" stroke="#444" stroke-dasharray="4 3"/>')
+
+    for r in points:
+        radius = 6 if r['pareto'] else 4
+        stroke = ' stroke="black" stroke-width="1.5"' if r['pareto'] else ''
+        parts.append(f'<circle cx="{sx(r["latency_ms"]):.1f}" cy="{sy(r["ap"]):.1f}" r="{radius}" '
+                     f'fill="{color[r["run"]]}"{stroke}><title>{r["run"]} thr={r["score_thr"]:.2f} '
+                     f'AP={r["ap"]:.2f} {r["latency_ms"]:.1f} ms</title></circle>')
+    for i, run in enumerate(runs):
+        y = margin + 14 * i
+        parts.append(f'<circle cx="{width - margin - 150}" cy="{y - 4}" r="4" fill="{color[run]}"/>')
+        parts.append(f'<text x="{width - margin - 140}" y="{y}">{run}</text>')
+    parts.append('</svg>')
+    return "\n".join(parts)
+
+
+def write_html(rows, html_path, title):
+    header = "".join(f"<th>{field}</th>" for field in CSV_FIELDS)
+    body = []
+    for r in rows:
+        cells = []
+        for field in CSV_FIELDS:
+            value = r[field]
+            if isinstance(value, float):
+                value = "-" if np.isnan(value) else f"{value:.2f}"
+            cells.append(f"<td>{value}</td>")
+        style = ' style="font-weight:bold"' if r['pareto'] else ''
+        body.append(f"<tr{style}>{''.join(cells)}</tr>")
+    html = (f"<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\"><title>{title}</title>"
+            "<style>body{font-family:sans-serif}table{border-collapse:collapse}"
+            "td,th{border:1px solid #ccc;padding:2px 6px;font-size:12px}</style></head><body>\n"
+            f"<h2>{title}</h2>\n{_svg_scatter(rows)}\n"
+            "<p>Bold rows are on the Pareto frontier.</p>\n"
+            f"<table><tr>{header}</tr>\n" + "\n".join(body) + "\n</table>\n</body></html>\n")
+    with open(html_path, 'w') as f:
+        f.write(html)
+
+
+def write_png(rows, png_path, title):
+    points = [r for r in rows if not (np.isnan(r['ap']) or np.isnan(r['latency_ms']))]
+    if not points:
+        return False
+    fig, ax = plt.subplots(figsize=(8, 5))
+    for run in sorted({r['run'] for r in points}):
+        sel = [r for r in points if r['run'] == run]
+        ax.scatter([r['latency_ms'] for r in sel], [r['ap'] for r in sel], label=run)
+    frontier = sorted((r for r in points if r['pareto']), key=lambda r: r['latency_ms'])
+    ax.step([r['latency_ms'] for r in frontier], [r['ap'] for r in frontier],
+            where='post', color='black', linestyle='--', label='Pareto frontier')
+    for r in frontier:
+        ax.annotate(f"{r['score_thr']:.2f}", (r['latency_ms'], r['ap']),
+                    textcoords='offset points', xytext=(4, 4), fontsize=8)
+    ax.set_xlabel('latency (ms / frame)')
+    ax.set_ylabel('AP (%)')
+    ax.set_title(title)
+    ax.legend(fontsize=8)
+    fig.tight_layout()
+    fig.savefig(png_path, dpi=120)
+    plt.close(fig)
+    return True
+
+
+# --------------------------------------------------------------------
+# Main
+# --------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Accuracy-vs-latency Pareto report across recorded runs")
+    parser.add_argument("--runs-dir", type=str, default=os.path.join("results", "runs"),
+                        help="Directory of run_stats JSON files (one per run)")
+    parser.add_argument("--label-dir", type=str, default=os.path.join("data", "kitti", "training", "label_2"))
+    parser.add_argument("--calib-dir", type=str, default=None,
+                        help="KITTI calib/ directory for the GT conversion (default: calib/ next to --label-dir)")
+    parser.add_argument("--thresholds", type=str, default=",".join(str(t) for t in DEFAULT_THRESHOLDS),
+                        help="Comma-separated score thresholds to evaluate")
+    parser.add_argument("--class-name", type=str, default="Car")
+    parser.add_argument("--metric", type=str, default="3d", choices=["3d", "bev"])
+    parser.add_argument("--difficulty", type=str, default="moderate", choices=["easy", "moderate", "hard"])
+    parser.add_argument("--ap", type=str, default="AP_R40", choices=["AP_R11", "AP_R40"])
+    parser.add_argument("--latency-stage", type=str, default="frame_total",
+                        help="Stage whose timing is used as latency (e.g. frame_total, inference)")
+    parser.add_argument("--latency-stat", type=str, default="p50", choices=["mean", "p50", "p90", "max"])
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Processes for kitti_eval matching")
+    parser.add_argument("--out-prefix", type=str, default=os.path.join("results", "pareto_report"))
+    args = parser.parse_args()
+
+    runs = load_runs(args.runs_dir)
+    if not runs:
+        print(f"[WARN] No run statistics found in {args.runs_dir}")
+        return
+
+    thresholds = [float(t) for t in args.thresholds.split(",") if t.strip()]
+    rows = collect_points(runs, args.label_dir, thresholds, args.class_name, args.metric,
+                          args.difficulty, args.ap, args.latency_stage, args.latency_stat,
+                          workers=args.workers, calib_dir=args.calib_dir)
+    rows = mark_pareto(rows)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.out_prefix)), exist_ok=True)
+    title = (f"{args.class_name} {args.metric.upper()} {args.ap} ({args.difficulty}) vs "
+             f"{args.latency_stage} {args.latency_stat} latency")
+    csv_path = args.out_prefix + ".csv"
+    html_path = args.out_prefix + ".html"
+    write_csv(rows, csv_path)
+    write_html(rows, html_path, title)
+    print(f"[INFO] {len(rows)} point(s) from {len(runs)} run(s)")
+    print(f"[INFO] CSV written to: {csv_path}")
+    print(f"[INFO] HTML written to: {html_path}")
+    if plt is None:
+        print("[WARN] matplotlib not available, skipping PNG plot")
+    elif write_png(rows, args.out_prefix + ".png", title):
+        print(f"[INFO] PNG written to: {args.out_prefix}.png")
+
+    frontier = sorted((r for r in rows if r['pareto']), key=lambda r: r['latency_ms'])
+    if frontier:
+        print("\nPareto frontier:")
+        print("| Run | Score thr | Latency (ms) | AP |")
+        print("|-----|----------:|-------------:|---:|")
+        for r in frontier:
+            print(f"| {r['run']} | {r['score_thr']:.2f} | {r['latency_ms']:.1f} | {r['ap']:.2f} |")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,319 @@
+"""
+ply_io.py
+
+Direct NumPy reading and writing of the per-frame point cloud artifacts, so
+headless runs do not go through Open3D's float64 PLY writer.
+
+Formats of <basename>_points.ply (--ply-format):
+
+  float32   binary PLY, float32 x/y/z + uint8 RGB (15 bytes/point instead
+            of the 27 Open3D writes); readable by any PLY viewer
+  int16     binary PLY, int16 x/y/z quantized to 1 cm + uint8 RGB
+            (9 bytes/point); scale and offset are stored in a header comment
+            that read_point_ply applies
+  int16-gz  the int16 PLY, gzip-compressed (<basename>_points.ply.gz)
+  ref       no point copy at all: <basename>_points_ref.json names the source
+            .bin (with its size and mtime) and the height range used for
+            coloring; readers load the .bin and recolor it
+
+read_points_artifact() resolves any of these for scripts/open3d_save_view.py
+and the other offline tools, from files or from the run's --archive. --vis-lod-levels adds disjoint coarse-to-fine
+<basename>_points_lod<i>.ply files; read_points_lods() concatenates the
+first levels for a progressively finer cloud.
+"""
+
+import os
+import gzip
+import json
+from pathlib import Path
+
+import numpy as np
+
+from point_ops import height_colors
+from run_archive import read_artifact
+
+PLY_FORMATS = ('float32', 'int16', 'int16-gz', 'ref')
+
+POINTS_SUFFIX = '_points.ply'
+POINTS_GZ_SUFFIX = '_points.ply.gz'
+POINTS_REF_SUFFIX = '_points_ref.json'
+POINTS_LOD_SUFFIX = '_points_lod{}.ply'
+MAX_LOD_LEVELS = 8
+
+DEFAULT_RESOLUTION = 0.01  # metres per int16 step
+
+_PLY_TYPES = {
+    'char': 'i1', 'int8': 'i1', 'uchar': 'u1', 'uint8': 'u1',
+    'short': 'i2', 'int16': 'i2', 'ushort': 'u2', 'uint16': 'u2',
+    'int': 'i4', 'int32': 'i4', 'uint': 'u4', 'uint32': 'u4',
+    'float': 'f4', 'float32': 'f4', 'double': 'f8', 'float64': 'f8',
+}
+
+
+def _colors_to_uint8(colors):
+    colors = np.asarray(colors)
+    if colors.dtype == np.uint8:
+        return colors
+    return np.clip(np.round(colors * 255.0), 0, 255).astype(np.uint8)
+
+
+def encode_point_ply(xyz, colors=None, fmt='float32', resolution=DEFAULT_RESOLUTION):
+    """
+    Encodes points (and optional colors in [0, 1] or uint8) as a binary
+    little-endian PLY in the 'float32' or 'int16' layout. Returns bytes.
+    """
+    xyz = np.asarray(xyz)[:, :3]
+    header = ['ply', 'format binary_little_endian 1.0']
+    if fmt == 'float32':
+        coord_type, coord_dtype = 'float', '<f4'
+        coords = xyz.astype(np.float32)
+    else:
+        if len(xyz):
+            low, high = xyz.min(axis=0).astype(np.float64), xyz.max(axis=0).astype(np.float64)
+        else:
+            low = high = np.zeros(3)
+        offset = (low + high) / 2.0
+        # Coarser steps only when an axis spans more than 65534 steps
+        scale = np.maximum(resolution, (high - low) / 65534.0)
+        coord_type, coord_dtype = 'short', '<i2'
+        coords = np.round((xyz - offset) / scale).astype(np.int16)
+        header.append('comment quantization scale {} {} {} offset {} {} {}'.format(
+            *(repr(float(v)) for v in np.concatenate([scale, offset]))))
+
+    fields = [('x', coord_dtype), ('y', coord_dtype), ('z', coord_dtype)]
+    if colors is not None:
+        fields += [('red', 'u1'), ('green', 'u1'), ('blue', 'u1')]
+    vertices = np.empty(len(xyz), dtype=fields)
+    vertices['x'], vertices['y'], vertices['z'] = coords[:, 0], coords[:, 1], coords[:, 2]
+    if colors is not None:
+        rgb = _colors_to_uint8(colors)
+        vertices['red'], vertices['green'], vertices['blue'] = rgb[:, 0], rgb[:, 1], rgb[:, 2]
+
+    header.append(f'element vertex {len(xyz)}')
+    header += [f'property {coord_type} {axis}' for axis in 'xyz']
+    if colors is not None:
+        header += ['property uchar red', 'property uchar green', 'property uchar blue']
+    header.append('end_header')
+    return ('\n'.join(header) + '\n').encode('ascii') + vertices.tobytes()
+
+
+def point_ply_path(path, fmt='float32'):
+    """The file name write_point_ply uses for 'path' in format 'fmt'."""
+    return f"{path}.gz" if fmt == 'int16-gz' else str(path)
+
+
+def point_ply_bytes(xyz, colors=None, fmt='float32', resolution=DEFAULT_RESOLUTION):
+    """The file content of a float32 / int16 / int16-gz point PLY."""
+    data = encode_point_ply(xyz, colors, fmt='float32' if fmt == 'float32' else 'int16',
+                            resolution=resolution)
+    if fmt == 'int16-gz':
+        data = gzip.compress(data, compresslevel=6)
+    return data
+
+
+def write_point_ply(path, xyz, colors=None, fmt='float32', resolution=DEFAULT_RESOLUTION):
+    """
+    Writes a point cloud PLY in one of the float32 / int16 / int16-gz
+    layouts ('int16-gz' appends '.gz' to 'path'). Returns the written path.
+    """
+    path = point_ply_path(path, fmt)
+    with open(path, 'wb') as f:
+        f.write(point_ply_bytes(xyz, colors, fmt=fmt, resolution=resolution))
+    return path
+
+
+def encode_line_set_ply(points, lines, colors=None):
+    """
+    Encodes a line set as the binary PLY Open3D's read_line_set expects
+    (double vertices, 'edge' elements with vertex1 / vertex2 and optional
+    per-edge colors in [0, 1] or uint8). Returns bytes.
+    """
+    points = np.asarray(points, dtype='<f8').reshape(-1, 3)
+    lines = np.asarray(lines).reshape(-1, 2)
+    fields = [('vertex1', '<i4'), ('vertex2', '<i4')]
+    if colors is not None and len(colors):
+        fields += [('red', 'u1'), ('green', 'u1'), ('blue', 'u1')]
+    edges = np.empty(len(lines), dtype=fields)
+    edges['vertex1'], edges['vertex2'] = lines[:, 0], lines[:, 1]
+    if len(fields) > 2:
+        rgb = _colors_to_uint8(colors)
+        edges['red'], edges['green'], edges['blue'] = rgb[:, 0], rgb[:, 1], rgb[:, 2]
+
+    header = ['ply', 'format binary_little_endian 1.0', f'element vertex {len(points)}']
+    header += [f'property double {axis}' for axis in 'xyz']
+    header.append(f'element edge {len(lines)}')
+    header += [f'property int {name}' for name in ('vertex1', 'vertex2')]
+    if len(fields) > 2:
+        header += ['property uchar red', 'property uchar green', 'property uchar blue']
+    header.append('end_header')
+    return ('\n'.join(header) + '\n').encode('ascii') + points.tobytes() + edges.tobytes()
+
+
+def encode_mesh_ply(vertices, triangles, vertex_colors=None, vertex_normals=None):
+    """
+    Encodes a triangle mesh (e.g. the coordinate axes) as a binary PLY
+    readable by Open3D's read_triangle_mesh. Returns bytes.
+    """
+    vertices = np.asarray(vertices, dtype=np.float64).reshape(-1, 3)
+    triangles = np.asarray(triangles).reshape(-1, 3)
+    has_normals = vertex_normals is not None and len(vertex_normals) == len(vertices)
+    has_colors = vertex_colors is not None and len(vertex_colors) == len(vertices)
+    fields = [('x', '<f8'), ('y', '<f8'), ('z', '<f8')]
+    if has_normals:
+        fields += [('nx', '<f8'), ('ny', '<f8'), ('nz', '<f8')]
+    if has_colors:
+        fields += [('red', 'u1'), ('green', 'u1'), ('blue', 'u1')]
+    vertex_data = np.empty(len(vertices), dtype=fields)
+    vertex_data['x'], vertex_data['y'], vertex_data['z'] = vertices.T
+    if has_normals:
+        vertex_data['nx'], vertex_data['ny'], vertex_data['nz'] = np.asarray(vertex_normals, dtype=np.float64).T
+    if has_colors:
+        rgb = _colors_to_uint8(vertex_colors)
+        vertex_data['red'], vertex_data['green'], vertex_data['blue'] = rgb.T
+    faces = np.empty(len(triangles), dtype=[('n', 'u1'), ('idx', '<i4', (3,))])
+    faces['n'], faces['idx'] = 3, triangles
+
+    header = ['ply', 'format binary_little_endian 1.0', f'element vertex {len(vertices)}']
+    header += [f'property double {name}' for name, _ in fields if name in ('x', 'y', 'z', 'nx', 'ny', 'nz')]
+    if has_colors:
+        header += ['property uchar red', 'property uchar green', 'property uchar blue']
+    header += [f'element face {len(triangles)}', 'property list uchar int vertex_indices', 'end_header']
+    return ('\n'.join(header) + '\n').encode('ascii') + vertex_data.tobytes() + faces.tobytes()
+
+
+def points_ref_bytes(source_file, load_dim=4, z_range=None):
+    """
+    The content of a JSON reference to the source point file, written
+    instead of a copy of its points. 'z_range' is the height range used for coloring.
+    """
+    source_file = os.path.abspath(source_file)
+    stat = os.stat(source_file)
+    ref = {
+        'source': source_file,
+        'load_dim': load_dim,
+        'size': stat.st_size,
+        'mtime': stat.st_mtime,
+        'z_range': list(z_range) if z_range is not None else None,
+    }
+    return json.dumps(ref, indent=2).encode('utf-8')
+
+
+def write_points_ref(path, source_file, load_dim=4, z_range=None):
+    """Writes the points_ref_bytes() reference to 'path'."""
+    with open(path, 'wb') as f:
+        f.write(points_ref_bytes(source_file, load_dim=load_dim, z_range=z_range))
+    return str(path)
+
+
+def read_point_ply(path):
+    """
+    Reads a binary little-endian or ASCII point PLY (ours or Open3D's, plain
+    or .gz). Returns (xyz float32 (N, 3), colors uint8 (N, 3) or None).
+    """
+    with open(path, 'rb') as f:
+        return parse_point_ply(f.read(), path)
+
+
+def parse_point_ply(data, path='<bytes>'):
+    """read_point_ply on the file content ('path' only names it in errors)."""
+    if data[:2] == b'\x1f\x8b':
+        data = gzip.decompress(data)
+    end = data.index(b'end_header')
+    body_start = data.index(b'\n', end) + 1
+    header = data[:end].decode('ascii', errors='replace').splitlines()
+
+    fmt, num_vertices, fields, quantization = None, 0, [], None
+    in_vertex = False
+    for line in header:
+        tokens = line.split()
+        if not tokens:
+            continue
+        if tokens[0] == 'format':
+            fmt = tokens[1]
+        elif tokens[0] == 'element':
+            in_vertex = tokens[1] == 'vertex'
+            if in_vertex:
+                num_vertices = int(tokens[2])
+        elif tokens[0] == 'property' and in_vertex:
+            if tokens[1] == 'list':
+                raise ValueError(f"{path}: list properties in the vertex element are not supported")
+            fields.append((tokens[2], _PLY_TYPES[tokens[1]]))
+        elif tokens[:3] == ['comment', 'quantization', 'scale']:
+            quantization = (np.array(tokens[3:6], dtype=np.float64), np.array(tokens[7:10], dtype=np.float64))
+
+    if fmt == 'ascii':
+        values = np.loadtxt(data[body_start:].decode('ascii').splitlines()[:num_vertices], ndmin=2)
+        vertices = np.empty(num_vertices, dtype=[(name, t) for name, t in fields])
+        for i, (name, _) in enumerate(fields):
+            vertices[name] = values[:, i]
+    elif fmt == 'binary_little_endian':
+        dtype = np.dtype([(name, '<' + t) for name, t in fields])
+        vertices = np.frombuffer(data, dtype=dtype, count=num_vertices, offset=body_start)
+    else:
+        raise ValueError(f"{path}: unsupported PLY format '{fmt}'")
+
+    xyz = np.stack([vertices['x'], vertices['y'], vertices['z']], axis=1).astype(np.float64)
+    if quantization is not None:
+        scale, offset = quantization
+        xyz = xyz * scale + offset
+    colors = None
+    if 'red' in vertices.dtype.names:
+        colors = np.stack([vertices['red'], vertices['green'], vertices['blue']], axis=1)
+        if colors.dtype != np.uint8:
+            colors = _colors_to_uint8(colors.astype(np.float64) / (255.0 if colors.size and colors.max() > 1 else 1.0))
+    return xyz.astype(np.float32), colors
+
+
+def read_points_ref(path):
+    """Loads the points a _points_ref.json refers to; returns (xyz, colors uint8)."""
+    with open(path, 'rb') as f:
+        return parse_points_ref(f.read(), path)
+
+
+def parse_points_ref(data, path='<bytes>'):
+    """read_points_ref on the reference's content."""
+    ref = json.loads(data)
+    source = ref['source']
+    if not os.path.exists(source):
+        raise FileNotFoundError(f"{path} refers to a missing point file: {source}")
+    stat = os.stat(source)
+    if stat.st_size != ref.get('size') or stat.st_mtime != ref.get('mtime'):
+        print(f"  > Warning: {source} changed since {path} was written.")
+    points = np.fromfile(source, dtype=np.float32).reshape(-1, ref.get('load_dim', 4))
+    colors = height_colors(points, ref.get('z_range'))
+    return points[:, :3].copy(), _colors_to_uint8(colors)
+
+
+def read_points_artifact(out_dir, basename):
+    """
+    Loads <basename>'s point artifact from 'out_dir' in whichever format it
+    was written. Returns (xyz float32, colors uint8 or None), or None when
+    there is none.
+    """
+    base = Path(out_dir) / basename
+    for suffix, parser in ((POINTS_SUFFIX, parse_point_ply), (POINTS_GZ_SUFFIX, parse_point_ply),
+                           (POINTS_REF_SUFFIX, parse_points_ref)):
+        path = Path(f"{base}{suffix}")
+        data = read_artifact(path)
+        if data is not None:
+            return parser(data, path)
+    return None
+
+
+def read_points_lods(out_dir, basename, max_level=None):
+    """
+    Concatenates LOD levels 0..max_level (all by default) of <basename>.
+    Returns (xyz, colors) like read_point_ply, or None when there are none.
+    """
+    parts = []
+    for level in range(MAX_LOD_LEVELS if max_level is None else max_level + 1):
+        base = Path(out_dir) / f"{basename}{POINTS_LOD_SUFFIX.format(level)}"
+        data = next((d for d in (read_artifact(p) for p in (base, Path(f"{base}.gz"))) if d is not None), None)
+        if data is None:
+            break
+        parts.append(parse_point_ply(data, base))
+    if not parts:
+        return None
+    xyz = np.concatenate([p[0] for p in parts])
+    colors = None if any(p[1] is None for p in parts) else np.concatenate([p[1] for p in parts])
+    return xyz, colors
@@ -0,0 +1,321 @@
+"""
+point_ops.py
+
+Vectorized NumPy point cloud operations shared by mmdet3d_inference2.py
+and the offline tools. Nothing here depends on mmdet3d or Open3D.
+
+Points are (N, C) arrays with x, y, z in the first three columns; any extra
+columns (intensity, time lag, ...) are carried along untouched.
+"""
+
+import numpy as np
+
+
+def get_point_cloud_range(cfg):
+    """
+    Returns the [x_min, y_min, z_min, x_max, y_max, z_max] range of an
+    mmengine config, or None. Looks at the top-level 'point_cloud_range'
+    first, then at the model's voxel layer.
+    """
+    pcr = cfg.get('point_cloud_range', None)
+    if pcr is None:
+        try:
+            pcr = cfg.model.data_preprocessor.voxel_layer.point_cloud_range
+        except AttributeError:
+            return None
+    return [float(v) for v in pcr]
+
+
+def crop_to_range(points, point_cloud_range):
+    """
+    Keeps the points inside point_cloud_range (min inclusive, max exclusive,
+    like mmdet3d's PointsRangeFilter).
+    """
+    pcr = np.asarray(point_cloud_range, dtype=np.float32)
+    xyz = points[:, :3]
+    mask = np.all((xyz >= pcr[:3]) & (xyz < pcr[3:]), axis=1)
+    return points[mask]
+
+
+def estimate_ground_plane(points, threshold=0.2, iterations=200, sample_size=4096, seed=0):
+    """
+    RANSAC ground plane fit with all hypotheses scored in one pass.
+
+    'iterations' random point triplets are drawn from a subsample of the
+    cloud, converted to planes, restricted to near-horizontal normals and
+    scored by their inlier count on the subsample as a single matrix product.
+
+    Returns:
+        (normal, d) of the best plane n·p + d = 0, or None if no plane fits.
+    """
+    if points.shape[0] < 3:
+        return None
+    rng = np.random.default_rng(seed)
+    xyz = points[:, :3].astype(np.float64)
+    sample = xyz[rng.choice(xyz.shape[0], min(sample_size, xyz.shape[0]), replace=False)]
+
+    tri = sample[rng.integers(0, sample.shape[0], (iterations, 3))]
+    normals = np.cross(tri[:, 1] - tri[:, 0], tri[:, 2] - tri[:, 0])
+    lengths = np.linalg.norm(normals, axis=1)
+    valid = lengths > 1e-6
+    normals[valid] /= lengths[valid, None]
+    valid &= np.abs(normals[:, 2]) > 0.9  # ground is roughly horizontal
+    offsets = -np.einsum('ij,ij->i', normals, tri[:, 0])
+
+    inliers = (np.abs(sample @ normals.T + offsets) < threshold).sum(axis=0)
+    inliers[~valid] = -1
+    best = int(np.argmax(inliers))
+    if inliers[best] <= 0:
+        return None
+    return normals[best], offsets[best]
+
+
+def remove_ground(points, threshold=0.2, **ransac_kwargs):
+    """
+    Drops the points within 'threshold' meters of the RANSAC ground plane.
+    Returns the points unchanged when no plane is found.
+    """
+    plane = estimate_ground_plane(points, threshold=threshold, **ransac_kwargs)
+    if plane is None:
+        return points
+    normal, offset = plane
+    distance = np.abs(points[:, :3].astype(np.float64) @ normal + offset)
+    return points[distance >= threshold]
+
+
+def voxel_keys(points, voxel_size):
+    """
+    Returns one int64 key per point identifying its voxel of edge
+    'voxel_size' (scalar or per-axis), plus the integer voxel coordinates.
+    """
+    coords = np.floor(points[:, :3] / np.asarray(voxel_size, dtype=np.float32)).astype(np.int64)
+    coords -= coords.min(axis=0)
+    dims = coords.max(axis=0) + 1
+    keys = (coords[:, 0] * dims[1] + coords[:, 1]) * dims[2] + coords[:, 2]
+    return keys, coords
+
+
+def voxel_downsample(points, voxel_size):
+    """
+    Keeps the first point of every occupied voxel, preserving input order.
+    Real points (not centroids) are kept so extra channels stay meaningful.
+    """
+    if points.shape[0] == 0:
+        return points
+    keys, _ = voxel_keys(points, voxel_size)
+    _, first = np.unique(keys, return_index=True)
+    return points[np.sort(first)]
+
+
+def points_in_boxes(points, boxes, margin=0.0):
+    """
+    Mask of the points inside any of the 7-DoF LiDAR boxes
+    [x, y, z_bottom, l, w, h, yaw, ...], each enlarged by 'margin' metres.
+    """
+    mask = np.zeros(points.shape[0], dtype=bool)
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, np.shape(boxes)[-1] if len(boxes) else 7)
+    xyz = points[:, :3]
+    for x, y, z, l, w, h, yaw in boxes[:, :7]:
+        # Cheap axis-aligned prefilter on the enclosing circle before rotating
+        radius = 0.5 * np.hypot(l, w) + margin
+        near = np.nonzero((np.abs(xyz[:, 0] - x) <= radius) & (np.abs(xyz[:, 1] - y) <= radius))[0]
+        dx, dy = xyz[near, 0] - x, xyz[near, 1] - y
+        cos, sin = np.cos(yaw), np.sin(yaw)
+        local_x, local_y = dx * cos + dy * sin, -dx * sin + dy * cos
+        dz = xyz[near, 2] - z
+        inside = ((np.abs(local_x) <= l / 2 + margin) & (np.abs(local_y) <= w / 2 + margin)
+                  & (dz >= -margin) & (dz <= h + margin))
+        mask[near[inside]] = True
+    return mask
+
+
+def _voxel_representatives(points, voxel_size):
+    """
+    Index of the first point of every occupied voxel. On randomly permuted
+    points that is a random point per voxel, and the points picked for a
+    voxel size are a subset of those picked for half that size (aligned
+    grids), which makes LOD levels nest.
+    """
+    keys, _ = voxel_keys(points, voxel_size)
+    _, first = np.unique(keys, return_index=True)
+    return first
+
+
+def decimate_indices(points, max_points=None, voxel_size=None, keep_mask=None, stratum_size=0.5, seed=0):
+    """
+    Sorted indices of a spatially uniform preview subset of 'points'.
+
+    Points flagged in 'keep_mask' (e.g. inside boxes) are always kept at full
+    resolution. Of the others, one random point per voxel of edge
+    'voxel_size' is kept; with 'max_points' the rest of the budget is drawn
+    by random stratified sampling: every point is weighted by the inverse
+    point count of its 'stratum_size' cell, so each occupied cell keeps about
+    the same number of points (dense areas near the sensor are thinned, the
+    sparse far field is kept).
+    """
+    rng = np.random.default_rng(seed)
+    keep = np.zeros(points.shape[0], dtype=bool) if keep_mask is None else np.asarray(keep_mask, dtype=bool)
+    # Random order of the remaining points: first-per-voxel becomes random-per-voxel
+    rest = np.nonzero(~keep)[0]
+    rest = rest[rng.permutation(rest.size)]
+    chosen = _voxel_representatives(points[rest], voxel_size) if voxel_size and rest.size else np.arange(rest.size)
+
+    budget = None if max_points is None else max(0, max_points - int(keep.sum()))
+    if budget is not None and chosen.size > budget:
+        keys, _ = voxel_keys(points[rest[chosen]], max(stratum_size, 2.0 * (voxel_size or 0.0)))
+        _, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+        # Weighted sampling without replacement (Efraimidis-Spirakis): top-k of log(u) / w
+        sample_keys = np.log(rng.random(chosen.size)) * counts[inverse]
+        chosen = chosen[np.argpartition(-sample_keys, budget - 1)[:budget]] if budget else chosen[:0]
+
+    return np.sort(np.concatenate([np.nonzero(keep)[0], rest[chosen]]))
+
+
+def lod_indices(points, num_levels, base_voxel=0.1, keep_mask=None, seed=0):
+    """
+    Splits the points into 'num_levels' disjoint index sets for progressive
+    loading: level 0 holds the 'keep_mask' points plus one point per voxel of
+    edge base_voxel * 2**(num_levels - 2), each further level adds the points
+    of a grid half as coarse, and the last level the remaining points, so
+    levels 0..k together are a uniform preview and all levels the full cloud.
+    """
+    perm = np.random.default_rng(seed).permutation(points.shape[0])
+    shuffled = points[perm]
+    assigned = np.zeros(points.shape[0], dtype=bool)
+    if keep_mask is not None:
+        assigned |= np.asarray(keep_mask, dtype=bool)
+    levels = []
+    for level in range(num_levels - 1):
+        reps = perm[_voxel_representatives(shuffled, base_voxel * 2.0 ** (num_levels - 2 - level))] \
+            if points.shape[0] else np.zeros(0, dtype=np.int64)
+        new = reps[~assigned[reps]]
+        if level == 0 and keep_mask is not None:
+            new = np.concatenate([np.nonzero(keep_mask)[0], new])
+        assigned[new] = True
+        levels.append(np.sort(new))
+    levels.append(np.nonzero(~assigned)[0])
+    return levels
+
+
+def preprocess_points(points, point_cloud_range=None, ground_threshold=None, voxel_size=None):
+    """
+    Range crop -> ground removal -> voxel downsampling; each stage optional.
+
+    Returns:
+        (points, report) where report is a list of (stage, points_after).
+    """
+    report = [('input', points.shape[0])]
+    if point_cloud_range is not None:
+        points = crop_to_range(points, point_cloud_range)
+        report.append(('range', points.shape[0]))
+    if ground_threshold:
+        points = remove_ground(points, threshold=ground_threshold)
+        report.append(('ground', points.shape[0]))
+    if voxel_size:
+        points = voxel_downsample(points, voxel_size)
+        report.append(('voxel', points.shape[0]))
+    return points, report
+
+
+def get_voxel_layer_cfg(cfg):
+    """
+    Returns the hard-voxelization settings of an mmengine config
+    (model.data_preprocessor.voxel_layer) as a dict, or None.
+    """
+    try:
+        layer = cfg.model.data_preprocessor.voxel_layer
+    except AttributeError:
+        return None
+    max_voxels = layer.get('max_voxels', 20000)
+    if isinstance(max_voxels, (list, tuple)):
+        max_voxels = max_voxels[1]  # (train, test)
+    return {
+        'voxel_size': [float(v) for v in layer['voxel_size']],
+        'point_cloud_range': [float(v) for v in layer['point_cloud_range']],
+        'max_num_points': int(layer['max_num_points']),
+        'max_voxels': int(max_voxels),
+    }
+
+
+def hard_voxelize(points, voxel_size, point_cloud_range, max_num_points, max_voxels):
+    """
+    Hard voxelization with the semantics of mmcv's Voxelization op:
+    points outside the range are dropped, voxels are numbered in order of
+    their first point, only the first 'max_voxels' voxels are kept and each
+    keeps its first 'max_num_points' points (in input order).
+
+    Vectorized as: voxel keys -> first-appearance ranks -> stable sort by
+    voxel -> position within voxel from cumulative counts -> first-K mask.
+
+    Returns:
+        voxels (V, max_num_points, C) float32 zero-padded,
+        coors (V, 3) int32 voxel coordinates in (z, y, x) order,
+        num_points (V,) int32.
+    """
+    voxel_size = np.asarray(voxel_size, dtype=np.float32)
+    pcr = np.asarray(point_cloud_range, dtype=np.float32)
+    grid = np.round((pcr[3:] - pcr[:3]) / voxel_size).astype(np.int64)
+
+    coords = np.floor((points[:, :3] - pcr[:3]) / voxel_size).astype(np.int64)
+    valid = np.all((coords >= 0) & (coords < grid), axis=1)
+    points, coords = points[valid], coords[valid]
+    num_channels = points.shape[1]
+    if points.shape[0] == 0:
+        return (np.zeros((0, max_num_points, num_channels), dtype=np.float32),
+                np.zeros((0, 3), dtype=np.int32), np.zeros((0,), dtype=np.int32))
+
+    keys = (coords[:, 2] * grid[1] + coords[:, 1]) * grid[0] + coords[:, 0]
+    _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    # Renumber voxels by their first point so truncation keeps the earliest ones
+    appearance = np.argsort(first, kind='stable')
+    rank = np.empty_like(appearance)
+    rank[appearance] = np.arange(appearance.size)
+    voxel_ids = rank[inverse.reshape(-1)]
+
+    num_voxels = min(appearance.size, max_voxels)
+    counts = np.bincount(voxel_ids, minlength=appearance.size)
+    order = np.argsort(voxel_ids, kind='stable')
+    sorted_ids = voxel_ids[order]
+    slot = np.arange(order.size) - (np.cumsum(counts) - counts)[sorted_ids]
+    keep = (slot < max_num_points) & (sorted_ids < num_voxels)
+
+    voxels = np.zeros((num_voxels, max_num_points, num_channels), dtype=np.float32)
+    voxels[sorted_ids[keep], slot[keep]] = points[order[keep]]
+    coors = coords[first[appearance[:num_voxels]]][:, ::-1].astype(np.int32)
+    num_points = np.minimum(counts[:num_voxels], max_num_points).astype(np.int32)
+    return voxels, coors, num_points
+
+
+# Polynomial fit of the Turbo colormap (Google AI, Apache-2.0), so the
+# offline tools can color points without matplotlib
+_TURBO_COEFFS = np.array([
+    [0.13572138, 4.61539260, -42.66032258, 132.13108234, -152.94239396, 59.28637943],
+    [0.09140261, 2.19418839, 4.84296658, -14.18503333, 4.27729857, 2.82956604],
+    [0.10667330, 12.64194608, -60.58204836, 110.36276771, -89.90310912, 27.34824973],
+])
+
+
+def turbo_colormap(values):
+    """Maps values in [0, 1] to (N, 3) Turbo RGB colors in [0, 1]."""
+    x = np.clip(np.asarray(values, dtype=np.float64), 0.0, 1.0)
+    powers = x[:, None] ** np.arange(6)
+    return np.clip(powers @ _TURBO_COEFFS.T, 0.0, 1.0)
+
+
+def height_range(points, percentiles=(2, 98)):
+    """Robust (z_low, z_high) used to normalize heights for coloring."""
+    if len(points) == 0:
+        return 0.0, 0.0
+    z_low, z_high = np.percentile(points[:, 2], percentiles)
+    return float(z_low), float(z_high)
+
+
+def height_colors(points, z_range=None, gamma=0.8):
+    """
+    Colors points by height like mmdet3d_inference2.color_points_by_height
+    (percentile clipping, gamma, Turbo), in pure NumPy.
+    """
+    z_low, z_high = z_range if z_range is not None else height_range(points)
+    z = points[:, 2].astype(np.float64)
+    z_norm = (z - z_low) / (z_high - z_low) if z_high > z_low else np.zeros_like(z)
+    return turbo_colormap(np.clip(z_norm, 0.0, 1.0) ** gamma)
@@ -0,0 +1,365 @@
+"""
+postprocess.py
+
+CPU post-processing of 3D detections, usable on the <frame>_predictions.json
+files saved by mmdet3d_inference2.py without re-running the network:
+
+  - rotated BEV NMS on the vectorized rotated-IoU matrix of box_ops
+  - class-aware NMS (per-class IoU thresholds)
+  - circle NMS on BEV center distance, as in the CenterPoint heads
+  - per-class and overall top-K caps
+  - 3D weighted box fusion of several models' boxes (used by --ensemble)
+
+Boxes are (N, >=7) [x, y, z, l, w, h, yaw, ...]; extra columns (nuScenes
+velocities) are kept untouched.
+
+Usage:
+  python postprocess.py --pred-dir outputs/kitti_second --out-dir outputs/kitti_second_nms \
+      --score-thr 0.1 --nms rotated --iou-thr 0.1 --topk-per-class 50
+  python postprocess.py --check-wbf
+"""
+
+import os
+import json
+import argparse
+
+import numpy as np
+
+from box_ops import bev_iou
+
+PREDICTION_SUFFIX = '_predictions.json'
+
+
+# --------------------------------------------------------------------
+# NMS
+# --------------------------------------------------------------------
+
+def _greedy_suppress(overlap, order):
+    """
+    Greedy NMS over a precomputed boolean 'overlap' matrix (i suppresses j)
+    for candidates already sorted by descending score. Returns kept positions.
+    """
+    suppressed = np.zeros(order.size, dtype=bool)
+    keep = []
+    for i in range(order.size):
+        if suppressed[i]:
+            continue
+        keep.append(i)
+        suppressed |= overlap[i]
+    return np.asarray(keep, dtype=np.int64)
+
+
+def rotated_nms(boxes, scores, iou_thr, pre_max=None, post_max=None):
+    """
+    Greedy NMS on rotated BEV IoU.
+
+    Args:
+        boxes: (N, >=7) boxes
+        scores: (N,) scores
+        iou_thr: Boxes overlapping a kept box by more than this are dropped
+        pre_max: Only the 'pre_max' best-scoring boxes enter NMS
+        post_max: At most 'post_max' boxes are kept
+
+    Returns:
+        Indices of the kept boxes, by descending score.
+    """
+    order = np.argsort(-np.asarray(scores), kind='stable')[:pre_max]
+    if order.size == 0:
+        return order
+    ious = bev_iou(np.asarray(boxes)[order, :7], np.asarray(boxes)[order, :7])
+    keep = _greedy_suppress(ious > iou_thr, order)
+    return order[keep][:post_max]
+
+
+def circle_nms(boxes, scores, min_radius, pre_max=None, post_max=None):
+    """
+    CenterPoint-style circle NMS: a box is dropped when its BEV center lies
+    within a kept box's radius. As in mmdet3d's circle_nms, 'min_radius' is
+    compared against the squared center distance.
+
+    Returns:
+        Indices of the kept boxes, by descending score.
+    """
+    order = np.argsort(-np.asarray(scores), kind='stable')[:pre_max]
+    if order.size == 0:
+        return order
+    centers = np.asarray(boxes, dtype=np.float64)[order, :2]
+    dist2 = np.sum((centers[:, None, :] - centers[None, :, :]) ** 2, axis=-1)
+    keep = _greedy_suppress(dist2 <= min_radius, order)
+    return order[keep][:post_max]
+
+
+def _per_class_value(value, label, default=None):
+    if isinstance(value, dict):
+        return value.get(label, default)
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return value[label] if label < len(value) else default
+    return value
+
+
+def class_aware_nms(boxes, scores, labels, method='rotated', iou_thr=0.1, min_radius=4.0,
+                    pre_max=None, post_max=None):
+    """
+    Runs rotated_nms or circle_nms separately for each class. 'iou_thr' and
+    'min_radius' may be scalars, per-class lists or {label: value} dicts.
+
+    Returns:
+        Indices of the kept boxes, by descending score.
+    """
+    labels = np.asarray(labels)
+    kept = []
+    for label in np.unique(labels):
+        idx = np.nonzero(labels == label)[0]
+        if method == 'circle':
+            radius = _per_class_value(min_radius, int(label), 4.0)
+            sub = circle_nms(boxes[idx], scores[idx], radius, pre_max=pre_max, post_max=post_max)
+        else:
+            thr = _per_class_value(iou_thr, int(label), 0.1)
+            sub = rotated_nms(boxes[idx], scores[idx], thr, pre_max=pre_max, post_max=post_max)
+        kept.append(idx[sub])
+    if not kept:
+        return np.zeros(0, dtype=np.int64)
+    kept = np.concatenate(kept)
+    return kept[np.argsort(-np.asarray(scores)[kept], kind='stable')]
+
+
+def topk_per_class(scores, labels, k):
+    """Indices of the 'k' best-scoring boxes of every class, by descending score."""
+    scores, labels = np.asarray(scores), np.asarray(labels)
+    order = np.argsort(-scores, kind='stable')
+    sorted_labels = labels[order]
+    # Rank of each box within its class (order is score-sorted)
+    class_order = np.argsort(sorted_labels, kind='stable')
+    _, starts, counts = np.unique(sorted_labels[class_order], return_index=True, return_counts=True)
+    rank = np.empty(order.size, dtype=np.int64)
+    rank[class_order] = np.arange(order.size) - np.repeat(starts, counts)
+    return order[rank < k]
+
+
+# --------------------------------------------------------------------
+# Weighted box fusion
+# --------------------------------------------------------------------
+
+def _align_yaw(yaw, ref):
+    """Shifts 'yaw' by multiples of pi to within pi/2 of 'ref' (overlap ignores heading)."""
+    return yaw - np.pi * np.round((yaw - ref) / np.pi)
+
+
+def _fuse_cluster(boxes, scores, weights):
+    """Score-weighted mean box of one cluster; the yaw keeps the best box's heading."""
+    coeff = scores * weights
+    aligned = boxes.copy()
+    aligned[:, 6] = _align_yaw(boxes[:, 6], boxes[np.argmax(coeff), 6])
+    return (coeff[:, None] * aligned).sum(axis=0) / coeff.sum()
+
+
+def weighted_box_fusion(preds, weights=None, iou_thr=0.55, skip_box_thr=0.0, conf_type='avg'):
+    """
+    3D weighted box fusion (WBF) of several models' predictions for one frame.
+
+    Boxes of the same label are visited by descending weighted score and
+    joined to the first fused box they overlap by more than 'iou_thr' (rotated
+    BEV IoU); every fused box is the score-weighted mean of its members.
+    With conf_type 'avg' the fused score is the weighted mean over all models
+    of each model's best score in the cluster, 0 for models that missed it
+    (a box found by one of three equal models scores a third). With 'max' it
+    is the best weighted score over the largest weight. Both stay in [0, 1].
+
+    Args:
+        preds: List of {'bboxes_3d', 'scores_3d', 'labels_3d'} arrays, one per
+            model, with labels already in a shared class space
+        weights: Per-model weights (default 1 each)
+        skip_box_thr: Boxes scoring below this are ignored
+
+    Returns:
+        {'bboxes_3d', 'scores_3d', 'labels_3d'} of the fused boxes, by
+        descending score.
+    """
+    weights = np.ones(len(preds)) if weights is None else np.asarray(weights, dtype=np.float64)
+    dim = max((np.asarray(p['bboxes_3d']).reshape(len(p['scores_3d']), -1).shape[1]
+               for p in preds if len(p['scores_3d'])), default=7)
+
+    boxes, scores, labels, model_ids = [], [], [], []
+    for i, p in enumerate(preds):
+        s = np.asarray(p['scores_3d'], dtype=np.float64)
+        b = np.asarray(p['bboxes_3d'], dtype=np.float64).reshape(len(s), -1) if len(s) else np.zeros((0, dim))
+        keep = s >= skip_box_thr
+        # Models without velocity columns contribute zeros there
+        boxes.append(np.pad(b[keep], ((0, 0), (0, dim - b.shape[1]))))
+        scores.append(s[keep])
+        labels.append(np.asarray(p['labels_3d'], dtype=np.int64)[keep])
+        model_ids.append(np.full(int(keep.sum()), i))
+    boxes, scores = np.concatenate(boxes), np.concatenate(scores)
+    labels, model_ids = np.concatenate(labels), np.concatenate(model_ids)
+
+    fused_boxes, fused_scores, fused_labels = [], [], []
+    for label in np.unique(labels):
+        idx = np.nonzero(labels == label)[0]
+        idx = idx[np.argsort(-(scores[idx] * weights[model_ids[idx]]), kind='stable')]
+        clusters, cluster_boxes = [], np.zeros((0, dim))
+        for i in idx:
+            match = -1
+            if clusters:
+                ious = bev_iou(boxes[i:i + 1, :7], cluster_boxes[:, :7])[0]
+                best = int(np.argmax(ious))
+                if ious[best] > iou_thr:
+                    match = best
+            if match < 0:
+                clusters.append([i])
+                cluster_boxes = np.vstack([cluster_boxes, boxes[i]])
+            else:
+                clusters[match].append(i)
+                members = clusters[match]
+                cluster_boxes[match] = _fuse_cluster(boxes[members], scores[members],
+                                                     weights[model_ids[members]])
+
+        for members, box in zip(clusters, cluster_boxes):
+            if conf_type == 'max':
+                score = (scores[members] * weights[model_ids[members]]).max() / weights.max()
+            else:
+                # A model with several boxes in the cluster counts once, with its best score
+                best = np.zeros(len(weights))
+                np.maximum.at(best, model_ids[members], scores[members])
+                score = (best * weights).sum() / weights.sum()
+            fused_boxes.append(box)
+            fused_scores.append(score)
+            fused_labels.append(label)
+
+    order = np.argsort(-np.asarray(fused_scores), kind='stable')
+    return {
+        'bboxes_3d': np.asarray(fused_boxes, dtype=np.float64).reshape(-1, dim)[order],
+        'scores_3d': np.asarray(fused_scores, dtype=np.float64)[order],
+        'labels_3d': np.asarray(fused_labels, dtype=np.int64)[order],
+    }
+
+
+def check_weighted_box_fusion():
+    """
+    Checks the fused scores of weighted_box_fusion on small fixed cases,
+    including non-unit model weights. Returns True when all of them pass.
+    """
+    def pred(*scores):
+        boxes = [[0.05 * i, 0.0, 0.0, 4.0, 1.8, 1.5, 0.0] for i in range(len(scores))]
+        return {'bboxes_3d': boxes, 'scores_3d': list(scores), 'labels_3d': [0] * len(scores)}
+
+    none = pred()
+    cases = [
+        # (description, preds, weights, expected fused score)
+        ("two equal models agree", [pred(0.9), pred(0.7)], None, 0.8),
+        ("one of three equal models", [pred(0.9), none, none], None, 0.3),
+        ("weights 2:1 agree", [pred(0.9), pred(0.9)], [2, 1], 0.9),
+        ("weights 2:1, heavy model alone", [pred(0.9), none], [2, 1], 0.6),
+        ("weights 2:1, light model alone", [none, pred(0.9)], [2, 1], 0.3),
+        ("duplicate boxes of one model", [pred(0.9, 0.8), none], [2, 1], 0.6),
+    ]
+    ok = True
+    for description, preds, weights, expected in cases:
+        scores = weighted_box_fusion(preds, weights=weights)['scores_3d']
+        passed = len(scores) == 1 and abs(scores[0] - expected) < 1e-9
+        ok &= passed
+        print(f"[{'OK' if passed else 'FAILED'}] {description}: {np.round(scores, 4).tolist()} "
+              f"(expected [{expected}])")
+    return ok
+
+
+# --------------------------------------------------------------------
+# Saved predictions
+# --------------------------------------------------------------------
+
+def load_predictions(pred_path):
+    """Reads a predictions JSON into arrays, keeping every box column and extra key."""
+    with open(pred_path, 'r') as f:
+        data = json.load(f)
+    if isinstance(data, list):
+        data = data[0] if data else {}
+    if 'pred_instances_3d' in data:
+        data = data['pred_instances_3d']
+    pred = dict(data)
+    boxes = np.asarray(data.get('bboxes_3d', []), dtype=np.float64)
+    pred['bboxes_3d'] = boxes.reshape(-1, boxes.shape[-1]) if boxes.size else np.zeros((0, 7))
+    pred['scores_3d'] = np.asarray(data.get('scores_3d', np.ones(len(pred['bboxes_3d']))), dtype=np.float64)
+    pred['labels_3d'] = np.asarray(data.get('labels_3d', np.zeros(len(pred['bboxes_3d']))), dtype=np.int64)
+    return pred
+
+
+def save_predictions(pred, pred_path):
+    serializable = {k: v.tolist() if isinstance(v, np.ndarray) else v for k, v in pred.items()}
+    with open(pred_path, 'w') as f:
+        json.dump(serializable, f, indent=2)
+
+
+def postprocess_predictions(pred, score_thr=0.0, nms=None, iou_thr=0.1, min_radius=4.0,
+                            pre_max=None, topk_per_class_k=None, max_boxes=None):
+    """
+    Score filter -> class-aware NMS ('rotated', 'circle' or None) ->
+    per-class top-K -> overall cap, on one frame's prediction arrays.
+
+    Returns:
+        A new prediction dict restricted to the kept boxes.
+    """
+    boxes, scores, labels = pred['bboxes_3d'], pred['scores_3d'], pred['labels_3d']
+    keep = np.nonzero(scores >= score_thr)[0]
+    if nms:
+        sub = class_aware_nms(boxes[keep], scores[keep], labels[keep], method=nms,
+                              iou_thr=iou_thr, min_radius=min_radius, pre_max=pre_max)
+        keep = keep[sub]
+    if topk_per_class_k:
+        keep = keep[topk_per_class(scores[keep], labels[keep], topk_per_class_k)]
+    keep = keep[np.argsort(-scores[keep], kind='stable')][:max_boxes]
+
+    out = dict(pred)
+    out['bboxes_3d'], out['scores_3d'], out['labels_3d'] = boxes[keep], scores[keep], labels[keep]
+    return out
+
+
+def _parse_per_class(text, cast=float):
+    """'0.1' -> 0.1 ; '0.1,0.2,0.3' -> [0.1, 0.2, 0.3] (indexed by label)."""
+    values = [cast(v) for v in text.split(',') if v.strip()]
+    return values[0] if len(values) == 1 else values
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-run NMS / top-K on saved predictions")
+    parser.add_argument("--pred-dir", type=str, default=None,
+                        help="Directory with <frame>_predictions.json files")
+    parser.add_argument("--out-dir", type=str, default=None)
+    parser.add_argument("--score-thr", type=float, default=0.0)
+    parser.add_argument("--nms", type=str, default="rotated", choices=["rotated", "circle", "none"])
+    parser.add_argument("--iou-thr", type=str, default="0.1",
+                        help="Rotated NMS IoU threshold, or comma-separated per-class thresholds")
+    parser.add_argument("--min-radius", type=str, default="4.0",
+                        help="Circle NMS radius (squared-distance units, like CenterPoint), or per-class list")
+    parser.add_argument("--pre-max", type=int, default=None, help="Boxes per class entering NMS")
+    parser.add_argument("--topk-per-class", type=int, default=None)
+    parser.add_argument("--max-boxes", type=int, default=None)
+    parser.add_argument("--check-wbf", action="store_true",
+                        help="Check the weighted box fusion scores on fixed cases and exit")
+    args = parser.parse_args()
+
+    if args.check_wbf:
+        raise SystemExit(0 if check_weighted_box_fusion() else 1)
+    if not args.pred_dir or not args.out_dir:
+        parser.error("--pred-dir and --out-dir are required")
+
+    names = sorted(n for n in os.listdir(args.pred_dir) if n.endswith(PREDICTION_SUFFIX))
+    if not names:
+        print(f"[WARN] No predictions found in {args.pred_dir}")
+        return
+    os.makedirs(args.out_dir, exist_ok=True)
+
+    total_in = total_out = 0
+    for name in names:
+        pred = load_predictions(os.path.join(args.pred_dir, name))
+        out = postprocess_predictions(
+            pred, score_thr=args.score_thr, nms=None if args.nms == "none" else args.nms,
+            iou_thr=_parse_per_class(args.iou_thr), min_radius=_parse_per_class(args.min_radius),
+            pre_max=args.pre_max, topk_per_class_k=args.topk_per_class, max_boxes=args.max_boxes)
+        save_predictions(out, os.path.join(args.out_dir, name))
+        total_in += len(pred['scores_3d'])
+        total_out += len(out['scores_3d'])
+
+    print(f"[INFO] {len(names)} frame(s): {total_in} -> {total_out} boxes, written to {args.out_dir}")
+
+
+if __name__ == "__main__":
+    main()
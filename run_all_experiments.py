@@ -5,7 +5,8 @@ run_all_experiments.py  (HW2 – Automated Evaluation Script)
 This script runs all 3D detection experiments required for CMPE 249 HW2.
 It automates the full evaluation pipeline:
 
-1. Execute mmdet3d_inference2.py for each model–dataset pair.
+1. Execute mmdet3d_inference2.py for each experiment of the matrix
+   in experiments.yaml (model × dataset × threshold × device × threads).
 2. Measure wall-clock runtime for each experiment.
 3. Record failures (if any) and print clean summaries.
 4. Save results into results/experiment_timings.csv for analysis.
@@ -20,10 +21,15 @@ The script is intentionally heavily commented for clarity and grading.
 import os
 import time
 import csv
+import json
+import fnmatch
+import argparse
 import subprocess
 from pathlib import Path
 import sys  # ensures we use the SAME Python (venv) that runs this script
 
+from experiment_matrix import DEFAULT_MATRIX, load_experiments
+
 
 # ----------------------------------------------------------------------
 # GLOBAL SETTINGS
@@ -40,6 +46,10 @@ RESULTS_DIR = Path("results")
 RESULTS_DIR.mkdir(parents=True, exist_ok=True)
 TIMINGS_CSV = RESULTS_DIR / "experiment_timings.csv"
 
+# Per-run stage timings (run_stats.json of each output folder) are collected here
+# for pareto_report.py
+RUNS_DIR = RESULTS_DIR / "runs"
+
 
 # ----------------------------------------------------------------------
 # Helper: Construct a CLI command for subprocess.run()
@@ -77,7 +87,7 @@ def build_cmd(args_dict):
 # ----------------------------------------------------------------------
 # Helper: Run a single experiment and measure runtime
 # ----------------------------------------------------------------------
-def run_experiment(name, args_dict):
+def run_experiment(name, args_dict, env=None):
     """
     Runs one HW2 experiment by:
       - Building the CLI command
@@ -107,7 +117,9 @@ def run_experiment(name, args_dict):
 
     try:
         # capture_output=True → prevents terminal spam
-        result = subprocess.run(cmd, check=False, capture_output=True, text=True)
+        # Extra variables (e.g. OMP_NUM_THREADS for thread-count sweeps) on top of ours
+        run_env = dict(os.environ, **env) if env else None
+        result = subprocess.run(cmd, check=False, capture_output=True, text=True, env=run_env)
     except Exception as e:
         end = time.perf_counter()
         print(f"[{name}] FAILED to launch: {e}")
@@ -146,12 +158,39 @@ def run_experiment(name, args_dict):
     }
 
 
+# ----------------------------------------------------------------------
+# Helper: Collect the run statistics written by mmdet3d_inference2.py
+# ----------------------------------------------------------------------
+def collect_run_stats(name, args_dict):
+    """
+    Copies <out-dir>/run_stats.json to results/runs/<name>.json, tagging it
+    with the experiment name. Returns the destination path, or None if the
+    run did not write statistics.
+    """
+    stats_path = Path(args_dict["out-dir"]) / "run_stats.json"
+    if not stats_path.is_file():
+        print(f"[{name}] No run_stats.json found in {stats_path.parent}")
+        return None
+
+    with stats_path.open() as f:
+        stats = json.load(f)
+    stats["experiment"] = name
+
+    RUNS_DIR.mkdir(parents=True, exist_ok=True)
+    dest = RUNS_DIR / f"{name}.json"
+    with dest.open("w") as f:
+        json.dump(stats, f, indent=2)
+    return dest
+
+
 # ----------------------------------------------------------------------
 # MAIN: Define and run all HW2 experiments
 # ----------------------------------------------------------------------
 def main():
     """
-    Defines all five experiments used for HW2:
+    Runs every experiment of the declarative matrix (experiments.yaml by
+    default; see experiment_matrix.py). The default matrix holds the five
+    HW2 experiments:
 
     KITTI:
         1. PointPillars
@@ -162,114 +201,38 @@ def main():
         4. PointPillars
         5. CenterPoint
 
-    Each experiment specifies:
-      - dataset
-      - input-path
-      - frame-number (KITTI)
-      - model + checkpoint
-      - output folder
-      - GPU device
-      - score threshold
-      - headless rendering
+    Larger benchmark sweeps (thresholds x devices x thread counts) are
+    added as matrix blocks instead of copy-pasted dicts.
     """
-
-    experiments = [
-
-        # --------------------------------------------------------------
-        # 1) KITTI – PointPillars (frame 000123)
-        # --------------------------------------------------------------
-        {
-            "name": "kitti_pointpillars_000123",
-            "args": {
-                "dataset": "kitti",
-                "input-path": "data/kitti/training",
-                "frame-number": "000123",
-                "model": "pointpillars_hv_secfpn_8xb6-160e_kitti-3d-car",
-                "checkpoint": "checkpoints/kitti_pointpillars/hv_pointpillars_secfpn_6x8_160e_kitti-3d-car_20220331_134606-d42d15ed.pth",
-                "out-dir": "outputs/kitti_pointpillars",
-                "device": "cuda:0",
-                "headless": True,
-                "score-thr": 0.3,
-            },
-        },
-
-        # --------------------------------------------------------------
-        # 2) KITTI – 3DSSD
-        # --------------------------------------------------------------
-        {
-            "name": "kitti_3dssd_000123",
-            "args": {
-                "dataset": "kitti",
-                "input-path": "data/kitti/training",
-                "frame-number": "000123",
-                "model": "3dssd_4x4_kitti-3d-car",
-                "checkpoint": "checkpoints/3dssd/3dssd_4x4_kitti-3d-car_20210818_203828-b89c8fc4.pth",
-                "out-dir": "outputs/kitti_3dssd",
-                "device": "cuda:0",
-                "headless": True,
-                "score-thr": 0.6,
-            },
-        },
-
-        # --------------------------------------------------------------
-        # 3) KITTI – SECOND (weaker baseline)
-        # --------------------------------------------------------------
-        {
-            "name": "kitti_second_000123",
-            "args": {
-                "dataset": "kitti",
-                "input-path": "data/kitti/training",
-                "frame-number": "000123",
-                "model": "second_hv_secfpn_8xb6-80e_kitti-3d-3class",
-                "checkpoint": "checkpoints/kitti_second/second_hv_secfpn_8xb6-80e_kitti-3d-3class-b086d0a3.pth",
-                "out-dir": "outputs/kitti_second",
-                "device": "cuda:0",
-                "headless": True,
-                "score-thr": 0.05,
-            },
-        },
-
-        # --------------------------------------------------------------
-        # 4) nuScenes – PointPillars (single lidar sample)
-        # --------------------------------------------------------------
-        {
-            "name": "nuscenes_pointpillars_demo",
-            "args": {
-                "dataset": "any",
-                "input-path": "data/nuscenes_demo/lidar/n015-2018-07-24-11-22-45+0800__LIDAR_TOP__1532402927647951.pcd.bin",
-                "model": "pointpillars_hv_fpn_sbn-all_8xb4-2x_nus-3d",
-                "checkpoint": "checkpoints/nuscenes_pointpillars/hv_pointpillars_fpn_sbn-all_4x8_2x_nus-3d_20210826_104936-fca299c1.pth",
-                "out-dir": "outputs/nuscenes_pointpillars",
-                "device": "cuda:0",
-                "headless": True,
-                "score-thr": 0.2,
-            },
-        },
-
-        # --------------------------------------------------------------
-        # 5) nuScenes – CenterPoint
-        # --------------------------------------------------------------
-        {
-            "name": "nuscenes_centerpoint_demo",
-            "args": {
-                "dataset": "any",
-                "input-path": "data/nuscenes_demo/lidar/n015-2018-07-24-11-22-45+0800__LIDAR_TOP__1532402927647951.pcd.bin",
-                "model": "centerpoint_voxel01_second_secfpn_head-circlenms_8xb4-cyclic-20e_nus-3d",
-                "checkpoint": "checkpoints/nuscenes_centerpoint/centerpoint_01voxel_second_secfpn_circlenms_4x8_cyclic-20e_nus-3d_20220810_030004-9061688e.pth",
-                "out-dir": "outputs/nuscenes_centerpoint",
-                "device": "cuda:0",
-                "headless": True,
-                "score-thr": 0.25,
-            },
-        },
-    ]
+    parser = argparse.ArgumentParser(description="Run the experiment matrix")
+    parser.add_argument("--matrix", type=str, default=DEFAULT_MATRIX,
+                        help="Experiment matrix file (.yaml or .toml)")
+    parser.add_argument("--only", type=str, nargs="+", default=None,
+                        help="Run only experiments whose name matches one of these glob patterns")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Print the expanded commands without running them")
+    cli_args = parser.parse_args()
+
+    experiments = load_experiments(cli_args.matrix)
+    if cli_args.only:
+        experiments = [exp for exp in experiments
+                       if any(fnmatch.fnmatch(exp["name"], pattern) for pattern in cli_args.only)]
+    print(f"{len(experiments)} experiment(s) from {cli_args.matrix}")
+
+    if cli_args.dry_run:
+        for exp in experiments:
+            env = " ".join(f"{k}={v}" for k, v in exp["env"].items())
+            print(f"{exp['name']}: {env + ' ' if env else ''}{' '.join(build_cmd(exp['args']))}")
+        return
 
     # ------------------------------------------------------------------
     # Run each experiment and collect results
     # ------------------------------------------------------------------
     results = []
     for exp in experiments:
-        res = run_experiment(exp["name"], exp["args"])
+        res = run_experiment(exp["name"], exp["args"], env=exp["env"])
+        if res["success"]:
+            collect_run_stats(exp["name"], exp["args"])
         results.append(res)
 
     # ------------------------------------------------------------------
@@ -294,7 +257,9 @@ def main():
         print(f"{r['name']:30s}  {status:4s}  {r['seconds']:.2f} s  {r['error']}")
 
     print(f"\nTiming CSV written to: {TIMINGS_CSV.resolve()}")
-    print("Next step: run  python compare_results_to_csv.py  to compute metrics.\n")
+    print(f"Run statistics collected in: {RUNS_DIR.resolve()}")
+    print("Next step: run  python compare_results_to_csv.py  to compute metrics,")
+    print("           or   python pareto_report.py  for the accuracy-vs-latency report.\n")
 
 
 # ----------------------------------------------------------------------
@@ -0,0 +1,283 @@
+"""
+run_archive.py
+
+Packs the per-frame artifacts of a mmdet3d_inference2.py run (--archive)
+into a few large files instead of 5-8 small files per frame, which is what
+makes NFS and object-store syncs of long runs slow.
+
+An archive is a set of append-only volumes <out_dir>/run_archive.<n>.pack:
+
+  magic 'MMPACK01'
+  record*   header (magic 'PKR1', name / frame / data lengths, SHA-256 of
+            the data), the member name (e.g. '000123_predictions.json'), its
+            frame id, the data
+  index     JSON {'members': [[name, frame, offset, size, sha256], ...]}
+  footer    index offset, index length, magic 'PKINDEX1'
+
+Volumes are never modified after they are closed: a volume is closed
+(index and footer written) when it reaches --archive-volume-mb or at the
+end of the run, and a later run or --resume starts a new volume. When a
+name occurs in several volumes, the newest volume wins. A volume without a
+footer (interrupted run) is recovered by scanning its record headers.
+
+RunArchive gives random access to members by name or by frame id and
+artifact type (the file suffix, e.g. '_bev.png'). read_artifact(path)
+reads whichever is newer of the file on disk and the member of that name
+in the archive of its directory, so loose files left by an earlier plain
+run into the same out_dir do not shadow a later --archive run (and vice
+versa). This is how compare_results.py, make_demo_video.py and
+scripts/open3d_save_view.py find archived artifacts.
+"""
+
+import os
+import re
+import json
+import struct
+import hashlib
+import threading
+
+ARCHIVE_PATTERN = re.compile(r'^run_archive\.(\d+)\.pack$')
+FILE_MAGIC = b'MMPACK01'
+RECORD_MAGIC = b'PKR1'
+INDEX_MAGIC = b'PKINDEX1'
+RECORD_HEADER = struct.Struct('<4sHHQ32s')
+FOOTER = struct.Struct('<QQ8s')
+
+
+def archive_volumes(out_dir):
+    """Volume paths of the archive in 'out_dir', oldest first."""
+    if not os.path.isdir(out_dir):
+        return []
+    numbered = []
+    for fname in os.listdir(out_dir):
+        match = ARCHIVE_PATTERN.match(fname)
+        if match:
+            numbered.append((int(match.group(1)), os.path.join(out_dir, fname)))
+    return [path for _, path in sorted(numbered)]
+
+
+def read_volume_index(path):
+    """
+    Returns the members of one volume as {name: (frame, offset, size, sha256)};
+    scans the records when the volume has no valid footer.
+    """
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        file_size = f.tell()
+        if file_size >= len(FILE_MAGIC) + FOOTER.size:
+            f.seek(file_size - FOOTER.size)
+            index_offset, index_len, magic = FOOTER.unpack(f.read(FOOTER.size))
+            if magic == INDEX_MAGIC and index_offset + index_len + FOOTER.size == file_size:
+                f.seek(index_offset)
+                index = json.loads(f.read(index_len).decode('utf-8'))
+                return {name: (frame, offset, size, digest)
+                        for name, frame, offset, size, digest in index['members']}
+        return _scan_records(f, path, file_size)
+
+
+def _scan_records(f, path, file_size):
+    members = {}
+    f.seek(0)
+    if f.read(len(FILE_MAGIC)) != FILE_MAGIC:
+        raise ValueError(f"{path} is not a run archive volume")
+    pos = len(FILE_MAGIC)
+    while pos + RECORD_HEADER.size <= file_size:
+        f.seek(pos)
+        magic, name_len, frame_len, size, digest = RECORD_HEADER.unpack(f.read(RECORD_HEADER.size))
+        data_offset = pos + RECORD_HEADER.size + name_len + frame_len
+        if magic != RECORD_MAGIC or data_offset + size > file_size:
+            break  # index or a record cut short by the interruption
+        name = f.read(name_len).decode('utf-8')
+        frame = f.read(frame_len).decode('utf-8') or None
+        members[name] = (frame, data_offset, size, digest.hex())
+        pos = data_offset + size
+    print(f"[WARN] {path} has no index (interrupted run); recovered {len(members)} member(s) by scanning.")
+    return members
+
+
+class RunArchive:
+    """Random-access reader over all volumes of an archive directory."""
+
+    def __init__(self, out_dir):
+        self.out_dir = out_dir
+        self.volumes = archive_volumes(out_dir)
+        self._members = {}  # name -> (volume index, frame, offset, size, sha256)
+        for vol_idx, path in enumerate(self.volumes):
+            for name, (frame, offset, size, digest) in read_volume_index(path).items():
+                self._members[name] = (vol_idx, frame, offset, size, digest)
+        self._mtimes = [os.path.getmtime(path) for path in self.volumes]
+        self._files = [None] * len(self.volumes)
+        self._locks = [threading.Lock() for _ in self.volumes]
+
+    def __bool__(self):
+        return bool(self._members)
+
+    def __contains__(self, name):
+        return name in self._members
+
+    def names(self):
+        return sorted(self._members)
+
+    def frames(self):
+        """Sorted frame ids with at least one member."""
+        return sorted({m[1] for m in self._members.values() if m[1]})
+
+    def members(self, frame):
+        """Member names of one frame."""
+        return sorted(name for name, m in self._members.items() if m[1] == frame)
+
+    def digest(self, name):
+        """SHA-256 hex digest of a member, or None when it is missing."""
+        member = self._members.get(name)
+        return member[4] if member else None
+
+    def mtime(self, name):
+        """Modification time of the volume holding a member, or None when it is missing."""
+        member = self._members.get(name)
+        return self._mtimes[member[0]] if member else None
+
+    def read(self, name):
+        """Bytes of a member, or None when it is missing."""
+        member = self._members.get(name)
+        if member is None:
+            return None
+        vol_idx, _, offset, size, _ = member
+        with self._locks[vol_idx]:
+            if self._files[vol_idx] is None:
+                self._files[vol_idx] = open(self.volumes[vol_idx], 'rb')
+            f = self._files[vol_idx]
+            f.seek(offset)
+            return f.read(size)
+
+    def read_frame(self, frame, kind):
+        """Bytes of the artifact of type 'kind' (its suffix, e.g. '_bev.png') of a frame."""
+        return self.read(f"{frame}{kind}")
+
+    def close(self):
+        for f in self._files:
+            if f is not None:
+                f.close()
+        self._files = [None] * len(self.volumes)
+
+
+_readers = {}
+_readers_lock = threading.Lock()
+
+
+def open_run_archive(out_dir):
+    """Cached RunArchive of 'out_dir', or None when it has no archive."""
+    key = os.path.abspath(out_dir)
+    with _readers_lock:
+        if key not in _readers:
+            _readers[key] = RunArchive(out_dir) if archive_volumes(out_dir) else None
+        return _readers[key]
+
+
+def archive_holding(path):
+    """
+    The RunArchive to read output file 'path' from: the archive of its
+    directory when it has the member and no newer file exists on disk;
+    otherwise None (read the file, if any).
+    """
+    path = str(path)
+    archive = open_run_archive(os.path.dirname(path) or '.')
+    if archive is None:
+        return None
+    mtime = archive.mtime(os.path.basename(path))
+    if mtime is None:
+        return None
+    if os.path.exists(path) and os.path.getmtime(path) > mtime:
+        return None
+    return archive
+
+
+def read_artifact(path):
+    """Bytes of an output file, from disk or from its directory's archive (newest wins); None if neither has it."""
+    path = str(path)
+    archive = archive_holding(path)
+    if archive is not None:
+        return archive.read(os.path.basename(path))
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            return f.read()
+    return None
+
+
+class ArchiveWriter:
+    """
+    Appends members to a new volume of the archive in 'out_dir'; thread-safe.
+    Members already in the directory's archive (earlier runs / --resume)
+    stay readable through digest() for the run journal.
+    """
+
+    def __init__(self, out_dir, volume_mb=2048):
+        self.out_dir = out_dir
+        self.volume_bytes = int(volume_mb * 2**20)
+        existing = archive_volumes(out_dir)
+        self._next_volume = 1 + max((int(ARCHIVE_PATTERN.match(os.path.basename(p)).group(1))
+                                     for p in existing), default=-1)
+        self._digests = {}
+        self._frame_members = {}  # frame -> names written by this run
+        for path in existing:
+            self._digests.update({name: m[3] for name, m in read_volume_index(path).items()})
+        self._lock = threading.Lock()
+        self._file = None
+        self._index = []
+        self.volumes_written = []
+
+    def _open_volume(self):
+        path = os.path.join(self.out_dir, f"run_archive.{self._next_volume:04d}.pack")
+        self._next_volume += 1
+        self._file = open(path, 'wb')
+        self._file.write(FILE_MAGIC)
+        self._index = []
+        self.volumes_written.append(path)
+
+    def _close_volume(self):
+        index = json.dumps({'members': self._index}).encode('utf-8')
+        index_offset = self._file.tell()
+        self._file.write(index)
+        self._file.write(FOOTER.pack(index_offset, len(index), INDEX_MAGIC))
+        self._file.close()
+        self._file = None
+
+    def add(self, name, data, frame=None, fsync=False):
+        """Appends one member; 'name' may be a path inside out_dir."""
+        if os.path.isabs(str(name)) or os.sep in str(name):
+            name = os.path.relpath(str(name), self.out_dir).replace(os.sep, '/')
+        name_bytes = name.encode('utf-8')
+        frame_bytes = (frame or '').encode('utf-8')
+        digest = hashlib.sha256(data).digest()
+        with self._lock:
+            if self._file is not None and self._file.tell() + len(data) > self.volume_bytes and self._index:
+                self._close_volume()
+            if self._file is None:
+                self._open_volume()
+            self._file.write(RECORD_HEADER.pack(RECORD_MAGIC, len(name_bytes), len(frame_bytes), len(data), digest))
+            self._file.write(name_bytes + frame_bytes)
+            offset = self._file.tell()
+            self._file.write(data)
+            if fsync:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            self._index.append([name, frame, offset, len(data), digest.hex()])
+            self._digests[name] = digest.hex()
+            if frame is not None:
+                self._frame_members.setdefault(frame, set()).add(name)
+
+    def digest(self, name):
+        """SHA-256 hex digest of a member written now or by an earlier run."""
+        return self._digests.get(name)
+
+    def members(self, frame):
+        """{name: sha256} of the members this run wrote for a frame."""
+        with self._lock:
+            return {name: self._digests[name] for name in sorted(self._frame_members.get(frame, ()))}
+
+    def close(self):
+        """Writes the index of the open volume; the archive is then complete."""
+        with self._lock:
+            if self._file is not None:
+                self._close_volume()
+        with _readers_lock:
+            _readers.pop(os.path.abspath(self.out_dir), None)
@@ -0,0 +1,56 @@
+"""
+run_frames.py
+
+Lists the frames of a mmdet3d_inference2.py output directory for the offline
+tools (scripts/open3d_save_view.py, make_demo_video.py), either from the
+files in the directory or from a manifest: the run's run_journal.jsonl, a
+JSON list or a text file with one basename per line. Frames packed into a
+run archive (--archive) are listed too.
+"""
+
+import os
+import json
+
+from ply_io import POINTS_SUFFIX, POINTS_GZ_SUFFIX, POINTS_REF_SUFFIX
+from run_archive import open_run_archive
+
+FRAME_KEY_SUFFIXES = ['_predictions.json', POINTS_SUFFIX, POINTS_GZ_SUFFIX, POINTS_REF_SUFFIX,
+                      '_2d_vis.png', '_bev.png']
+
+
+def read_manifest(manifest):
+    """Basenames listed in a manifest, in order and without duplicates."""
+    with open(manifest, 'r') as f:
+        text = f.read()
+    try:
+        loaded = json.loads(text)
+        items = loaded if isinstance(loaded, list) else [loaded]
+    except json.JSONDecodeError:
+        items = text.splitlines()
+
+    names = []
+    for item in items:
+        if isinstance(item, str):
+            item = item.strip()
+            if item.startswith('{'):
+                try:
+                    item = json.loads(item)
+                except json.JSONDecodeError:
+                    continue  # truncated last journal line
+        name = item.get('frame') if isinstance(item, dict) else item
+        if name and name not in names:
+            names.append(name)
+    return names
+
+
+def list_frames(directory, manifest=None):
+    """Sorted basenames with outputs in 'directory', or the manifest's frames."""
+    if manifest:
+        return read_manifest(manifest)
+    archive = open_run_archive(directory)
+    names = set(archive.frames()) if archive else set()
+    for fname in os.listdir(directory):
+        for suffix in FRAME_KEY_SUFFIXES:
+            if fname.endswith(suffix):
+                names.add(fname[:-len(suffix)])
+    return sorted(names)
@@ -1,52 +1,205 @@
-import open3d as o3d
-import os
-import argparse
-
 """
 Reliable screenshot script for Windows.
 Loads *.ply files and saves PNG using an ABSOLUTE path.
+The points may be in any --ply-format of mmdet3d_inference2.py (float32 /
+int16 / gzipped PLY or a reference to the source .bin), and runs written
+with --archive are read from their pack volumes.
+
+Single frame:
+  python scripts/open3d_save_view.py --dir outputs/kitti_pointpillars --basename 000123 --save-path shot.png
+
+Batch: without --basename every frame of --dir (or of a --manifest such as
+<out-dir>/run_journal.jsonl) is rendered with one hidden window that is kept
+alive; only the geometry is swapped per frame. --camera applies a saved
+viewpoint (Open3D pinhole JSON from --save-camera or the 'P' key, or the view
+status JSON copied with Ctrl+C in an Open3D window) to every frame:
+  python scripts/open3d_save_view.py --dir outputs/kitti_pointpillars --save-dir results/screenshots/seq \
+      --camera results/camera.json
 """
 
-def load_if_exists(path):
-    if os.path.exists(path):
-        return o3d.io.read_point_cloud(path) if path.endswith(".ply") else None
-    return None
+import open3d as o3d
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ply_io import read_points_artifact, read_points_lods
+from run_archive import archive_holding
+from run_frames import list_frames
+
+def load_points(directory, basename, max_lod=None):
+    loaded = read_points_lods(directory, basename, max_lod) if max_lod is not None else None
+    if loaded is None:
+        loaded = read_points_artifact(directory, basename)
+    if loaded is None:
+        return None
+    xyz, colors = loaded
+    pcd = o3d.geometry.PointCloud()
+    pcd.points = o3d.utility.Vector3dVector(xyz.astype("float64"))
+    if colors is not None:
+        pcd.colors = o3d.utility.Vector3dVector(colors / 255.0)
+    return pcd
+
+def load_geometry(path, reader):
+    """Reads a PLY file, or the newer archive member of that name, with an Open3D reader."""
+    archive = archive_holding(path)
+    if archive is None:
+        return reader(path) if os.path.exists(path) else None
+    data = archive.read(os.path.basename(path))
+    # The Open3D readers only take paths: go through a temporary file
+    fd, tmp_path = tempfile.mkstemp(suffix=".ply")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        return reader(tmp_path)
+    finally:
+        os.remove(tmp_path)
+
+def load_line_set(path):
+    return load_geometry(path, o3d.io.read_line_set)
+
+def load_frame(directory, basename, max_lod=None):
+    """Geometries of one frame by role; missing files give None."""
+    base = os.path.join(directory, basename)
+    axes = load_geometry(base + "_axes.ply", o3d.io.read_triangle_mesh)
+    if axes is None:
+        # Newer runs write the axes once per run
+        axes = load_geometry(os.path.join(directory, "axes.ply"), o3d.io.read_triangle_mesh)
+    return {
+        "points": load_points(directory, basename, max_lod),
+        "axes": axes,
+        "pred": load_line_set(base + "_pred_bboxes.ply"),
+        "gt": load_line_set(base + "_gt_bboxes.ply"),
+        "labels": load_line_set(base + "_pred_labels.ply"),
+    }
+
+def apply_camera(vis, camera_path):
+    with open(camera_path, "r") as f:
+        camera = json.load(f)
+    ctr = vis.get_view_control()
+    if "trajectory" in camera:
+        # View status copied from an Open3D window (Ctrl+C)
+        view = camera["trajectory"][0]
+        ctr.set_front(view["front"])
+        ctr.set_lookat(view["lookat"])
+        ctr.set_up(view["up"])
+        ctr.set_zoom(view["zoom"])
+    else:
+        params = o3d.io.read_pinhole_camera_parameters(camera_path)
+        ctr.convert_from_pinhole_camera_parameters(params, allow_arbitrary=True)
+
+def copy_geometry(target, source):
+    """Moves the buffers of 'source' into the long-lived 'target' geometry."""
+    if isinstance(target, o3d.geometry.PointCloud):
+        target.points, target.colors = source.points, source.colors
+    elif isinstance(target, o3d.geometry.LineSet):
+        target.points, target.lines, target.colors = source.points, source.lines, source.colors
+    else:
+        target.vertices, target.triangles = source.vertices, source.triangles
+        target.vertex_colors, target.vertex_normals = source.vertex_colors, source.vertex_normals
+
+
+class FrameRenderer:
+    """One hidden Open3D window reused for many frames; geometry is swapped in place."""
+
+    def __init__(self, width, height, camera=None):
+        self.vis = o3d.visualization.Visualizer()
+        self.vis.create_window(width=width, height=height, visible=False)
+        self.camera = camera
+        self.geometries = {
+            "points": o3d.geometry.PointCloud(),
+            "axes": o3d.geometry.TriangleMesh(),
+            "pred": o3d.geometry.LineSet(),
+            "gt": o3d.geometry.LineSet(),
+            "labels": o3d.geometry.LineSet(),
+        }
+        self.added = set()
+        self.view_set = False
+
+    def render(self, frame, save_path):
+        for role, target in self.geometries.items():
+            source = frame.get(role)
+            if source is None or source.is_empty():
+                if role in self.added:
+                    self.vis.remove_geometry(target, reset_bounding_box=False)
+                    self.added.discard(role)
+                continue
+            copy_geometry(target, source)
+            if role in self.added:
+                self.vis.update_geometry(target)
+            else:
+                # Only the first frame fits the view to the scene; later frames keep it
+                self.vis.add_geometry(target, reset_bounding_box=not self.view_set)
+                self.added.add(role)
+        if not self.view_set and self.added:
+            if self.camera:
+                apply_camera(self.vis, self.camera)
+            self.view_set = True
+        self.vis.poll_events()
+        self.vis.update_renderer()
+        self.vis.capture_screen_image(save_path, do_render=True)
+
+    def save_camera(self, path):
+        params = self.vis.get_view_control().convert_to_pinhole_camera_parameters()
+        o3d.io.write_pinhole_camera_parameters(path, params)
+
+    def close(self):
+        self.vis.destroy_window()
+
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--dir", type=str, required=True)
-    parser.add_argument("--basename", type=str, required=True)
+    parser.add_argument("--basename", type=str, default=None,
+                        help="Single frame; omit to render every frame of --dir / --manifest")
+    parser.add_argument("--manifest", type=str, default=None,
+                        help="Frames to render: run_journal.jsonl, a JSON list or a text file of basenames")
     parser.add_argument("--width", type=int, default=1600)
     parser.add_argument("--height", type=int, default=1200)
-    parser.add_argument("--save-path", type=str, required=True)
+    parser.add_argument("--save-path", type=str, default=None, help="PNG path in single-frame mode")
+    parser.add_argument("--save-dir", type=str, default=None,
+                        help="Batch output folder for <basename>_open3d.png (default: --dir)")
+    parser.add_argument("--camera", type=str, default=None, help="Viewpoint JSON applied to every frame")
+    parser.add_argument("--save-camera", type=str, default=None,
+                        help="Write the viewpoint used (pinhole JSON) for reuse with --camera")
+    parser.add_argument("--max-lod", type=int, default=None,
+                        help="Render LOD levels 0..N (_points_lod<i>.ply) instead of _points.ply when present")
     args = parser.parse_args()
 
-    base = os.path.join(args.dir, args.basename)
-
-    pcd = load_if_exists(base + "_points.ply")
-    axes = load_if_exists(base + "_axes.ply")
-    bbox = load_if_exists(base + "_pred_bboxes.ply")
-
-    geometries = []
-    if pcd: geometries.append(pcd)
-    if axes: geometries.append(axes)
-    if bbox: geometries.append(bbox)
-
-    vis = o3d.visualization.Visualizer()
-    vis.create_window(width=args.width, height=args.height, visible=False)
-    for g in geometries:
-        vis.add_geometry(g)
-    vis.poll_events()
-    vis.update_renderer()
+    if args.basename:
+        if not args.save_path:
+            parser.error("--save-path is required with --basename")
+        # Convert save-path to ABSOLUTE
+        jobs = [(args.basename, os.path.abspath(args.save_path))]
+    else:
+        save_dir = os.path.abspath(args.save_dir or args.dir)
+        jobs = [(name, os.path.join(save_dir, f"{name}_open3d.png"))
+                for name in list_frames(args.dir, args.manifest)]
+        if not jobs:
+            print("[WARN] No frames found in", args.manifest or args.dir)
+            return
+    for _, save_path in jobs:
+        os.makedirs(os.path.dirname(save_path), exist_ok=True)
 
-    # Convert save-path to ABSOLUTE
-    save_abs_path = os.path.abspath(args.save_path)
-    os.makedirs(os.path.dirname(save_abs_path), exist_ok=True)
+    start = time.perf_counter()
+    renderer = FrameRenderer(args.width, args.height, camera=args.camera)
+    setup_time = time.perf_counter() - start
+    for i, (name, save_path) in enumerate(jobs):
+        frame_start = time.perf_counter()
+        renderer.render(load_frame(args.dir, name, args.max_lod), save_path)
+        print(f"[INFO] [{i + 1}/{len(jobs)}] {name} -> {save_path} "
+              f"({(time.perf_counter() - frame_start) * 1000:.0f} ms)")
+    if args.save_camera:
+        renderer.save_camera(args.save_camera)
+        print("[INFO] Camera saved to:", args.save_camera)
+    renderer.close()
 
-    print("[INFO] Saving screenshot to:", save_abs_path)
-    vis.capture_screen_image(save_abs_path)
-    vis.destroy_window()
-    print("[INFO] Screenshot saved successfully.")
+    total = time.perf_counter() - start
+    print(f"[INFO] {len(jobs)} screenshot(s) in {total:.2f} s "
+          f"(window setup {setup_time * 1000:.0f} ms, {(total - setup_time) / len(jobs) * 1000:.0f} ms/frame)")
 
 if __name__ == "__main__":
     main()
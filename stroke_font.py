@@ -0,0 +1,127 @@
+"""
+stroke_font.py
+
+The vector font of the 3D text labels (create_text_stroke_label and
+create_text_stroke_labels in mmdet3d_inference2.py), as NumPy tables built
+once at import. layout_text() places every character of every label of a
+frame in one vectorized pass; nothing here depends on Open3D.
+
+Glyphs are line segments in a 1 x 1 box on the XY plane; lowercase text is
+drawn in uppercase and unknown characters advance the cursor like a space.
+"""
+
+import numpy as np
+
+GLYPH_SPACING = 0.25  # gap between glyphs, in glyph widths
+
+# Each glyph is a list of line segments ((x1, y1), (x2, y2))
+GLYPHS = {
+    'A': [((0,0), (0.5,1)), ((1,0), (0.5,1)), ((0.25,0.5), (0.75,0.5))],
+    'B': [((0,0), (0,1)), ((0,1), (0.6,1)), ((0.6,1),(0.6,0.5)), ((0.6,0.5),(0,0.5)),
+          ((0,0.5),(0.6,0)), ((0.6,0),(0,0))],
+    'C': [((1,0),(0,0)), ((0,0),(0,1)), ((0,1),(1,1))],
+    'D': [((0,0),(0,1)), ((0,1),(0.7,0.85)), ((0.7,0.85),(0.7,0.15)), ((0.7,0.15),(0,0))],
+    'E': [((1,1),(0,1)), ((0,1),(0,0)), ((0,0),(1,0)), ((0,0.5),(0.6,0.5))],
+    'F': [((1,1),(0,1)), ((0,1),(0,0)), ((0,0.5),(0.6,0.5))],
+    'G': [((1,1),(0,1)), ((0,1),(0,0)), ((0,0),(1,0)), ((1,0),(1,0.5)), ((1,0.5),(0.5,0.5))],
+    'H': [((0,0),(0,1)), ((1,0),(1,1)), ((0,0.5),(1,0.5))],
+    'I': [((0.5,0),(0.5,1))],
+    'J': [((1,1),(1,0)), ((1,0),(0,0)), ((0,0),(0,0.3))],
+    'K': [((0,0),(0,1)), ((1,1),(0,0.5)), ((0,0.5),(1,0))],
+    'L': [((0,1),(0,0)), ((0,0),(1,0))],
+    'M': [((0,0),(0,1)), ((0,1),(0.5,0.5)), ((0.5,0.5),(1,1)), ((1,1),(1,0))],
+    'N': [((0,0),(0,1)), ((0,1),(1,0)), ((1,0),(1,1))],
+    'O': [((0,0),(1,0)), ((1,0),(1,1)), ((1,1),(0,1)), ((0,1),(0,0))],
+    'P': [((0,0),(0,1)), ((0,1),(0.7,1)), ((0.7,1),(0.7,0.6)), ((0.7,0.6),(0,0.6))],
+    'Q': [((0,0),(1,0)), ((1,0),(1,1)), ((1,1),(0,1)), ((0,1),(0,0)), ((0.6,0.4),(1.1,-0.1))],
+    'R': [((0,0),(0,1)), ((0,1),(0.7,1)), ((0.7,1),(0.7,0.6)), ((0.7,0.6),(0,0.6)),
+          ((0,0.6),(0.9,0)),],
+    'S': [((1,1),(0.2,1)), ((0.2,1),(0,0.8)), ((0,0.8),(0.8,0.6)), ((0.8,0.6),(1,0.4)),
+          ((1,0.4),(0.2,0.2)), ((0.2,0.2),(0,0))],
+    'T': [((0,1),(1,1)), ((0.5,1),(0.5,0))],
+    'U': [((0,1),(0,0.2)), ((0,0.2),(1,0.2)), ((1,0.2),(1,1))],
+    'V': [((0,1),(0.5,0)), ((0.5,0),(1,1))],
+    'W': [((0,1),(0.25,0)), ((0.25,0),(0.5,0.5)), ((0.5,0.5),(0.75,0)), ((0.75,0),(1,1))],
+    'X': [((0,0),(1,1)), ((1,0),(0,1))],
+    'Y': [((0,1),(0.5,0.5)), ((1,1),(0.5,0.5)), ((0.5,0.5),(0.5,0))],
+    'Z': [((0,1),(1,1)), ((1,1),(0,0)), ((0,0),(1,0))],
+    '0': [((0,0),(1,0)), ((1,0),(1,1)), ((1,1),(0,1)), ((0,1),(0,0)), ((0,0),(1,1))],
+    '1': [((0.5,0),(0.5,1)), ((0.3,0.2),(0.5,0))],
+    '2': [((0,1),(1,1)), ((1,1),(0,0.5)), ((0,0.5),(1,0)), ((1,0),(0,0))],
+    '3': [((0,1),(1,1)), ((1,1),(0.2,0.6)), ((0.2,0.6),(1,0.3)), ((1,0.3),(0,0))],
+    '4': [((0,1),(0,0.4)), ((1,1),(0,0.4)), ((1,1),(1,0))],
+    '5': [((1,1),(0,1)), ((0,1),(0,0.6)), ((0,0.6),(1,0.6)), ((1,0.6),(1,0)), ((1,0),(0,0))],
+    '6': [((1,1),(0,1)), ((0,1),(0,0)), ((0,0),(1,0)), ((1,0),(1,0.6)), ((1,0.6),(0,0.6))],
+    '7': [((0,1),(1,1)), ((1,1),(0,0))],
+    '8': [((0,0),(1,0)), ((1,0),(1,1)), ((1,1),(0,1)), ((0,1),(0,0)), ((0,0.5),(1,0.5))],
+    '9': [((1,0),(1,1)), ((1,1),(0,1)), ((0,1),(0,0.5)), ((0,0.5),(1,0.5))],
+    '-': [((0,0.5),(1,0.5))],
+    '_': [((0,0),(1,0))],
+    '.': [((0.4,0),(0.6,0)), ((0.6,0),(0.6,0.15)), ((0.6,0.15),(0.4,0.15)), ((0.4,0.15),(0.4,0))],
+    ':': [((0.45,0.2),(0.55,0.2)), ((0.45,0.7),(0.55,0.7))],
+    '%': [((0,0),(1,1)), ((0,1),(0.2,1)), ((0.2,1),(0.2,0.8)), ((0.8,0.2),(1,0.2)), ((1,0.2),(1,0))],
+    ' ': [],
+}
+
+
+def _build_tables():
+    """Packs GLYPHS into one segment array indexed through per-code offset / count tables."""
+    starts = np.zeros(128, dtype=np.int64)
+    counts = np.zeros(128, dtype=np.int64)
+    parts = []
+    offset = 0
+    for ch, glyph in GLYPHS.items():
+        code = ord(ch)
+        starts[code], counts[code] = offset, len(glyph)
+        if glyph:
+            parts.append(np.asarray(glyph, dtype=np.float64))
+        offset += len(glyph)
+    return np.concatenate(parts), starts, counts
+
+
+_GLYPH_SEGMENTS, _GLYPH_START, _GLYPH_COUNT = _build_tables()
+
+
+def encode_texts(texts):
+    """
+    Character codes of all 'texts' back to back, plus the label index and
+    the position within its label of every character.
+    """
+    texts = [str(t or '').upper() for t in texts]
+    # Non-ASCII characters become '?', which has no glyph
+    codes = np.frombuffer(''.join(texts).encode('ascii', errors='replace'), dtype=np.uint8).astype(np.int64)
+    lengths = np.array([len(t) for t in texts], dtype=np.int64)
+    label_idx = np.repeat(np.arange(len(texts)), lengths)
+    char_pos = np.arange(codes.size) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return codes, label_idx, char_pos
+
+
+def layout_text(texts, positions, scale=0.4):
+    """
+    Lays out many labels at once, each starting at its (x, y, z) position.
+
+    Returns:
+        points: (2S, 3) float64 segment end points
+        lines: (S, 2) int32 point indices, one row per segment
+        label_of_line: (S,) index of the label each segment belongs to
+    """
+    positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+    codes, label_idx, char_pos = encode_texts(texts)
+
+    # One row per drawn segment: which table entry, which character slot, which label
+    counts = _GLYPH_COUNT[codes]
+    num_segments = int(counts.sum())
+    first = np.cumsum(counts) - counts
+    seg_in_char = np.arange(num_segments) - np.repeat(first, counts)
+    seg_idx = np.repeat(_GLYPH_START[codes], counts) + seg_in_char
+    seg_label = np.repeat(label_idx, counts)
+    seg_cursor = np.repeat(char_pos, counts) * (1.0 + GLYPH_SPACING)
+
+    ends = _GLYPH_SEGMENTS[seg_idx]  # (S, 2, 2)
+    points = np.zeros((num_segments, 2, 3), dtype=np.float64)
+    points[:, :, 0] = (ends[:, :, 0] + seg_cursor[:, None]) * scale
+    points[:, :, 1] = ends[:, :, 1] * scale
+    points += positions[seg_label][:, None, :]
+
+    lines = np.arange(2 * num_segments, dtype=np.int32).reshape(-1, 2)
+    return points.reshape(-1, 3), lines, seg_label
@@ -0,0 +1,268 @@
+"""
+voxelizer.py
+
+CPU hard voxelization / pillarization for the voxel-based configs
+(PointPillars: max_num_points=32, max_voxels=(16000, 40000)), as a
+replacement for mmcv's generic Voxelization op:
+
+  numpy   point_ops.hard_voxelize: sort by voxel key, cumulative counts,
+          first-K truncation, fully vectorized
+  numba   a single-pass JIT kernel over a reusable dense voxel-index grid
+          (the mmcv CPU algorithm), used when numba is installed and the grid
+          is small enough (pillar grids are); otherwise falls back to numpy
+
+Both match mmcv's output exactly: voxels in order of first appearance, the
+first max_voxels voxels and the first max_num_points points of each.
+
+install_voxelizer() swaps the model's data_preprocessor.voxel_layer so the
+eager mmdet3d pipeline uses it; ExportedInferencer (dense_export.py) takes a
+Voxelizer directly.
+
+Benchmark against mmcv:
+  python voxelizer.py --config checkpoints/kitti_pointpillars/pointpillars_hv_secfpn_8xb6-160e_kitti-3d-car.py \
+      --inputs data/kitti/training/velodyne --iterations 20
+"""
+
+import os
+import ast
+import glob
+import time
+import argparse
+
+import numpy as np
+
+from point_ops import hard_voxelize
+
+try:
+    import torch
+except ImportError:
+    torch = None  # the NumPy / Numba paths and their benchmark work without PyTorch
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+VOXELIZERS = ('mmcv', 'numpy', 'numba')
+
+# Dense voxel-index grids above this many cells are not worth allocating
+MAX_NUMBA_GRID_CELLS = 2**25
+
+
+def read_voxel_layer_cfg(config_path):
+    """
+    Reads model.data_preprocessor.voxel_layer from an mmdet3d config file
+    without mmengine (test-time max_voxels).
+    """
+    with open(config_path, 'r') as f:
+        tree = ast.parse(f.read())
+    for node in ast.walk(tree):
+        if isinstance(node, ast.keyword) and node.arg == 'voxel_layer' and isinstance(node.value, ast.Call):
+            layer = {kw.arg: ast.literal_eval(kw.value) for kw in node.value.keywords}
+            max_voxels = layer.get('max_voxels', 20000)
+            if isinstance(max_voxels, (list, tuple)):
+                max_voxels = max_voxels[1]
+            return {
+                'voxel_size': [float(v) for v in layer['voxel_size']],
+                'point_cloud_range': [float(v) for v in layer['point_cloud_range']],
+                'max_num_points': int(layer['max_num_points']),
+                'max_voxels': int(max_voxels),
+            }
+    raise ValueError(f"No voxel_layer found in {config_path}")
+
+
+if numba is not None:
+    @numba.njit(cache=True, nogil=True)
+    def _voxelize_kernel(points, voxel_size, range_min, grid, max_num_points, max_voxels,
+                         voxel_index, voxels, coors, num_points):
+        num_voxels = 0
+        for i in range(points.shape[0]):
+            cx = int(np.floor((points[i, 0] - range_min[0]) / voxel_size[0]))
+            cy = int(np.floor((points[i, 1] - range_min[1]) / voxel_size[1]))
+            cz = int(np.floor((points[i, 2] - range_min[2]) / voxel_size[2]))
+            if cx < 0 or cy < 0 or cz < 0 or cx >= grid[0] or cy >= grid[1] or cz >= grid[2]:
+                continue
+            idx = voxel_index[cz, cy, cx]
+            if idx == -1:
+                if num_voxels >= max_voxels:
+                    continue
+                idx = num_voxels
+                voxel_index[cz, cy, cx] = idx
+                coors[idx, 0], coors[idx, 1], coors[idx, 2] = cz, cy, cx
+                num_voxels += 1
+            k = num_points[idx]
+            if k < max_num_points:
+                voxels[idx, k] = points[i]
+                num_points[idx] = k + 1
+        # Leave the grid clean for the next frame
+        for v in range(num_voxels):
+            voxel_index[coors[v, 0], coors[v, 1], coors[v, 2]] = -1
+        return num_voxels
+
+
+class Voxelizer:
+    """
+    Callable hard voxelizer for one voxel_layer config:
+    points (N, C) -> voxels (V, K, C), coors (V, 3) zyx, num_points (V,).
+    """
+
+    def __init__(self, voxel_cfg, backend='numpy'):
+        self.cfg = dict(voxel_cfg)
+        self.voxel_size = np.asarray(self.cfg['voxel_size'], dtype=np.float32)
+        self.range_min = np.asarray(self.cfg['point_cloud_range'][:3], dtype=np.float32)
+        range_max = np.asarray(self.cfg['point_cloud_range'][3:], dtype=np.float32)
+        self.grid = np.round((range_max - self.range_min) / self.voxel_size).astype(np.int64)
+
+        self.backend = backend
+        self._voxel_index = None
+        if backend == 'numba':
+            if numba is None:
+                print("  > Warning: numba is not installed; using the NumPy voxelizer.")
+                self.backend = 'numpy'
+            elif int(np.prod(self.grid)) > MAX_NUMBA_GRID_CELLS:
+                print(f"  > Warning: Voxel grid {tuple(self.grid)} is too large for the numba kernel; "
+                      f"using the NumPy voxelizer.")
+                self.backend = 'numpy'
+            else:
+                self._voxel_index = np.full(self.grid[::-1], -1, dtype=np.int32)
+
+    def __call__(self, points):
+        if self.backend == 'numpy':
+            return hard_voxelize(points, **self.cfg)
+
+        points = np.ascontiguousarray(points, dtype=np.float32)
+        max_voxels, max_num_points = self.cfg['max_voxels'], self.cfg['max_num_points']
+        voxels = np.zeros((max_voxels, max_num_points, points.shape[1]), dtype=np.float32)
+        coors = np.zeros((max_voxels, 3), dtype=np.int32)
+        num_points = np.zeros((max_voxels,), dtype=np.int32)
+        num_voxels = _voxelize_kernel(points, self.voxel_size, self.range_min, self.grid,
+                                      max_num_points, max_voxels, self._voxel_index,
+                                      voxels, coors, num_points)
+        return voxels[:num_voxels], coors[:num_voxels], num_points[:num_voxels]
+
+
+if torch is not None:
+    class NumpyVoxelLayer(torch.nn.Module):
+        """Stand-in for mmcv's Voxelization module running a Voxelizer on CPU."""
+
+        def __init__(self, voxelizer):
+            super().__init__()
+            self.voxelizer = voxelizer
+            self.voxel_size = voxelizer.cfg['voxel_size']
+            self.point_cloud_range = voxelizer.cfg['point_cloud_range']
+            self.max_num_points = voxelizer.cfg['max_num_points']
+
+        def forward(self, points):
+            voxels, coors, num_points = self.voxelizer(points.detach().cpu().numpy())
+            return (torch.from_numpy(voxels).to(points.device), torch.from_numpy(coors).to(points.device),
+                    torch.from_numpy(num_points).to(points.device))
+
+
+def install_voxelizer(inferencer, backend):
+    """
+    Replaces inferencer.model.data_preprocessor.voxel_layer with a NumPy /
+    Numba voxelizer. Returns the Voxelizer, or None when the model does not
+    use hard voxelization.
+    """
+    from point_ops import get_voxel_layer_cfg
+
+    voxel_cfg = get_voxel_layer_cfg(inferencer.cfg)
+    preprocessor = getattr(inferencer.model, 'data_preprocessor', None)
+    if voxel_cfg is None or getattr(preprocessor, 'voxel_type', 'hard') != 'hard' \
+            or getattr(preprocessor, 'voxel_layer', None) is None:
+        print(f"  > Warning: Model does not use hard voxelization; --voxelizer {backend} ignored.")
+        return None
+    voxelizer = Voxelizer(voxel_cfg, backend)
+    preprocessor.voxel_layer = NumpyVoxelLayer(voxelizer)
+    print(f"Using the {voxelizer.backend} voxelizer (max_num_points={voxel_cfg['max_num_points']}, "
+          f"max_voxels={voxel_cfg['max_voxels']}).")
+    return voxelizer
+
+
+# --------------------------------------------------------------------
+# Benchmark
+# --------------------------------------------------------------------
+
+def _mmcv_voxelizer(voxel_cfg):
+    from mmcv.ops import Voxelization
+
+    layer = Voxelization(voxel_cfg['voxel_size'], voxel_cfg['point_cloud_range'],
+                         voxel_cfg['max_num_points'], max_voxels=voxel_cfg['max_voxels']).eval()
+
+    def run(points):
+        voxels, coors, num_points = layer(torch.from_numpy(np.ascontiguousarray(points)))
+        return voxels.numpy(), coors.numpy(), num_points.numpy()
+    return run
+
+
+def benchmark(voxel_cfg, frames, backends=VOXELIZERS, iterations=10):
+    """
+    Times each backend over 'frames' (list of (N, C) arrays) and checks its
+    output against the NumPy voxelizer.
+
+    Returns:
+        {backend: {'ms_per_frame', 'matches_numpy'}}; backends that cannot
+        run here are skipped with a warning.
+    """
+    runners = {}
+    for backend in backends:
+        if backend == 'mmcv':
+            try:
+                runners[backend] = _mmcv_voxelizer(voxel_cfg)
+            except ImportError as e:
+                print(f"[WARN] mmcv voxelizer unavailable ({e})")
+        elif backend == 'numba' and numba is None:
+            print("[WARN] numba is not installed, skipping")
+        else:
+            runners[backend] = Voxelizer(voxel_cfg, backend)
+
+    reference = [hard_voxelize(points, **voxel_cfg) for points in frames]
+    results = {}
+    for backend, run in runners.items():
+        outputs = [run(points) for points in frames]  # warm-up (and numba compilation)
+        matches = all(all(np.array_equal(a, b) for a, b in zip(out, ref))
+                      for out, ref in zip(outputs, reference))
+        timings = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            for points in frames:
+                run(points)
+            timings.append((time.perf_counter() - start) / len(frames))
+        results[backend] = {'ms_per_frame': float(np.median(timings)) * 1000.0, 'matches_numpy': matches}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark NumPy/Numba hard voxelization against mmcv")
+    parser.add_argument("--config", type=str, required=True, help="mmdet3d config with a voxel_layer")
+    parser.add_argument("--inputs", type=str, nargs="+", required=True,
+                        help=".bin files or directories of .bin files")
+    parser.add_argument("--load-dim", type=int, default=4)
+    parser.add_argument("--max-frames", type=int, default=20)
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--backends", type=str, nargs="+", default=list(VOXELIZERS), choices=VOXELIZERS)
+    args = parser.parse_args()
+
+    voxel_cfg = read_voxel_layer_cfg(args.config)
+    files = []
+    for path in args.inputs:
+        files.extend(sorted(glob.glob(os.path.join(path, '*.bin'))) if os.path.isdir(path) else [path])
+    files = files[:args.max_frames]
+    if not files:
+        print("[WARN] No .bin inputs found")
+        return
+    # Memory-mapped, as in mmdet3d_inference2.py
+    frames = [np.memmap(f, dtype=np.float32, mode='r').reshape(-1, args.load_dim) for f in files]
+
+    print(f"[INFO] {len(frames)} frame(s), voxel_layer: {voxel_cfg}\n")
+    results = benchmark(voxel_cfg, frames, args.backends, args.iterations)
+    print("| Voxelizer | ms / frame | Speedup vs mmcv | Matches NumPy |")
+    print("|-----------|-----------:|----------------:|---------------|")
+    base = results.get('mmcv', {}).get('ms_per_frame')
+    for backend, r in results.items():
+        speedup = f"{base / r['ms_per_frame']:.2f}x" if base else "-"
+        print(f"| {backend} | {r['ms_per_frame']:.2f} | {speedup} | {'yes' if r['matches_numpy'] else 'NO'} |")
+
+
+if __name__ == "__main__":
+    main()